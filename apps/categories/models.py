@@ -1,8 +1,12 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.template.defaultfilters import slugify
 
 from treebeard.mp_tree import MP_Node
 
+from apps.utilities.cache.tags import get_tag, invalidate_tags, invalidate_object_tag
+from apps.utilities.jsonl import export
+
 class Category(MP_Node):
     """
         @summary: need to add docs
@@ -42,6 +46,15 @@ class Category(MP_Node):
         # save the object
         super(Category, self).save(*args, **kwargs)
 
+    def move(self, target, pos = None):
+        """
+            Moves the category and its descendants in the tree. Treebeard rewrites the paths with an update, which
+            doesn't send post_save, so the pages listing the category are invalidated here. Those for its descendants
+            list it as a parent and are tagged with it too.
+        """
+        super(Category, self).move(target, pos)
+        invalidate_tags([get_tag(Category, self.id)])
+
     
     class Meta:
         """model meta"""
@@ -50,4 +63,9 @@ class Category(MP_Node):
         verbose_name_plural = "Categories"
         
 
-Category._meta.get_field('path').max_length = 1024
\ No newline at end of file
+Category._meta.get_field('path').max_length = 1024
+
+# Content pages list their categories by name, so a rename drops the pages tagged with it.
+post_save.connect(invalidate_object_tag, sender=Category)
+post_delete.connect(invalidate_object_tag, sender=Category)
+export.register(Category)
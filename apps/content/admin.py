@@ -14,8 +14,12 @@ from django.contrib.admin.options import ModelAdmin as default_Model_Admin
 from django.template import RequestContext
 from django.conf import settings
 
+from django.contrib.admin.views.main import ORDER_VAR
+
+from apps.content import search
 from apps.content.models import Article
 from apps.utilities.admin_actions import delete_selected, make_draft, make_public
+from apps.utilities.pagination.estimated_count import EstimatedCountAdminMixin, EstimatedCountChangeList
 
 
 class ArticleAdminForm(forms.ModelForm):
@@ -79,13 +83,29 @@ class ArticleAdminForm(forms.ModelForm):
 
         return self.cleaned_data
     
-class ArticleAdmin(VersionAdmin):
+class ArticleChangeList(EstimatedCountChangeList):
+    """
+        ChangeList which answers the search box from the full-text index, best matches first unless a column has been
+        clicked for sorting, or from the text index, instead of running icontains over search_fields.
+    """
+    def get_query_set(self, request):
+        if not (self.query and search.has_index(self.model)):
+            return super(ArticleChangeList, self).get_query_set(request)
+        query, self.query = self.query, ''
+        try:
+            queryset = super(ArticleChangeList, self).get_query_set(request)
+        finally:
+            self.query = query
+        return search.filter_queryset(queryset, query, ranked = ORDER_VAR not in self.params)
+
+class ArticleAdmin(EstimatedCountAdminMixin, VersionAdmin):
 
     
     form = ArticleAdminForm
 
     # This line is necessary because of Reversion, which defines its own change_list override. Without it, Reversion's version will take precedence.
-    #change_list_template = "admin/content/change_list.html"
+    # The template extends Reversion's and reads the date drilldown from the ContentDateCount histogram.
+    change_list_template = "admin/content/article/change_list.html"
     
     list_display = ('title', 'status', 'publish_at', 'updated_at', 'show_authors_in_admin')
     prepopulated_fields = {"slug": ("title",),}
@@ -111,6 +131,13 @@ class ArticleAdmin(VersionAdmin):
     )
     
 
+    def get_changelist(self, request, **kwargs):
+        return ArticleChangeList
+
+    def queryset(self, request):
+        # show_authors_in_admin would otherwise query each row's authors.
+        return super(ArticleAdmin, self).queryset(request).prefetch_related('authors')
+
     def change_view(self, request, object_id):
         # check that we've got a valid object_id and raise a 404 if not
         try:
@@ -0,0 +1,255 @@
+"""
+    A read-only JSON API over public content, for apps and partner widgets.
+
+        /api/<model>/<id>/                      One object.
+        /api/<model>/?ids=3,1,2                 Several objects, in the order asked for.
+        /api/<model>/?category=4&since=2013-01-01&until=2013-02-01
+                                                Objects newest first, optionally within a category (and the categories
+                                                under it) and a publish date range, settings.API_PAGE_SIZE at a time.
+                                                The response's next token, passed back as after, fetches the next page.
+
+    Every request takes site, defaulting to the current site, and fields, a comma separated subset of FIELDS. The body
+    is only read when fields asks for it.
+
+    Objects are read as values() rows holding just the columns their fields need, never as model instances. Whole
+    responses are cached gzipped, tagged with the objects and authors in them so edits drop them, for
+    settings.API_CACHE_SECONDS, or settings.API_LIST_CACHE_SECONDS for lists, which new content changes without
+    touching any tag. Gzipped responses go out as they are to clients that accept them.
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime, date
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db.models import Q
+
+from apps.categories.models import Category
+from apps.content.bake import gzip_bytes
+from apps.content.sitemaps import fill_url
+from apps.utilities.bulk.bulk_utils import chunked
+from apps.utilities.cache.tags import get_tag, get_tag_generations, get_tagged, set_tagged
+
+# The content models served, by URL name.
+registered_models = {}
+
+FIELDS = ('id', 'title', 'slug', 'abstract', 'body', 'publish_at', 'updated_at', 'expires_at', 'url', 'categories', 'authors')
+DEFAULT_FIELDS = tuple([field for field in FIELDS if field != 'body'])
+# The columns read for fields that aren't columns themselves.
+FIELD_COLUMNS = {'url': ('id', 'slug', 'publish_at'), 'categories': ('id',), 'authors': ('id',)}
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+class ApiError(Exception):
+    """
+        A request the API can't answer, reported to the client as a 400 with the message.
+    """
+    pass
+
+
+def parse_fields(value):
+    """
+        @type value: string
+        @param value: The fields parameter, or None for DEFAULT_FIELDS.
+
+        @rtype: tuple
+        @return: The fields, in FIELDS order.
+    """
+    if not value:
+        return DEFAULT_FIELDS
+    fields = set(value.split(','))
+    unknown = fields - set(FIELDS)
+    if unknown:
+        raise ApiError("Unknown fields: %s" % ', '.join(sorted(unknown)))
+    return tuple([field for field in FIELDS if field in fields])
+
+def parse_int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError("%s must be a number." % name)
+
+def parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ApiError("%s must be a date, as YYYY-MM-DD." % name)
+
+def encode_cursor(publish_at, pk):
+    return base64.urlsafe_b64encode("%s:%d" % (publish_at.strftime(CURSOR_FORMAT), pk))
+
+def decode_cursor(token):
+    """
+        @rtype: tuple
+        @return: (publish_at, id) of the last object on the previous page.
+    """
+    try:
+        publish_at, pk = base64.urlsafe_b64decode(str(token)).split(':')
+        return datetime.strptime(publish_at, CURSOR_FORMAT), int(pk)
+    except (TypeError, ValueError):
+        raise ApiError("after isn't a valid token.")
+
+def to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+def get_url_format(model, site_id):
+    return "http://%s%s" % (Site.objects.get(pk = site_id).domain.replace('%', '%%'), model.get_url_format())
+
+def get_objects(model, site_id, pk_list, fields):
+    """
+        Reads public objects as dicts of the fields asked for, with one values() query plus one for each relation asked
+        for.
+
+        @type pk_list: list
+        @param pk_list: The objects' pks.
+
+        @type fields: tuple
+        @param fields: The fields, from parse_fields.
+
+        @rtype: tuple
+        @return: (the objects found, by pk; the cache tags for them and their authors)
+    """
+    columns = set(['id'])
+    for field in fields:
+        columns.update(FIELD_COLUMNS.get(field, (field,)))
+    objects = {}
+    for chunk in chunked(list(pk_list)):
+        for row in model.published.for_site(site_id).filter(pk__in = chunk).values(*columns):
+            objects[row['id']] = row
+    tags = [get_tag(model, pk) for pk in objects]
+
+    if 'url' in fields:
+        url_format = get_url_format(model, site_id)
+        for row in objects.values():
+            row['url'] = fill_url(url_format, row['id'], row['slug'], row['publish_at'])
+    if 'categories' in fields:
+        for row in objects.values():
+            row['categories'] = []
+        field = model._meta.get_field('categories')
+        for chunk in chunked(objects.keys()):
+            for pk, category_id in field.rel.through.objects.filter(**{field.m2m_field_name() + '__in': chunk}).values_list(field.m2m_field_name(), field.m2m_reverse_field_name()):
+                objects[pk]['categories'].append(category_id)
+    if 'authors' in fields:
+        for row in objects.values():
+            row['authors'] = []
+        field = model._meta.get_field('authors')
+        user = field.m2m_reverse_field_name()
+        for chunk in chunked(objects.keys()):
+            rows = field.rel.through.objects.filter(**{field.m2m_field_name() + '__in': chunk}).values_list(field.m2m_field_name(), user, user + '__first_name', user + '__last_name', user + '__username')
+            for pk, user_id, first_name, last_name, username in rows:
+                objects[pk]['authors'].append({'id': user_id, 'name': (u"%s %s" % (first_name, last_name)).strip() or username})
+                tags.append(get_tag(User, user_id))
+
+    # Drop the columns that were only read to build other fields.
+    for row in objects.values():
+        for column in set(row) - set(fields):
+            del row[column]
+    return objects, tags
+
+def get_detail(model, site_id, pk, fields):
+    objects, tags = get_objects(model, site_id, [pk], fields)
+    return objects.get(pk), tags
+
+def get_bulk(model, site_id, pk_list, fields):
+    objects, tags = get_objects(model, site_id, pk_list, fields)
+    return {'objects': [objects[pk] for pk in pk_list if pk in objects]}, tags
+
+def get_list(model, site_id, fields, category_id = None, since = None, until = None, after = None, limit = None):
+    """
+        @rtype: tuple
+        @return: ({'objects': the page, newest first, 'next': the token for the next page or None}, cache tags)
+    """
+    queryset = model.published.for_site(site_id)
+    if category_id is not None:
+        paths = list(Category.objects.filter(pk = category_id).values_list('path', flat = True))
+        if not paths:
+            raise ApiError("No such category.")
+        queryset = queryset.filter(categories__path__startswith = paths[0]).distinct()
+    if since is not None:
+        queryset = queryset.filter(publish_at__gte = since)
+    if until is not None:
+        queryset = queryset.filter(publish_at__lt = until)
+    if after is not None:
+        publish_at, pk = after
+        queryset = queryset.filter(Q(publish_at__lt = publish_at) | Q(publish_at = publish_at, id__lt = pk))
+
+    # Only the keys are read in the filtered, sorted query. The fields come from the pk lookup after it.
+    page = list(queryset.order_by('-publish_at', '-id').values_list('id', 'publish_at')[:limit + 1])
+    next_token = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_token = encode_cursor(page[-1][1], page[-1][0])
+    payload, tags = get_bulk(model, site_id, [row[0] for row in page], fields)
+    payload['next'] = next_token
+    return payload, tags
+
+def get_response(model, site_id, pk, params):
+    """
+        Answers an API request from the cache, or builds and caches the answer.
+
+        @type pk: int
+        @param pk: The object's pk for a detail request, or None for bulk and list requests.
+
+        @type params: dict
+        @param params: The query parameters.
+
+        @rtype: tuple
+        @return: (the gzipped JSON, its ETag), or (None, None) if a detail request's object isn't public.
+    """
+    fields = parse_fields(params.get('fields'))
+    if pk is not None:
+        request = ('detail', pk)
+        build = lambda: get_detail(model, site_id, pk, fields)
+        timeout = settings.API_CACHE_SECONDS
+    elif params.get('ids'):
+        pk_list = [parse_int(value, 'ids') for value in params['ids'].split(',')]
+        if len(pk_list) > settings.API_MAX_IDS:
+            raise ApiError("At most %d ids can be fetched at once." % settings.API_MAX_IDS)
+        request = ('bulk', tuple(pk_list))
+        build = lambda: get_bulk(model, site_id, pk_list, fields)
+        timeout = settings.API_CACHE_SECONDS
+    else:
+        category_id = params.get('category') and parse_int(params['category'], 'category') or None
+        since = params.get('since') and parse_date(params['since'], 'since') or None
+        until = params.get('until') and parse_date(params['until'], 'until') or None
+        after = params.get('after') and decode_cursor(params['after']) or None
+        limit = params.get('limit') and min(max(parse_int(params['limit'], 'limit'), 1), settings.API_MAX_PAGE_SIZE) or settings.API_PAGE_SIZE
+        request = ('list', category_id, since, until, after, limit)
+        build = lambda: get_list(model, site_id, fields, category_id, since, until, after, limit)
+        timeout = settings.API_LIST_CACHE_SECONDS
+
+    signature = repr((model._meta.object_name, site_id, fields) + request)
+    cache_key = "%s::api::%s::%s" % (settings.GROUP_NAME, hashlib.md5(signature).hexdigest(), settings.GROUP_CACHE_VERSION)
+    cached = get_tagged(cache_key)
+    if cached is not None:
+        return cached
+
+    # The detail and bulk objects' generations are read before the objects, so an edit made meanwhile isn't lost. Lists
+    # and authors are only known afterwards, and rely on their timeouts for that.
+    generations = {}
+    if request[0] == 'detail':
+        generations = get_tag_generations([get_tag(model, pk)])
+    elif request[0] == 'bulk':
+        generations = get_tag_generations([get_tag(model, bulk_pk) for bulk_pk in request[1]])
+    payload, tags = build()
+    generations.update(get_tag_generations(set(tags) - set(generations)))
+
+    if payload is None:
+        response = (None, None)
+    else:
+        data = json.dumps(payload, default = to_json, separators = (',', ':'))
+        response = (gzip_bytes(data), hashlib.md5(data).hexdigest())
+    set_tagged(cache_key, response, generations, timeout)
+    return response
+
+def register(model, name = None):
+    """
+        Serves a content model through the API, as /api/<name>/. The model needs the published manager and
+        get_url_format, as Article has.
+    """
+    registered_models[name or model._meta.object_name.lower()] = model
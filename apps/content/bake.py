@@ -0,0 +1,335 @@
+"""
+    Static publishing of content pages.
+
+    With settings.STATIC_BAKE_ROOT set, each public object's page is rendered as an anonymous visitor to each of its
+    sites would see it and written to <STATIC_BAKE_ROOT>/<site domain><get_absolute_url>index.html, with a gzipped copy
+    beside it, so the web server can serve it without Python. The domain is the site's, without a port, so with nginx,
+    for example:
+
+        location / {
+            root /path/to/bake/root/$host;
+            gzip_static on;
+            try_files $uri/index.html @django;
+        }
+
+    Pages are baked as objects are saved or published, and removed when they are unpublished, moved off a site or
+    deleted. The baking is deferred (see L{apps.utilities.deferred.queue}), so an admin save bakes the page once, after
+    the form has saved the categories, authors and sites too, and after the other deferred work, such as the related
+    lists the page shows. Each baked page's cache tags are kept in BakedTag rows, and invalidating a tag, such as when a
+    category or an author is renamed or a category moves, rebakes the pages showing it. Expiry doesn't save anything, so
+    the bake_content command's --sweep mode removes expired pages, and its default mode rebuilds everything across
+    several processes.
+"""
+import gzip
+import os
+import tempfile
+from cStringIO import StringIO
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.http import Http404
+
+from apps.content.prerender import render_public_page
+from apps.utilities.bulk.bulk_utils import post_bulk_save, pre_bulk_delete, chunked
+from apps.utilities.cache.cache_utils import delete_model_cache_many
+from apps.utilities.cache.tags import tags_invalidated
+from apps.utilities.deferred.queue import defer
+from apps.utilities.sites import current
+
+# The content models whose pages are baked.
+registered_models = set()
+
+
+def get_bake_root(site_id = None):
+    """
+        @type site_id: int
+        @param site_id: The site, or None for the current site.
+
+        @rtype: string
+        @return: The directory a site's pages are baked to, named after its domain as a Host header gives it: lower
+            case, without a port.
+    """
+    return os.path.join(settings.STATIC_BAKE_ROOT, current.get_domain(site_id).split(':')[0].lower())
+
+def get_bake_path(url, site_id = None):
+    """
+        Returns the file a page's URL is baked to.
+
+        @type url: string
+        @param url: The page's path, as returned by get_absolute_url.
+
+        @type site_id: int
+        @param site_id: The site, or None for the current site.
+
+        @rtype: string
+        @return: The absolute path of the HTML file.
+    """
+    return os.path.join(get_bake_root(site_id), url.strip('/'), 'index.html')
+
+def get_site_ids():
+    return list(Site.objects.values_list('id', flat = True))
+
+def write_atomic(path, data):
+    """
+        Writes a file through a temporary file and a rename, so the web server never sees half of it.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another process made it first.
+            pass
+    fd, temp_path = tempfile.mkstemp(dir = directory, prefix = '.bake-')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def gzip_bytes(data):
+    buf = StringIO()
+    # A fixed mtime keeps the gzipped copy identical between bakes of the same page.
+    with gzip.GzipFile(fileobj = buf, mode = 'wb', compresslevel = 9, mtime = 0) as gz:
+        gz.write(data)
+    return buf.getvalue()
+
+def unbake_url(url, site_ids = None):
+    """
+        Removes a page's baked files, and any directories left empty by that, up to its site's directory.
+
+        @type site_ids: list
+        @param site_ids: The sites to remove the page from, or None for every site.
+
+        @rtype: boolean
+        @return: True if there was a baked page to remove.
+    """
+    if site_ids is None:
+        site_ids = get_site_ids()
+    removed = False
+    for site_id in site_ids:
+        path = get_bake_path(url, site_id)
+        for name in (path, path + '.gz'):
+            try:
+                os.remove(name)
+                removed = True
+            except OSError:
+                pass
+
+        root = os.path.abspath(get_bake_root(site_id))
+        directory = os.path.dirname(path)
+        while os.path.abspath(directory).startswith(root + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+    return removed
+
+def unbake(content_obj):
+    return unbake_url(content_obj.get_absolute_url())
+
+def bake(content_obj):
+    """
+        Renders an object's public page to disk for each of its sites, and removes its baked page from every other site
+        and from all of them if it no longer has a public one.
+
+        @type content_obj: L{GenericContent}
+        @param content_obj: The object to bake.
+
+        @rtype: boolean
+        @return: True if the page was baked for at least one site.
+    """
+    url = content_obj.get_absolute_url()
+    site_ids = content_obj.is_public() and set(content_obj.sites.values_list('id', flat = True)) or set()
+    baked = False
+    for site_id in get_site_ids():
+        if site_id in site_ids and bake_for_site(content_obj, url, site_id):
+            baked = True
+        else:
+            unbake_url(url, [site_id])
+    if baked:
+        record_tags(content_obj)
+    else:
+        forget_tags(content_obj.__class__, [content_obj.pk])
+    return baked
+
+def bake_for_site(content_obj, url, site_id):
+    """
+        Renders an object's page, as served on one of its sites, to that site's directory.
+
+        @rtype: boolean
+        @return: True if the page was baked, False if the site leaves it to Django.
+    """
+    with current.site(site_id):
+        try:
+            response = render_public_page(content_obj)
+        except Http404:
+            response = None
+    # Redirects, such as for external articles, and pages missing from the site are left to Django.
+    if response is None or response.status_code != 200:
+        return False
+
+    path = get_bake_path(url, site_id)
+    write_atomic(path, response.content)
+    write_atomic(path + '.gz', gzip_bytes(response.content))
+    return True
+
+def bake_pks(model, pks):
+    """
+        Bakes objects by primary key, reading them from the database, for deferred bakes. Objects deleted since are
+        forgotten.
+    """
+    found = set()
+    for chunk in chunked(list(pks)):
+        for content_obj in model._default_manager.filter(pk__in = chunk):
+            found.add(content_obj.pk)
+            bake(content_obj)
+    forget_tags(model, set(pks) - found)
+
+def record_tags(content_obj):
+    """
+        Stores the cache tags of an object's baked page, replacing those of its last bake.
+    """
+    from apps.content.models import BakedTag
+    ctype = ContentType.objects.get_for_model(content_obj.__class__)
+    tags = set(content_obj.get_cache_tags())
+    stored = BakedTag.objects.filter(content_type = ctype, object_id = content_obj.pk)
+    previous = set(stored.values_list('tag', flat = True))
+    if previous - tags:
+        stored.filter(tag__in = list(previous - tags)).delete()
+    if tags - previous:
+        BakedTag.objects.bulk_create([BakedTag(content_type = ctype, object_id = content_obj.pk, tag = tag) for tag in tags - previous])
+
+def forget_tags(model, pks):
+    """
+        Removes the stored tags of objects whose pages are no longer baked.
+    """
+    from apps.content.models import BakedTag
+    if not pks:
+        return
+    ctype = ContentType.objects.get_for_model(model)
+    for chunk in chunked(list(pks)):
+        BakedTag.objects.filter(content_type = ctype, object_id__in = chunk).delete()
+
+def get_previous_url(model, pk):
+    """
+        @rtype: string or None
+        @return: The URL the object has according to the database, before any unsaved changes to its slug or publish date.
+    """
+    rows = list(model._default_manager.filter(pk = pk).values_list('slug', 'publish_at')[:1])
+    if not rows:
+        return None
+    return model(pk = pk, slug = rows[0][0], publish_at = rows[0][1]).get_absolute_url()
+
+
+def remember_url(sender, instance, raw = False, **kwargs):
+    """
+        pre_save handler. Stores the object's current URL, so its old page can be removed if the URL changes.
+    """
+    instance._bake_previous_url = None
+    if settings.STATIC_BAKE_ROOT and instance.pk and not raw:
+        instance._bake_previous_url = get_previous_url(sender, instance.pk)
+
+def bake_on_save(sender, instance, raw = False, **kwargs):
+    """
+        post_save handler. Removes the page at the object's old URL, and defers baking it at its new one, or removing
+        it if the object isn't public.
+    """
+    if not settings.STATIC_BAKE_ROOT or raw:
+        return
+    previous_url = getattr(instance, '_bake_previous_url', None)
+    if previous_url and previous_url != instance.get_absolute_url():
+        unbake_url(previous_url)
+    defer(bake_pks, sender, [instance.pk], last = True)
+
+def unbake_on_delete(sender, instance, **kwargs):
+    """
+        post_delete handler.
+    """
+    if settings.STATIC_BAKE_ROOT:
+        unbake(instance)
+        forget_tags(sender, [instance.pk])
+
+def bake_on_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+        m2m_changed handler for the sites, categories and authors relations, which the admin saves after the object.
+        A clear from the other side, such as category.article_set.clear(), doesn't say which content it removed; the
+        related object's tag is invalidated instead, which rebakes the pages showing it.
+    """
+    if not settings.STATIC_BAKE_ROOT or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        content_model, pks = instance.__class__, [instance.pk]
+    elif pk_set:
+        content_model, pks = model, list(pk_set)
+    else:
+        return
+    # The cached objects don't know their sites changed, and content_display would serve them from the cache.
+    delete_model_cache_many(content_model, [content_model(pk = pk) for pk in pks])
+    defer(bake_pks, content_model, pks, last = True)
+
+def bake_on_bulk_save(sender, instances, created, previous, **kwargs):
+    """
+        post_bulk_save handler, for admin actions such as make_public and make_draft.
+    """
+    if not settings.STATIC_BAKE_ROOT:
+        return
+    for instance in instances:
+        old_publish_at = (previous or {}).get(instance.pk, {}).get('publish_at')
+        if old_publish_at and old_publish_at != instance.publish_at:
+            unbake_url(sender(pk = instance.pk, slug = instance.slug, publish_at = old_publish_at).get_absolute_url())
+    defer(bake_pks, sender, [instance.pk for instance in instances], last = True)
+
+def unbake_on_bulk_delete(sender, pk_list, **kwargs):
+    """
+        pre_bulk_delete handler. Removes the pages while their URLs can still be read.
+    """
+    if not settings.STATIC_BAKE_ROOT:
+        return
+    for pk, slug, publish_at in sender._default_manager.filter(pk__in = pk_list).values_list('pk', 'slug', 'publish_at'):
+        unbake_url(sender(pk = pk, slug = slug, publish_at = publish_at).get_absolute_url())
+    forget_tags(sender, pk_list)
+
+def rebake_on_tags_invalidated(sender, tags, **kwargs):
+    """
+        tags_invalidated handler. Defers rebaking the pages tagged with any of the tags, such as every page listing a
+        renamed category.
+    """
+    from apps.content.models import BakedTag
+    if not settings.STATIC_BAKE_ROOT:
+        return
+    pks = {}
+    for chunk in chunked(list(tags)):
+        for content_type_id, object_id in BakedTag.objects.filter(tag__in = chunk).values_list('content_type', 'object_id').distinct():
+            pks.setdefault(content_type_id, set()).add(object_id)
+    for content_type_id, object_ids in pks.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model in registered_models:
+            defer(bake_pks, model, object_ids, last = True)
+
+def register(model):
+    """
+        Starts baking a content model's pages. The model needs is_public, get_absolute_url, get_cache_tags and sites,
+        categories and authors fields, as GenericContent subclasses have. Register it after the model's cache
+        invalidation handlers, so pages are rendered from fresh data.
+    """
+    if model in registered_models:
+        return
+    registered_models.add(model)
+
+    pre_save.connect(remember_url, sender = model)
+    post_save.connect(bake_on_save, sender = model)
+    post_delete.connect(unbake_on_delete, sender = model)
+    m2m_changed.connect(bake_on_m2m_changed, sender = model.sites.through)
+    m2m_changed.connect(bake_on_m2m_changed, sender = model.categories.through)
+    m2m_changed.connect(bake_on_m2m_changed, sender = model.authors.through)
+    post_bulk_save.connect(bake_on_bulk_save, sender = model)
+    pre_bulk_delete.connect(unbake_on_bulk_delete, sender = model)
+    tags_invalidated.connect(rebake_on_tags_invalidated, dispatch_uid = 'bake.rebake_on_tags_invalidated')
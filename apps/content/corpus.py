@@ -0,0 +1,353 @@
+"""
+    Generates large synthetic corpora for scale testing: sites, deep category trees, authors, image libraries and
+    articles, with control over how they are distributed.
+
+    Rows are written in batches with bulk_create, and the M2M through tables are loaded with COPY on Postgres.
+    Model save methods and signals are skipped, so category paths are computed directly and the publish date
+    histogram and related content are rebuilt at the end.
+"""
+import os
+import random
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db import connection, transaction
+from django.template.defaultfilters import slugify
+
+from apps.categories.models import Category
+from apps.content import date_histogram, related, search
+from apps.content.models import Article
+from apps.contentinfo.models import GFContentType
+from apps.media_library.models import GFImage
+from apps.utilities.bulk.bulk_utils import chunked
+
+WORDS = ('city', 'council', 'school', 'board', 'vote', 'budget', 'storm', 'road', 'game', 'season', 'coach', 'market',
+    'police', 'fire', 'county', 'river', 'festival', 'museum', 'library', 'hospital', 'park', 'bridge', 'election', 'mayor',
+    'tax', 'plan', 'water', 'power', 'court', 'judge', 'team', 'record', 'crowd', 'night', 'street', 'downtown')
+
+
+def copy_rows(model, columns, rows, batch_size):
+    """
+        Loads rows straight into a model's table. Uses COPY on Postgres and batched bulk_create elsewhere.
+
+        @type model: class
+        @param model: The model whose table is loaded. Usually an M2M through model.
+
+        @type columns: tuple
+        @param columns: The attnames of the fields being set, such as ('article_id', 'site_id').
+
+        @type rows: iterable
+        @param rows: Tuples of values in column order.
+
+        @rtype: int
+        @return: The number of rows loaded.
+    """
+    count = 0
+    use_copy = connection.vendor == 'postgresql'
+    for batch in chunked(rows, batch_size):
+        if use_copy:
+            data = StringIO('\n'.join(['\t'.join([str(value) for value in row]) for row in batch]) + '\n')
+            cursor = connection.cursor()
+            cursor.copy_from(data, model._meta.db_table, columns = [model._meta.get_field(column).column for column in columns])
+        else:
+            model.objects.bulk_create([model(**dict(zip(columns, row))) for row in batch])
+        count += len(batch)
+    return count
+
+
+class CorpusGenerator(object):
+    """
+        Builds a synthetic corpus. The same options and random seed always produce the same rows.
+
+        @type articles: int
+        @cvar articles: Number of articles.
+
+        @type categories: int
+        @cvar categories: Number of categories.
+
+        @type category_depth: int
+        @cvar category_depth: Depth of the category tree.
+
+        @type category_fanout: int
+        @cvar category_fanout: Children per category, and the number of roots.
+
+        @type category_skew: float
+        @cvar category_skew: Pareto shape for how articles are spread over categories. Lower is more skewed; 0 spreads them evenly.
+
+        @type categories_per_article: int
+        @cvar categories_per_article: Most categories an article is put in. Each gets between 1 and this many.
+
+        @type sites: int
+        @cvar sites: Number of sites, including the current one.
+
+        @type sites_per_article: int
+        @cvar sites_per_article: Most extra sites an article is put on besides the current one. Each gets between 0 and this many.
+
+        @type authors: int
+        @cvar authors: Number of author users.
+
+        @type images: int
+        @cvar images: Number of images.
+
+        @type images_per_day: int
+        @cvar images_per_day: Images uploaded per day, which sets how crowded each day's image directory is.
+
+        @type image_files: boolean
+        @cvar image_files: Whether to write a file for each image. The files are hard links to one small PNG.
+
+        @type future_ratio: float
+        @cvar future_ratio: Fraction of articles scheduled to publish in the next 30 days.
+
+        @type expired_ratio: float
+        @cvar expired_ratio: Fraction of articles that have already expired.
+
+        @type draft_ratio: float
+        @cvar draft_ratio: Fraction of articles that are drafts.
+
+        @type days: int
+        @cvar days: How many days back publish dates are spread over.
+
+        @type batch_size: int
+        @cvar batch_size: Rows written per query.
+    """
+    def __init__(self, articles = 10000, categories = 200, category_depth = 4, category_fanout = 6, category_skew = 1.2, categories_per_article = 3,
+                 sites = 10, sites_per_article = 2, authors = 50, images = 5000, images_per_day = 200, image_files = False,
+                 future_ratio = 0.01, expired_ratio = 0.02, draft_ratio = 0.05, days = 365 * 3, batch_size = 2000, random_seed = 1, log = None):
+        self.articles = articles
+        self.categories = categories
+        self.category_depth = category_depth
+        self.category_fanout = category_fanout
+        self.category_skew = category_skew
+        self.categories_per_article = categories_per_article
+        self.sites = sites
+        self.sites_per_article = sites_per_article
+        self.authors = authors
+        self.images = images
+        self.images_per_day = images_per_day
+        self.image_files = image_files
+        self.future_ratio = future_ratio
+        self.expired_ratio = expired_ratio
+        self.draft_ratio = draft_ratio
+        self.days = days
+        self.batch_size = batch_size
+        self.rand = random.Random(random_seed)
+        self.log = log or (lambda message: None)
+        self.now = datetime.now().replace(microsecond = 0)
+
+    def generate(self):
+        """
+            Builds the whole corpus.
+
+            @rtype: list
+            @return: The ids of the generated articles.
+        """
+        GFContentType.objects.get_or_create(short_name = 'ar', defaults = {'full_name': 'Article', 'model_name': 'Article'})
+        site_ids = self.generate_sites()
+        category_ids = self.generate_categories()
+        author_ids = self.generate_authors()
+        self.generate_images()
+        article_ids = self.generate_articles(site_ids, category_ids, author_ids)
+        self.log("Rebuilt %d histogram rows" % date_histogram.rebuild(Article))
+        # COPY skips post_save, so the search vectors are built in one pass.
+        if search.is_indexed(Article):
+            self.log("Indexed %d articles for search" % search.update_search_vectors(Article))
+        self.log("Stored %d related content lists" % related.rebuild(Article))
+        return article_ids
+
+    def new_ids(self, model, start_id):
+        """
+            Returns the ids of rows just bulk created, which bulk_create doesn't hand back.
+        """
+        return list(model.objects.filter(id__gt = start_id).order_by('id').values_list('id', flat = True))
+
+    def last_id(self, model):
+        return (model.objects.order_by('-id').values_list('id', flat = True)[:1] or [0])[0]
+
+    def generate_sites(self):
+        """
+            @rtype: list
+            @return: The ids of every site other than the current one.
+        """
+        if not Site.objects.filter(id = settings.SITE_ID).exists():
+            Site.objects.create(id = settings.SITE_ID, domain = settings.SITE_DOMAIN, name = settings.SITE_PREFIX)
+        existing = Site.objects.count()
+        with transaction.commit_on_success():
+            Site.objects.bulk_create([Site(domain = 'site%d.example.com' % i, name = 'Site %d' % i) for i in range(existing + 1, self.sites + 1)])
+        site_ids = list(Site.objects.exclude(id = settings.SITE_ID).values_list('id', flat = True))
+        self.log("%d sites" % (len(site_ids) + 1))
+        return site_ids
+
+    def generate_categories(self):
+        """
+            Builds the category tree breadth first, one level per batch of inserts. Paths, depths and child counts are
+            worked out here instead of through treebeard's add_child, which costs several queries per node.
+
+            @rtype: list
+            @return: The ids of the new categories.
+        """
+        start_id = self.last_id(Category)
+        last_root = Category.get_last_root_node()
+        first_step = last_root and Category._str2int(last_root.path[0:Category.steplen]) + 1 or 1
+
+        remaining = self.categories
+        level = [('', step) for step in range(first_step, first_step + min(self.category_fanout, remaining))]
+        depth = 1
+        created = 0
+        with transaction.commit_on_success():
+            while level and remaining > 0:
+                level = level[:remaining]
+                remaining -= len(level)
+                # Children are handed out to this level's nodes in turn, so the tree fills evenly.
+                numchild = [0] * len(level)
+                if depth < self.category_depth:
+                    for i in range(min(remaining, len(level) * self.category_fanout)):
+                        numchild[i % len(level)] += 1
+
+                nodes = []
+                next_level = []
+                for (parent_path, step), children in zip(level, numchild):
+                    path = Category._get_path(parent_path, depth, step)
+                    created += 1
+                    nodes.append(Category(path = path, depth = depth, numchild = children, name = 'Category %d' % created, slug = slugify(path)))
+                    next_level.extend([(path, child) for child in range(1, children + 1)])
+                for batch in chunked(nodes, self.batch_size):
+                    Category.objects.bulk_create(batch)
+                level = next_level
+                depth += 1
+
+        category_ids = self.new_ids(Category, start_id)
+        self.log("%d categories, %d levels deep" % (len(category_ids), depth - 1))
+        return category_ids
+
+    def generate_authors(self):
+        """
+            @rtype: list
+            @return: The ids of the new users.
+        """
+        start_id = self.last_id(User)
+        with transaction.commit_on_success():
+            User.objects.bulk_create([User(username = 'corpus_%d_%d' % (start_id, i), first_name = 'Author', last_name = str(i), password = '!') for i in range(self.authors)])
+        author_ids = self.new_ids(User, start_id)
+        self.log("%d authors" % len(author_ids))
+        return author_ids
+
+    def generate_images(self):
+        """
+            Adds images in daily runs of images_per_day, going back from today, each in its day's upload directory.
+        """
+        start_id = self.last_id(GFImage)
+        source = None
+        if self.image_files:
+            from PIL import Image
+            source = os.path.join(settings.MEDIA_ROOT, settings.SITE_PREFIX, 'images', 'corpus.png')
+            if not os.path.isdir(os.path.dirname(source)):
+                os.makedirs(os.path.dirname(source))
+            Image.new('RGB', (64, 48), (128, 128, 128)).save(source)
+
+        days = []
+        for batch_start in range(0, self.images, self.images_per_day):
+            day = self.now - timedelta(days = len(days))
+            directory = "%s/%s/%s/%s" % (settings.MEDIA_ROOT, settings.SITE_PREFIX, 'images', day.strftime('%Y/%m/%d'))
+            if source and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            images = []
+            for i in range(batch_start, min(self.images, batch_start + self.images_per_day)):
+                path = "%s/corpus-%d-%d.png" % (directory, start_id, i)
+                if source and not os.path.exists(path):
+                    os.link(source, path)
+                images.append(GFImage(title = 'Corpus image %d' % i, slug = 'corpus-image-%d' % i, image = path))
+            with transaction.commit_on_success():
+                GFImage.objects.bulk_create(images)
+            days.append(day)
+
+        # created_at is auto_now_add, which bulk_create fills with the current time, so date each day's run afterwards.
+        ids = self.new_ids(GFImage, start_id)
+        with transaction.commit_on_success():
+            for day, day_ids in zip(days, chunked(ids, self.images_per_day)):
+                GFImage.objects.filter(id__gte = day_ids[0], id__lte = day_ids[-1]).update(created_at = day)
+        self.log("%d images over %d days" % (len(ids), len(days)))
+
+    def pick_categories(self, category_ids):
+        """
+            Picks an article's categories. With a skew set, a few categories get most of the articles, as sections do.
+        """
+        if not category_ids:
+            return []
+        count = min(len(category_ids), self.rand.randint(1, self.categories_per_article))
+        if not self.category_skew:
+            return self.rand.sample(category_ids, count)
+        chosen = set()
+        while len(chosen) < count:
+            index = int(self.rand.paretovariate(self.category_skew)) - 1
+            chosen.add(category_ids[index % len(category_ids)])
+        return list(chosen)
+
+    def make_article(self):
+        rand = self.rand
+        roll = rand.random()
+        status = Article.STATUS_CHOICES.public
+        expires_at = None
+        if roll < self.future_ratio:
+            publish_at = self.now + timedelta(seconds = rand.randint(60, 60 * 60 * 24 * 30))
+        else:
+            publish_at = self.now - timedelta(seconds = rand.randint(60, 60 * 60 * 24 * self.days))
+            if roll < self.future_ratio + self.expired_ratio:
+                expires_at = publish_at + timedelta(seconds = rand.randint(0, int((self.now - publish_at).total_seconds())))
+        if rand.random() < self.draft_ratio:
+            status = Article.STATUS_CHOICES.draft
+
+        title = ' '.join([rand.choice(WORDS) for w in range(rand.randint(4, 10))]).capitalize()
+        return Article(
+            title = title,
+            slug = slugify(title)[:50],
+            status = status,
+            publish_at = publish_at,
+            updated_at = publish_at,
+            expires_at = expires_at,
+            abstract = title + '.',
+            body = '\n\n'.join([' '.join([rand.choice(WORDS) for w in range(60)]) for p in range(rand.randint(3, 12))]),
+        )
+
+    def generate_articles(self, site_ids, category_ids, author_ids):
+        """
+            Adds the articles in batches, each followed by its site, category and author through rows.
+
+            @rtype: list
+            @return: The ids of the new articles.
+        """
+        SiteThrough = Article.sites.through
+        CategoryThrough = Article.categories.through
+        AuthorThrough = Article.authors.through
+
+        article_ids = []
+        links = {'sites': 0, 'categories': 0, 'authors': 0}
+        for batch_start in range(0, self.articles, self.batch_size):
+            start_id = self.last_id(Article)
+            with transaction.commit_on_success():
+                Article.objects.bulk_create([self.make_article() for i in range(batch_start, min(self.articles, batch_start + self.batch_size))])
+                ids = self.new_ids(Article, start_id)
+
+                site_rows = []
+                category_rows = []
+                author_rows = []
+                for article_id in ids:
+                    site_rows.append((article_id, settings.SITE_ID))
+                    for site_id in self.rand.sample(site_ids, min(len(site_ids), self.rand.randint(0, self.sites_per_article))):
+                        site_rows.append((article_id, site_id))
+                    for category_id in self.pick_categories(category_ids):
+                        category_rows.append((article_id, category_id))
+                    if author_ids:
+                        author_rows.append((article_id, self.rand.choice(author_ids)))
+
+                links['sites'] += copy_rows(SiteThrough, ('article_id', 'site_id'), site_rows, self.batch_size)
+                links['categories'] += copy_rows(CategoryThrough, ('article_id', 'category_id'), category_rows, self.batch_size)
+                links['authors'] += copy_rows(AuthorThrough, ('article_id', 'user_id'), author_rows, self.batch_size)
+            article_ids.extend(ids)
+            self.log("%d articles" % len(article_ids))
+
+        self.log("%(sites)d site links, %(categories)d category links, %(authors)d author links" % links)
+        return article_ids
@@ -0,0 +1,199 @@
+"""
+    Maintains the ContentDateCount histogram for content models.
+
+    Counts are adjusted as content is saved, deleted, moved between sites or changed in bulk. The rebuild function
+    recomputes a model's histogram from scratch, for first installs or if it ever drifts.
+"""
+from collections import defaultdict
+
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, m2m_changed
+from django.contrib.contenttypes.models import ContentType
+
+from apps.utilities.bulk.bulk_utils import post_bulk_save, pre_bulk_delete, chunked
+
+# The content models whose histograms are maintained.
+registered_models = set()
+
+
+def adjust(model, deltas):
+    """
+        Applies a set of count changes to the histogram.
+
+        @type model: class
+        @param model: The content model the changes are for.
+
+        @type deltas: dict
+        @param deltas: Maps (site_id, status, date) to the amount to add to that bucket.
+
+        @rtype: None
+        @return: None
+    """
+    from apps.content.models import ContentDateCount
+
+    ctype = ContentType.objects.get_for_model(model)
+    for (site_id, status, day), delta in deltas.items():
+        if not delta or site_id is None:
+            continue
+        lookup = dict(content_type = ctype, site__id = site_id, status = status, year = day.year, month = day.month, day = day.day)
+        if ContentDateCount.objects.filter(**lookup).update(count = F('count') + delta) or delta < 0:
+            continue
+        # The bucket doesn't exist yet. Another process may be creating it at the same time, so fall back to the update.
+        sid = transaction.savepoint()
+        try:
+            ContentDateCount.objects.create(content_type = ctype, site_id = site_id, status = status, year = day.year, month = day.month, day = day.day, count = delta)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            ContentDateCount.objects.filter(**lookup).update(count = F('count') + delta)
+
+def _sites_field_name(model):
+    """ Returns the name of the through table column pointing at the content model. """
+    return model._meta.get_field('sites').m2m_field_name()
+
+def remember_previous(sender, instance, raw = False, **kwargs):
+    """
+        pre_save handler. Stores the status and publish date the object has in the DB, so post_save can tell if it moved.
+    """
+    instance._histogram_previous = None
+    if instance.pk and not raw:
+        previous = list(sender._default_manager.filter(pk = instance.pk).values_list('status', 'publish_at')[:1])
+        if previous:
+            instance._histogram_previous = previous[0]
+
+def update_on_save(sender, instance, created, raw = False, **kwargs):
+    """
+        post_save handler. Moves the object's counts if its status or publish date changed.
+        New objects are counted when their sites are added.
+    """
+    previous = getattr(instance, '_histogram_previous', None)
+    if raw or not previous:
+        return
+    old_status, old_publish_at = previous
+    if old_status == instance.status and old_publish_at.date() == instance.publish_at.date():
+        return
+
+    deltas = defaultdict(int)
+    for site_id in instance.sites.values_list('id', flat = True):
+        deltas[(site_id, old_status, old_publish_at.date())] -= 1
+        deltas[(site_id, instance.status, instance.publish_at.date())] += 1
+    adjust(sender, deltas)
+
+def update_on_delete(sender, instance, **kwargs):
+    """
+        pre_delete handler. Removes the object from the counts while its sites can still be read.
+    """
+    deltas = defaultdict(int)
+    for site_id in instance.sites.values_list('id', flat = True):
+        deltas[(site_id, instance.status, instance.publish_at.date())] -= 1
+    adjust(sender, deltas)
+
+def update_on_sites_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+        m2m_changed handler for the sites relation, from either side.
+    """
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    sign = action == 'post_add' and 1 or -1
+
+    deltas = defaultdict(int)
+    if reverse:
+        # instance is a Site and pk_set holds content pks.
+        content_model = model
+        rows = content_model._default_manager.filter(sites = instance)
+        if action != 'pre_clear':
+            rows = rows.filter(pk__in = pk_set)
+        for status, publish_at in rows.values_list('status', 'publish_at'):
+            deltas[(instance.pk, status, publish_at.date())] += sign
+    else:
+        content_model = instance.__class__
+        if action == 'post_add':
+            # Django only reports the sites which were actually added.
+            site_ids = pk_set
+        else:
+            # Removals report what was asked for, so only count the sites which are really attached.
+            site_ids = instance.sites.all()
+            if action == 'pre_remove':
+                site_ids = site_ids.filter(pk__in = pk_set)
+            site_ids = site_ids.values_list('id', flat = True)
+        for site_id in site_ids:
+            deltas[(site_id, instance.status, instance.publish_at.date())] += sign
+    adjust(content_model, deltas)
+
+def update_on_bulk_save(sender, instances, created, previous, **kwargs):
+    """
+        post_bulk_save handler. Adds created objects, and moves updated objects whose status or publish date changed.
+    """
+    moved = {}
+    for instance in instances:
+        old = (previous or {}).get(instance.pk, {})
+        old_status = old.get('status', instance.status)
+        old_publish_at = old.get('publish_at', instance.publish_at)
+        if created or old_status != instance.status or old_publish_at.date() != instance.publish_at.date():
+            moved[instance.pk] = (instance, old_status, old_publish_at)
+    if not moved:
+        return
+
+    deltas = defaultdict(int)
+    field_name = _sites_field_name(sender)
+    through = sender.sites.through
+    for chunk in chunked(moved.keys()):
+        for pk, site_id in through.objects.filter(**{'%s__in' % field_name: chunk}).values_list('%s_id' % field_name, 'site_id'):
+            instance, old_status, old_publish_at = moved[pk]
+            if not created:
+                deltas[(site_id, old_status, old_publish_at.date())] -= 1
+            deltas[(site_id, instance.status, instance.publish_at.date())] += 1
+    adjust(sender, deltas)
+
+def update_on_bulk_delete(sender, pk_list, **kwargs):
+    """
+        pre_bulk_delete handler. Removes the objects from the counts while their sites can still be read.
+    """
+    deltas = defaultdict(int)
+    for site_id, status, publish_at in sender._default_manager.filter(pk__in = pk_list).values_list('sites__id', 'status', 'publish_at'):
+        deltas[(site_id, status, publish_at.date())] -= 1
+    adjust(sender, deltas)
+
+def rebuild(model):
+    """
+        Recomputes a content model's histogram from the content table. The rows are streamed and counted in Python,
+        so this works the same way on any database.
+
+        @type model: class
+        @param model: The content model.
+
+        @rtype: int
+        @return: The number of histogram rows written.
+    """
+    from apps.content.models import ContentDateCount
+
+    counts = defaultdict(int)
+    rows = model._default_manager.exclude(sites = None).values_list('sites__id', 'status', 'publish_at').order_by()
+    for site_id, status, publish_at in rows.iterator():
+        counts[(site_id, status, publish_at.year, publish_at.month, publish_at.day)] += 1
+
+    ctype = ContentType.objects.get_for_model(model)
+    with transaction.commit_on_success():
+        ContentDateCount.objects.filter(content_type = ctype).delete()
+        ContentDateCount.objects.bulk_create([
+            ContentDateCount(content_type = ctype, site_id = site_id, status = status, year = year, month = month, day = day, count = count)
+            for (site_id, status, year, month, day), count in counts.items()
+        ])
+    return len(counts)
+
+def register(model):
+    """
+        Starts maintaining the histogram for a content model. The model needs status, publish_at and sites fields,
+        as GenericContent subclasses have.
+    """
+    if model in registered_models:
+        return
+    registered_models.add(model)
+
+    pre_save.connect(remember_previous, sender = model)
+    post_save.connect(update_on_save, sender = model)
+    pre_delete.connect(update_on_delete, sender = model)
+    m2m_changed.connect(update_on_sites_changed, sender = model.sites.through)
+    post_bulk_save.connect(update_on_bulk_save, sender = model)
+    pre_bulk_delete.connect(update_on_bulk_delete, sender = model)
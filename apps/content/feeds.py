@@ -0,0 +1,433 @@
+"""
+    Site and category feeds, in RSS 2.0 and Atom.
+
+    A feed is cached as its settings.FEED_ITEMS newest public items, each rendered in both formats when it's added,
+    along with its channel details. Nothing regenerates a whole feed once it's cached: when content is saved, moved
+    between sites or categories, transitioned in bulk or deleted, the cached feeds it belongs or belonged to are patched.
+    Its items are dropped and, if it's still public and in the feed, rendered again and put back in order, and a feed left
+    short is topped up from the database. Content going live on schedule and items expiring don't save anything, so each
+    feed records when its next such change is due and catches up on the first request after it. A feed is patched under
+    a lock, so two processes patching it at once can't each write back a copy missing the other's change; one that finds
+    the feed locked drops it instead, and it's built afresh on the next request.
+
+    Category feeds include the content filed under the category's children. Channel titles and item bylines aren't
+    patched when a category or author is renamed, so settings.FEED_CACHE_SECONDS bounds how long those can be stale.
+"""
+import hashlib
+import time
+from cStringIO import StringIO
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db.models.signals import pre_delete, post_save, post_delete, m2m_changed
+from django.contrib.sites.models import Site
+from django.utils.feedgenerator import Atom1Feed, Enclosure, Rss201rev2Feed
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from apps.categories.models import Category
+from apps.utilities.bulk.bulk_utils import post_bulk_save, pre_bulk_delete, chunked
+from apps.utilities.cache.cache_utils import get_cache_versions
+
+# The content models with feeds.
+registered_models = set()
+
+
+class CachedFeedMixin(object):
+    """
+        Takes the channel's updated time from the cached feed, since the channel is rendered without its items.
+    """
+    def latest_post_date(self):
+        return self.feed['updated']
+
+class RssFeed(CachedFeedMixin, Rss201rev2Feed):
+    pass
+
+class AtomFeed(CachedFeedMixin, Atom1Feed):
+    pass
+
+FEED_CLASSES = {'rss': RssFeed, 'atom': AtomFeed}
+# Where each format's items go in its channel.
+CHANNEL_ENDS = {'rss': '</channel>', 'atom': '</feed>'}
+# How long a process patching a feed keeps others from patching it, in case it dies before letting go.
+PATCH_LOCK_SECONDS = 30
+
+
+def to_epoch(value):
+    return value and time.mktime(value.timetuple()) or None
+
+def get_feed_cache_key(model, site_id, category_id = None, version = None):
+    """
+        @type category_id: int
+        @param category_id: The category of a category feed, or None for the site's feed.
+
+        @type version: int
+        @param version: The group cache version to build the key for. Defaults to settings.GROUP_CACHE_VERSION.
+
+        @rtype: string
+        @return: The cache key of a feed.
+    """
+    if version is None:
+        version = settings.GROUP_CACHE_VERSION
+    return "%s::feed::%s::%s::%s::%s" % (settings.GROUP_NAME, model._meta.object_name.lower(), site_id, category_id or 'all', version)
+
+def get_queryset(model, feed):
+    """
+        @rtype: L{QuerySet}
+        @return: The public content that belongs in a feed.
+    """
+    queryset = model.published.for_site(feed['site_id'])
+    if feed['category_path']:
+        queryset = queryset.filter(categories__path__startswith = feed['category_path']).distinct()
+    return queryset
+
+def get_channel(site_id, category = None):
+    """
+        @rtype: dict
+        @return: The title, link, description and each format's URL of a feed.
+    """
+    site = Site.objects.get(pk = site_id)
+    kwargs = category and {'category_id': category.id} or {}
+    name = category and 'content_category_feed' or 'content_feed'
+    return {
+        'title': category and u"%s: %s" % (site.name, category.name) or site.name,
+        'link': "http://%s/" % site.domain,
+        'description': u"The latest from %s" % (category and category.name or site.name),
+        'urls': dict((format, "http://%s%s" % (site.domain, reverse(name, kwargs = dict(kwargs, format = format)))) for format in FEED_CLASSES),
+    }
+
+def render_channel(feed, format):
+    """
+        @rtype: tuple
+        @return: The feed's XML before its items and after them.
+    """
+    channel = feed['channel']
+    generator = FEED_CLASSES[format](channel['title'], channel['link'], channel['description'], language = settings.LANGUAGE_CODE,
+        feed_url = channel['urls'][format], updated = datetime.fromtimestamp(feed['updated']))
+    xml = generator.writeString('utf-8')
+    end = xml.rindex(CHANNEL_ENDS[format])
+    return xml[:end], xml[end:]
+
+def get_enclosure(content_obj):
+    """
+        @rtype: L{Enclosure} or None
+        @return: An enclosure for the object's photo. Its length is the size stored when the photo was saved, never
+        encoded here, and 0 if it wasn't stored, which feed readers take as unknown.
+    """
+    photo = content_obj.get_photo()
+    if photo is None:
+        return None
+    width, height = settings.FEED_ENCLOSURE_SIZE
+    return Enclosure(photo.get_resize_url(width, height), unicode(photo.get_rendition_size(width, height) or 0), photo.determine_mime_type())
+
+def render_items(content_obj, domain):
+    """
+        Renders an object's item in every format.
+
+        @type domain: string
+        @param domain: The domain of the feed's site, for the item's link.
+
+        @rtype: dict
+        @return: The item's XML, by format.
+    """
+    link = "http://%s%s" % (domain, content_obj.get_absolute_url())
+    authors = [user.get_full_name() or user.username for user in content_obj.authors.all()]
+    item = {
+        'title': content_obj.title,
+        'link': link,
+        'description': content_obj.abstract,
+        'pubdate': content_obj.publish_at,
+        'unique_id': link,
+        'author_name': u", ".join(authors) or content_obj.one_off_byline or None,
+        'categories': [category.name for category in content_obj.categories.all()],
+        'enclosure': get_enclosure(content_obj),
+    }
+    rendered = {}
+    for format, feed_class in FEED_CLASSES.items():
+        generator = feed_class(u'', link, u'')
+        generator.add_item(**item)
+        buf = StringIO()
+        generator.write_items(SimplerXMLGenerator(buf, 'utf-8'))
+        rendered[format] = buf.getvalue()
+    return rendered
+
+def get_entries(feed, queryset):
+    """
+        @rtype: list
+        @return: (publish time, pk, expiry time, items) for the objects in a queryset, as the feed stores them.
+    """
+    return [(to_epoch(content_obj.publish_at), content_obj.pk, to_epoch(content_obj.expires_at), render_items(content_obj, feed['domain']))
+        for content_obj in queryset.prefetch_related('authors', 'categories')]
+
+def get_next_change(model, feed, now):
+    """
+        @rtype: float or None
+        @return: When the feed's next item expires or its next scheduled content goes live, whichever is first.
+    """
+    changes = [expires for publish, pk, expires, items in feed['entries'] if expires]
+    scheduled = model._default_manager.filter(status = model.STATUS_CHOICES.public, sites__id__exact = feed['site_id'], publish_at__gt = datetime.fromtimestamp(now))
+    if feed['category_path']:
+        scheduled = scheduled.filter(categories__path__startswith = feed['category_path'])
+    changes.extend([to_epoch(publish_at) for publish_at in scheduled.order_by('publish_at').values_list('publish_at', flat = True)[:1]])
+    return changes and min(changes) or None
+
+def finish(model, feed, now):
+    """
+        Puts a feed's entries in order, trims them to settings.FEED_ITEMS, and renders its channel again.
+    """
+    feed['entries'].sort(reverse = True)
+    if len(feed['entries']) > settings.FEED_ITEMS:
+        del feed['entries'][settings.FEED_ITEMS:]
+        feed['full'] = True
+    feed['updated'] = now
+    feed['next_change'] = get_next_change(model, feed, now)
+    feed['channels'] = dict((format, render_channel(feed, format)) for format in FEED_CLASSES)
+
+def build(model, site_id, category_id = None):
+    """
+        Builds a feed from the database.
+
+        @rtype: dict
+        @return: The feed.
+    """
+    category = category_id and Category.objects.get(pk = category_id) or None
+    now = time.time()
+    feed = {
+        'site_id': site_id,
+        'domain': Site.objects.get(pk = site_id).domain,
+        'category_path': category and category.path or None,
+        'channel': get_channel(site_id, category),
+        'checked_at': now,
+    }
+    feed['entries'] = get_entries(feed, get_queryset(model, feed).order_by('-publish_at', '-id')[:settings.FEED_ITEMS])
+    # A full feed may have more content behind it to top up from.
+    feed['full'] = len(feed['entries']) >= settings.FEED_ITEMS
+    finish(model, feed, now)
+    return feed
+
+def patch(model, feed, pk_list = (), deleted = False):
+    """
+        Brings a cached feed up to date with changes to some of its content, and with any content that went live or
+        expired since it was last patched.
+
+        @type pk_list: list
+        @param pk_list: The pks of content that changed, whether or not it's in the feed.
+
+        @type deleted: boolean
+        @param deleted: The content is about to be deleted, and is only dropped.
+
+        @rtype: None
+        @return: None
+    """
+    now = time.time()
+    changed = set(pk_list)
+    entries = [entry for entry in feed['entries'] if entry[1] not in changed and (entry[2] is None or entry[2] >= now)]
+    queryset = get_queryset(model, feed)
+
+    additions = []
+    if changed and not deleted:
+        additions.extend(get_entries(feed, queryset.filter(pk__in = list(changed))))
+    if feed['next_change'] is not None and now >= feed['next_change']:
+        present = set([entry[1] for entry in entries + additions])
+        live = queryset.filter(publish_at__gt = datetime.fromtimestamp(feed['checked_at'])).exclude(pk__in = list(present))
+        additions.extend(get_entries(feed, live))
+        feed['checked_at'] = now
+    entries.extend(additions)
+
+    missing = settings.FEED_ITEMS - len(entries)
+    if missing > 0 and feed['full']:
+        entries.sort(reverse = True)
+        older = queryset.exclude(pk__in = [entry[1] for entry in entries] + list(changed)).order_by('-publish_at', '-id')
+        if entries:
+            older = older.filter(publish_at__lte = datetime.fromtimestamp(entries[-1][0]))
+        topped_up = get_entries(feed, older[:missing])
+        feed['full'] = len(topped_up) >= missing
+        entries.extend(topped_up)
+    feed['entries'] = entries
+    finish(model, feed, now)
+
+def get_feed(model, site_id, category_id = None):
+    """
+        Returns a feed, building it if it isn't cached, or catching up on the content that went live or expired since
+        it was last patched.
+
+        @rtype: dict
+        @return: The feed.
+    """
+    key = get_feed_cache_key(model, site_id, category_id)
+    feed = cache.get(key)
+    if feed is None:
+        feed = build(model, site_id, category_id)
+        cache.set(key, feed, settings.FEED_CACHE_SECONDS)
+    elif feed['next_change'] is not None and time.time() >= feed['next_change']:
+        feed = patch_cached(model, key) or build(model, site_id, category_id)
+    return feed
+
+def patch_cached(model, key, pk_list = (), deleted = False):
+    """
+        Patches a cached feed under a lock. If another process is patching it, the feed is dropped instead, and the lock
+        is marked so that process drops its copy too once it has written it: either copy would be missing a change.
+
+        @type key: string
+        @param key: The feed's cache key.
+
+        @rtype: dict or None
+        @return: The patched feed, or None if it wasn't cached or was dropped.
+    """
+    lock_key = key + ':patching'
+    if not cache.add(lock_key, 1, PATCH_LOCK_SECONDS):
+        cache.set(lock_key, 'stale', PATCH_LOCK_SECONDS)
+        cache.delete(key)
+        return None
+    try:
+        feed = cache.get(key)
+        if feed is None:
+            return None
+        patch(model, feed, pk_list, deleted)
+        cache.set(key, feed, settings.FEED_CACHE_SECONDS)
+        # Checked after writing, so a process that marks the lock afterwards also deletes what was written.
+        if cache.get(lock_key) == 'stale':
+            cache.delete(key)
+            return None
+        return feed
+    finally:
+        cache.delete(lock_key)
+
+def render_feed(feed, format):
+    """
+        @rtype: string
+        @return: The feed's document, in UTF-8.
+    """
+    head, tail = feed['channels'][format]
+    return head + ''.join([items[format] for publish, pk, expires, items in feed['entries']]) + tail
+
+def get_validators(model, feed, format):
+    """
+        @rtype: tuple
+        @return: (etag, last modified as epoch seconds) for a feed document.
+    """
+    parts = [model._meta.object_name, feed['site_id'], feed['category_path'], format, repr(feed['updated']), settings.CACHE_VERSION]
+    return hashlib.md5("|".join([unicode(part) for part in parts])).hexdigest(), feed['updated']
+
+def get_feeds_for(model, pk_list, site_ids = (), category_ids = ()):
+    """
+        Returns the feeds some content can appear in, as (site id, category id) pairs with None for a site's feed.
+
+        @type site_ids: list
+        @param site_ids: Sites to include as well as the content's own, such as sites it was just removed from.
+
+        @type category_ids: list
+        @param category_ids: Categories to include as well as the content's own.
+
+        @rtype: set
+        @return: The feeds.
+    """
+    site_ids = set(site_ids)
+    category_ids = set(category_ids)
+    sites_field = model._meta.get_field('sites')
+    categories_field = model._meta.get_field('categories')
+    for chunk in chunked(list(pk_list)):
+        site_ids.update(sites_field.rel.through.objects.filter(**{sites_field.m2m_field_name() + '__in': chunk}).values_list(sites_field.m2m_reverse_field_name(), flat = True))
+        category_ids.update(categories_field.rel.through.objects.filter(**{categories_field.m2m_field_name() + '__in': chunk}).values_list(categories_field.m2m_reverse_field_name(), flat = True))
+
+    # Category feeds include the content of the categories under them.
+    ancestor_paths = set()
+    for path in Category.objects.filter(pk__in = list(category_ids)).values_list('path', flat = True):
+        for depth in range(1, len(path) // Category.steplen):
+            ancestor_paths.add(path[0:depth * Category.steplen])
+    if ancestor_paths:
+        category_ids.update(Category.objects.filter(path__in = list(ancestor_paths)).values_list('id', flat = True))
+
+    feeds = set()
+    for site_id in site_ids:
+        feeds.add((site_id, None))
+        feeds.update([(site_id, category_id) for category_id in category_ids])
+    return feeds
+
+def patch_feeds(model, feeds, pk_list, deleted = False):
+    """
+        Patches the feeds that are cached, for every live cache version, leaving the rest to be built when requested.
+
+        @type feeds: list
+        @param feeds: (site id, category id) pairs, from get_feeds_for.
+    """
+    if not feeds or not pk_list:
+        return
+    keys = [get_feed_cache_key(model, site_id, category_id, version) for site_id, category_id in feeds for version in get_cache_versions()]
+    for key in cache.get_many(keys):
+        patch_cached(model, key, pk_list, deleted)
+
+
+def patch_on_save(sender, instance, raw = False, **kwargs):
+    """
+        post_save handler.
+    """
+    if not raw:
+        patch_feeds(sender, get_feeds_for(sender, [instance.pk]), [instance.pk])
+
+def patch_on_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+        m2m_changed handler for the sites and categories relations. Content leaving a site or category is patched out of
+        its feeds too. A clear from the site or category side doesn't say which content it removed, and is left to
+        settings.FEED_CACHE_SECONDS.
+    """
+    if not reverse:
+        content_model = instance.__class__
+        if action == 'pre_clear':
+            instance._feeds_previous = get_feeds_for(content_model, [instance.pk])
+        elif action in ('post_add', 'post_remove', 'post_clear'):
+            if model is Site:
+                feeds = get_feeds_for(content_model, [instance.pk], site_ids = pk_set or ())
+            else:
+                feeds = get_feeds_for(content_model, [instance.pk], category_ids = pk_set or ())
+            patch_feeds(content_model, feeds | getattr(instance, '_feeds_previous', set()), [instance.pk])
+            instance._feeds_previous = set()
+    elif action in ('post_add', 'post_remove') and pk_set:
+        if isinstance(instance, Site):
+            feeds = get_feeds_for(model, pk_set, site_ids = [instance.pk])
+        else:
+            feeds = get_feeds_for(model, pk_set, category_ids = [instance.pk])
+        patch_feeds(model, feeds, list(pk_set))
+
+def remember_feeds(sender, instance, **kwargs):
+    """
+        pre_delete handler. Stores the feeds the object is in, while its sites and categories can still be read.
+    """
+    instance._feeds_previous = get_feeds_for(sender, [instance.pk])
+
+def patch_on_delete(sender, instance, **kwargs):
+    """
+        post_delete handler.
+    """
+    patch_feeds(sender, getattr(instance, '_feeds_previous', set()), [instance.pk], deleted = True)
+
+def patch_on_bulk_save(sender, instances, **kwargs):
+    """
+        post_bulk_save handler, for transitions such as make_public and for imports.
+    """
+    pk_list = [instance.pk for instance in instances]
+    patch_feeds(sender, get_feeds_for(sender, pk_list), pk_list)
+
+def patch_on_bulk_delete(sender, pk_list, **kwargs):
+    """
+        pre_bulk_delete handler.
+    """
+    patch_feeds(sender, get_feeds_for(sender, pk_list), pk_list, deleted = True)
+
+def register(model):
+    """
+        Starts patching a content model's cached feeds. The model needs sites, categories and authors relations, the
+        published manager and get_photo, as GenericContent subclasses have.
+    """
+    if model in registered_models:
+        return
+    registered_models.add(model)
+
+    post_save.connect(patch_on_save, sender = model)
+    pre_delete.connect(remember_feeds, sender = model)
+    post_delete.connect(patch_on_delete, sender = model)
+    m2m_changed.connect(patch_on_m2m_changed, sender = model.sites.through)
+    m2m_changed.connect(patch_on_m2m_changed, sender = model.categories.through)
+    post_bulk_save.connect(patch_on_bulk_save, sender = model)
+    pre_bulk_delete.connect(patch_on_bulk_delete, sender = model)
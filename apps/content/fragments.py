@@ -0,0 +1,206 @@
+"""
+    Fragment caching for content pages.
+
+    Wrapping part of a detail template in {% fragment content "name" timeout %} ... {% endfragment %} caches that part
+    on its own, under a key tied to the object's model cache key. With settings.CACHE_FRAGMENTS on, content_display
+    caches the rest of the page as a long-lived shell with a placeholder where each fragment goes. Requests then only
+    fetch the shell and fragments and fill the placeholders, re-rendering just the fragments that have expired, so a
+    volatile block like a comment count can have a short timeout without the whole article being re-rendered.
+
+    Saving or deleting an object moves it to a new fragment generation, which orphans its shell and fragments together.
+    invalidate_fragment in cache_utils clears a single fragment. The shell and fragments are also tagged with the
+    object's cache tags, so a change to anything shown on the page, such as one of its categories, drops them too.
+"""
+import re
+
+from django import template
+from django.conf import settings
+from django.template.loader import get_template
+
+from apps.utilities.cache.cache_utils import get_fragment_cache_key, get_fragment_generation
+from apps.utilities.cache.tags import get_many_tagged, get_tag_generations, get_tagged, set_tagged
+from apps.utilities.sites.current import get_site_id
+from apps.utilities.stats import request_stats
+
+PLACEHOLDER = "<!--griffon:fragment:%s-->"
+PLACEHOLDER_RE = re.compile(r"<!--griffon:fragment:([\w.-]+)-->")
+
+# Set in the context while a page shell is being rendered, so fragments leave placeholders instead of their content
+# and record themselves.
+SHELL_FLAG = 'griffon_fragment_shell'
+
+# The fragment nodes of each template, by name, as recorded by the last shell render in this process. Fragments can
+# come from parent templates or includes, which aren't reachable from the template's own nodelist.
+fragment_nodes = {}
+
+
+def get_generations(context):
+    """
+        Returns the fragment generations already looked up while rendering, by (class, id), so each is read once per page.
+    """
+    if 'griffon_fragment_generations' not in context.render_context:
+        context.render_context['griffon_fragment_generations'] = {}
+    return context.render_context['griffon_fragment_generations']
+
+def get_tag_generations_for(context, content_obj):
+    """
+        Returns the generations of an object's cache tags, read once per page.
+    """
+    if 'griffon_fragment_tags' not in context.render_context:
+        context.render_context['griffon_fragment_tags'] = {}
+    tag_generations = context.render_context['griffon_fragment_tags']
+    key = (content_obj.__class__, content_obj.id)
+    if key not in tag_generations:
+        tag_generations[key] = get_tag_generations(content_obj.get_cache_tags())
+    return tag_generations[key]
+
+
+class FragmentNode(template.Node):
+    """
+        A part of a template cached on its own for one content object.
+
+        @type content_var: L{FilterExpression}
+        @cvar content_var: Resolves to the content object the fragment belongs to.
+
+        @type name: string
+        @cvar name: The fragment's name, unique within the page.
+
+        @type timeout_var: L{FilterExpression} or None
+        @cvar timeout_var: Resolves to the fragment's timeout in seconds. Defaults to settings.CACHE_LONG_SECONDS.
+    """
+    def __init__(self, content_var, name, timeout_var, nodelist):
+        self.content_var = content_var
+        self.name = name
+        self.timeout_var = timeout_var
+        self.nodelist = nodelist
+
+    def get_cache_key(self, context):
+        content_obj = self.content_var.resolve(context)
+        generations = get_generations(context)
+        generation_key = (content_obj.__class__, content_obj.id)
+        if generation_key not in generations:
+            generations[generation_key] = get_fragment_generation(content_obj.__class__, content_obj.id)
+        return get_fragment_cache_key(content_obj.__class__, content_obj.id, self.name, generations[generation_key], get_site_id())
+
+    def get_timeout(self, context):
+        if self.timeout_var is None:
+            return settings.CACHE_LONG_SECONDS
+        try:
+            return int(self.timeout_var.resolve(context))
+        except (ValueError, TypeError):
+            raise template.TemplateSyntaxError("fragment %s: timeout must be a number of seconds." % self.name)
+
+    def is_staff(self, context):
+        request = context.get('request')
+        return request is not None and getattr(request, 'user', None) is not None and request.user.is_staff
+
+    def render_fresh(self, context, cache_key = None):
+        """
+            Renders the fragment and caches it. Staff may be looking at a draft, so their renders aren't cached.
+        """
+        if self.is_staff(context):
+            return self.nodelist.render(context)
+        # Read before rendering, so an invalidation during the render leaves the fragment stale rather than lost.
+        tag_generations = get_tag_generations_for(context, self.content_var.resolve(context))
+        output = self.nodelist.render(context)
+        set_tagged(cache_key or self.get_cache_key(context), output, tag_generations, self.get_timeout(context))
+        return output
+
+    def render(self, context):
+        shell_fragments = context.get(SHELL_FLAG)
+        if shell_fragments is not None:
+            shell_fragments[self.name] = self
+            return PLACEHOLDER % self.name
+        if self.is_staff(context):
+            return self.nodelist.render(context)
+        cache_key = self.get_cache_key(context)
+        output = get_tagged(cache_key)
+        if output is None:
+            output = self.render_fresh(context, cache_key)
+        return output
+
+
+def render_shell(template_name, context):
+    """
+        Renders a page with placeholders in place of its fragments, and records the fragments' nodes.
+
+        @rtype: string
+        @return: The shell.
+    """
+    context.push()
+    try:
+        shell_fragments = context[SHELL_FLAG] = {}
+        shell = get_template(template_name).render(context)
+    finally:
+        context.pop()
+    fragment_nodes[template_name] = shell_fragments
+    return shell
+
+def compose(shell, nodes, context):
+    """
+        Fills a page shell's placeholders with their fragments, fetching all of them with one get_many and
+        re-rendering only the ones missing from the cache.
+
+        @type shell: string
+        @param shell: The rendered page shell.
+
+        @type nodes: dict
+        @param nodes: The fragment nodes of the shell's template, by name.
+
+        @type context: L{Context}
+        @param context: The context the fragments are rendered with.
+
+        @rtype: string
+        @return: The page.
+    """
+    names = PLACEHOLDER_RE.findall(shell)
+    if not names:
+        return shell
+    keys = dict((name, nodes[name].get_cache_key(context)) for name in names)
+    found = get_many_tagged(keys.values())
+    request_stats.record('content_display.fragments', len(found) == len(keys) and 'hit' or found and 'partial' or 'miss')
+
+    outputs = {}
+    for name, key in keys.items():
+        outputs[name] = found.get(key)
+        if outputs[name] is None:
+            outputs[name] = nodes[name].render_fresh(context, key)
+    return PLACEHOLDER_RE.sub(lambda match: outputs.get(match.group(1), ''), shell)
+
+def render_fragmented(template_name, content_obj, context, tag_generations = None):
+    """
+        Renders a content page from its cached shell and fragments, rendering and caching the shell first if it's missing.
+        The shell is kept for settings.CACHE_FRAGMENTS seconds.
+
+        @type template_name: string
+        @param template_name: The detail template.
+
+        @type content_obj: L{GenericContent}
+        @param content_obj: The object the page is for.
+
+        @type context: L{Context}
+        @param context: The context to render with, usually a RequestContext.
+
+        @type tag_generations: dict
+        @param tag_generations: The generations of the object's cache tags, if the caller has already read them.
+
+        @rtype: string
+        @return: The page.
+    """
+    if tag_generations is not None:
+        context.render_context['griffon_fragment_tags'] = {(content_obj.__class__, content_obj.id): tag_generations}
+    generation = get_fragment_generation(content_obj.__class__, content_obj.id)
+    shell_key = get_fragment_cache_key(content_obj.__class__, content_obj.id, 'shell', generation, get_site_id())
+    shell = get_tagged(shell_key)
+    nodes = fragment_nodes.get(template_name, {})
+    # A process that hasn't rendered this template's shell yet doesn't know its fragments, so it renders the shell once.
+    if shell is not None and not set(PLACEHOLDER_RE.findall(shell)) <= set(nodes):
+        shell = None
+    request_stats.record('content_display.shell', shell is not None and 'hit' or 'miss')
+    if shell is None:
+        shell_tag_generations = get_tag_generations_for(context, content_obj)
+        shell = render_shell(template_name, context)
+        nodes = fragment_nodes[template_name]
+        set_tagged(shell_key, shell, shell_tag_generations, settings.CACHE_FRAGMENTS)
+    get_generations(context)[(content_obj.__class__, content_obj.id)] = generation
+    return compose(shell, nodes, context)
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from apps.content import bake
+from apps.utilities.bulk.bulk_utils import chunked
+
+
+def init_worker():
+    # Forked workers must not share the parent's DB connection.
+    connection.close()
+
+def get_public(model):
+    """
+        @rtype: L{QuerySet}
+        @return: The model's content that is public on any site, as the published manager finds it on one.
+    """
+    now = datetime.now()
+    return model._default_manager.filter(status = model.STATUS_CHOICES.public, publish_at__lte = now).filter(Q(expires_at__isnull = True) | Q(expires_at__gte = now))
+
+def bake_batch(args):
+    """
+        Bakes a batch of objects in a worker process.
+
+        @rtype: tuple
+        @return: (baked, skipped)
+    """
+    model, ids = args
+    baked = 0
+    for content_obj in get_public(model).filter(pk__in = ids):
+        if bake.bake(content_obj):
+            baked += 1
+    return baked, len(ids) - baked
+
+
+class Command(BaseCommand):
+    """
+        Bakes every public page, for each site it's on, to settings.STATIC_BAKE_ROOT, spread over several processes,
+        then removes pages for anything no longer public. Saves keep the baked pages current after that, except for
+        expiry, which doesn't save anything: run with --sweep every few minutes to remove pages for content that has
+        just expired.
+    """
+    help = "Bakes public content pages to static files."
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', dest='processes', type='int', default=cpu_count(), help='Number of worker processes for a full bake.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=100, help='Objects per batch handed to a worker.'),
+        make_option('--sweep', dest='sweep', action='store_true', default=False, help='Only remove the pages of recently expired content.'),
+        make_option('--since', dest='since', type='int', default=60 * 24, help='With --sweep, how many minutes back to look for expired content.'),
+    )
+
+    def handle(self, *args, **options):
+        if not settings.STATIC_BAKE_ROOT:
+            raise CommandError("settings.STATIC_BAKE_ROOT isn't set.")
+
+        for model in bake.registered_models:
+            if not options['sweep']:
+                self.bake_all(model, options['processes'], options['batch_size'])
+                since = None
+            else:
+                since = datetime.now() - timedelta(minutes = options['since'])
+            self.sweep(model, since)
+
+    def bake_all(self, model, processes, batch_size):
+        ids = list(get_public(model).order_by('-publish_at').values_list('id', flat = True))
+        # Close the connection before forking, so each worker opens its own.
+        connection.close()
+        pool = Pool(processes, initializer = init_worker)
+        baked = skipped = 0
+        try:
+            for batch_baked, batch_skipped in pool.imap_unordered(bake_batch, [(model, batch) for batch in chunked(ids, batch_size)]):
+                baked += batch_baked
+                skipped += batch_skipped
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write("%s: baked %d pages, skipped %d\n" % (model._meta.object_name, baked, skipped))
+
+    def sweep(self, model, since = None):
+        """
+            Removes the pages of objects that are no longer public: drafts, scheduled content, and content that
+            expired after since, or at any time if since is None.
+        """
+        now = datetime.now()
+        expired = model._default_manager.filter(expires_at__lte = now)
+        if since is not None:
+            expired = expired.filter(expires_at__gte = since)
+        else:
+            expired = expired | model._default_manager.filter(status = model.STATUS_CHOICES.draft) | model._default_manager.filter(publish_at__gt = now)
+
+        removed = 0
+        for pk, slug, publish_at in expired.values_list('pk', 'slug', 'publish_at').iterator():
+            if bake.unbake_url(model(pk = pk, slug = slug, publish_at = publish_at).get_absolute_url()):
+                bake.forget_tags(model, [pk])
+                removed += 1
+        self.stdout.write("%s: removed %d pages\n" % (model._meta.object_name, removed))
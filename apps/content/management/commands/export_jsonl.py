@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.utilities.jsonl import export
+
+
+class Command(BaseCommand):
+    """
+        Streams content, categories, their relations and image metadata to JSONL files, in constant memory, in place of
+        dumpdata. Run it again with --resume to finish an export that was interrupted.
+    """
+    help = "Exports content and media metadata as JSONL files."
+    args = '<output directory>'
+    option_list = BaseCommand.option_list + (
+        make_option('--streams', dest='streams', default=None, help='Comma separated streams to export, such as article,article.categories. Defaults to all of them.'),
+        make_option('--partitions', dest='partitions', type='int', default=1, help='Split each stream into this many pk ranges, written by as many processes.'),
+        make_option('--resume', dest='resume', action='store_true', default=False, help='Finish the export already in the directory.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=5000, help='Rows fetched at a time.'),
+        make_option('--window-size', dest='window_size', type='int', default=100000, help='Rows read per server-side cursor, and so per transaction.'),
+        make_option('--list', dest='list', action='store_true', default=False, help='List the streams and exit.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for stream in export.get_streams():
+                self.stdout.write("%s\n" % stream.name)
+            return
+        if len(args) != 1:
+            raise CommandError("Give the directory to export to.")
+
+        stream_names = options['streams'] and options['streams'].split(',') or None
+        try:
+            written = export.export(args[0], stream_names, max(options['partitions'], 1), options['resume'], options['batch_size'], options['window_size'])
+        except export.ExportError, e:
+            raise CommandError(str(e))
+        for name in sorted(written):
+            self.stdout.write("%s: %d rows\n" % (name, written[name]))
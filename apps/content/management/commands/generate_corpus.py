@@ -0,0 +1,66 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.content.corpus import CorpusGenerator
+
+
+class Command(BaseCommand):
+    """
+        Fills the database with a synthetic corpus for scale testing, such as millions of articles over hundreds of
+        sites, a deep category tree and crowded daily image directories. Rows are added to whatever is already there,
+        so never run it against a production database.
+    """
+    help = "Generates a large synthetic corpus of sites, categories, authors, images and articles."
+    option_list = BaseCommand.option_list + (
+        make_option('--articles', dest='articles', type='int', default=10000, help='Number of articles.'),
+        make_option('--categories', dest='categories', type='int', default=200, help='Number of categories.'),
+        make_option('--category-depth', dest='category_depth', type='int', default=4, help='Depth of the category tree.'),
+        make_option('--category-fanout', dest='category_fanout', type='int', default=6, help='Children per category, and the number of roots.'),
+        make_option('--category-skew', dest='category_skew', type='float', default=1.2, help='Pareto shape for articles per category. Lower is more skewed; 0 is even.'),
+        make_option('--categories-per-article', dest='categories_per_article', type='int', default=3, help='Most categories per article.'),
+        make_option('--sites', dest='sites', type='int', default=10, help='Number of sites, including the current one.'),
+        make_option('--sites-per-article', dest='sites_per_article', type='int', default=2, help='Most extra sites per article besides the current one.'),
+        make_option('--authors', dest='authors', type='int', default=50, help='Number of author users.'),
+        make_option('--images', dest='images', type='int', default=5000, help='Number of images.'),
+        make_option('--images-per-day', dest='images_per_day', type='int', default=200, help='Images per daily upload directory.'),
+        make_option('--image-files', dest='image_files', action='store_true', default=False, help='Write a file for each image, hard linked to one small PNG.'),
+        make_option('--future-ratio', dest='future_ratio', type='float', default=0.01, help='Fraction of articles scheduled in the future.'),
+        make_option('--expired-ratio', dest='expired_ratio', type='float', default=0.02, help='Fraction of articles already expired.'),
+        make_option('--draft-ratio', dest='draft_ratio', type='float', default=0.05, help='Fraction of articles that are drafts.'),
+        make_option('--days', dest='days', type='int', default=365 * 3, help='Days back that publish dates are spread over.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=2000, help='Rows written per query.'),
+        make_option('--seed', dest='seed', type='int', default=1, help='Random seed. The same options and seed give the same corpus.'),
+    )
+
+    def handle(self, *args, **options):
+        for ratio in ('future_ratio', 'expired_ratio', 'draft_ratio'):
+            if not 0 <= options[ratio] <= 1:
+                raise CommandError("--%s must be between 0 and 1." % ratio.replace('_', '-'))
+        if options['future_ratio'] + options['expired_ratio'] > 1:
+            raise CommandError("--future-ratio and --expired-ratio can't add up to more than 1.")
+        if options['images_per_day'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--images-per-day and --batch-size must be at least 1.")
+
+        generator = CorpusGenerator(
+            articles = options['articles'],
+            categories = options['categories'],
+            category_depth = options['category_depth'],
+            category_fanout = options['category_fanout'],
+            category_skew = options['category_skew'],
+            categories_per_article = options['categories_per_article'],
+            sites = options['sites'],
+            sites_per_article = options['sites_per_article'],
+            authors = options['authors'],
+            images = options['images'],
+            images_per_day = options['images_per_day'],
+            image_files = options['image_files'],
+            future_ratio = options['future_ratio'],
+            expired_ratio = options['expired_ratio'],
+            draft_ratio = options['draft_ratio'],
+            days = options['days'],
+            batch_size = options['batch_size'],
+            random_seed = options['seed'],
+            log = lambda message: self.stdout.write(message + "\n"),
+        )
+        generator.generate()
@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.content import sitemaps
+
+
+class Command(BaseCommand):
+    """
+        Writes a site's sitemaps and sitemap index under settings.SITEMAP_ROOT. Only the shards whose content changed
+        since the last run are rewritten, so it can run from cron as often as the sitemaps should be fresh.
+    """
+    help = "Generates gzipped sitemap shards and a sitemap index for a site."
+    option_list = BaseCommand.option_list + (
+        make_option('--site', dest='site_id', type='int', default=None, help='The site to generate for. Defaults to settings.SITE_ID.'),
+        make_option('--full', dest='full', action='store_true', default=False, help='Rewrite every shard, re-splitting the id ranges.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=5000, help='Rows read per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if not settings.SITEMAP_ROOT:
+            raise CommandError("settings.SITEMAP_ROOT isn't set.")
+        site_id = options['site_id'] or settings.SITE_ID
+        written, kept = sitemaps.generate(site_id, options['full'], options['batch_size'])
+        self.stdout.write("Site %s: wrote %d shards, %d unchanged\n" % (site_id, written, kept))
@@ -0,0 +1,47 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model
+
+from apps.utilities.jsonl import load
+
+
+class Command(BaseCommand):
+    """
+        Creates content in bulk from JSONL or CSV files, such as wire stories, in batches of bulk_create with their
+        relations, one revision and one round of cache invalidation per batch. See L{apps.utilities.jsonl.load} for
+        the formats.
+    """
+    help = "Imports new content from JSONL or CSV files."
+    args = '<file> [<file> ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--model', dest='model', default='content.article', help='The model to create, as app_label.model. Defaults to content.article.'),
+        make_option('--format', dest='format', default=None, choices=('jsonl', 'csv'), help='jsonl or csv. Defaults to the file extension.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=500, help='Objects created per transaction.'),
+        make_option('--user', dest='username', default=None, help='The username the revisions are attributed to.'),
+        make_option('--comment', dest='comment', default='Imported.', help='The revision comment.'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("Give the files to import.")
+        model = get_model(*options['model'].split('.', 1))
+        if model is None:
+            raise CommandError("No such model: %s" % options['model'])
+        user = None
+        if options['username']:
+            try:
+                user = User.objects.get(username = options['username'])
+            except User.DoesNotExist:
+                raise CommandError("No such user: %s" % options['username'])
+
+        for path in args:
+            file_format = options['format'] or (path.lower().endswith('.csv') and 'csv' or 'jsonl')
+            with open(path, 'rb') as import_file:
+                records = file_format == 'csv' and load.read_csv(import_file) or load.read_jsonl(import_file)
+                try:
+                    count = load.load(model, records, options['batch_size'], user, options['comment'])
+                except load.LoadError, e:
+                    raise CommandError("%s: %s" % (path, e))
+            self.stdout.write("%s: created %d objects\n" % (path, count))
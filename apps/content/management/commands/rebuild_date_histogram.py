@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from apps.content import date_histogram
+
+
+class Command(BaseCommand):
+    """
+        Recomputes the ContentDateCount histogram for every registered content model.
+        Run it once after installing the table, or whenever the counts are suspected of drifting.
+    """
+    help = "Rebuilds the publish date histogram used by date drilldowns."
+
+    def handle(self, *args, **options):
+        for model in date_histogram.registered_models:
+            rows = date_histogram.rebuild(model)
+            self.stdout.write("%s: %d histogram rows\n" % (model._meta.object_name, rows))
@@ -0,0 +1,22 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from apps.content import related
+
+
+class Command(BaseCommand):
+    """
+        Recomputes the related content lists of every registered content model from the database. Run it after
+        installing the table, after moving categories, and regularly, such as nightly, to fill in the lists that saves
+        only update around the content that changed.
+    """
+    help = "Rebuilds the precomputed related content lists."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=20000, help='Objects loaded and stored per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        for model in related.registered_models:
+            count = related.rebuild(model, options['batch_size'])
+            self.stdout.write("%s: %d related content lists\n" % (model._meta.object_name, count))
@@ -0,0 +1,55 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.categories.models import Category
+from apps.content import text_index
+from apps.utilities.bulk.bulk_utils import chunked
+
+
+class Command(BaseCommand):
+    """
+        Rebuilds the on-disk text index of every registered content model from the database, writing a segment per
+        batch and swapping them in for the old index at once, then merges them. Searches carry on against the old
+        index meanwhile. --merge-only just merges the segments saves have added, as the background merge does.
+    """
+    help = "Rebuilds the text search index under settings.SEARCH_INDEX_ROOT."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=20000, help='Objects per segment.'),
+        make_option('--no-merge', dest='merge', action='store_false', default=True, help="Leave the rebuilt segments unmerged."),
+        make_option('--merge-only', dest='merge_only', action='store_true', default=False, help='Only merge the existing segments.'),
+    )
+
+    def handle(self, *args, **options):
+        if not settings.SEARCH_INDEX_ROOT:
+            raise CommandError("settings.SEARCH_INDEX_ROOT isn't set.")
+
+        for model in text_index.registered_models:
+            index = text_index.get_index(model)
+            if not options['merge_only']:
+                count = index.rebuild(self.batches(model, options['batch_size']))
+                self.stdout.write("%s: indexed %d objects\n" % (model._meta.object_name, count))
+            if options['merge'] and index.merge(full = not options['merge_only']):
+                self.stdout.write("%s: merged segments\n" % model._meta.object_name)
+
+    def batches(self, model, batch_size):
+        """
+            Yields the index documents a batch at a time. Sites and categories are prefetched, and the categories' parents
+            are found from their paths, rather than querying for each object.
+        """
+        category_paths = dict(Category.objects.values_list('path', 'id'))
+        ids = list(model._default_manager.order_by('id').values_list('id', flat = True))
+        for batch in chunked(ids, batch_size):
+            documents = []
+            # Fetched in smaller chunks, to stay under SQLite's limit on query parameters.
+            for chunk in chunked(batch):
+                for content_obj in model._default_manager.filter(pk__in = chunk).prefetch_related('sites', 'categories'):
+                    category_ids = set()
+                    for category in content_obj.categories.all():
+                        for depth in range(1, category.depth + 1):
+                            category_ids.add(category_paths.get(category.path[0:depth * Category.steplen]))
+                    category_ids.discard(None)
+                    site_ids = [site.id for site in content_obj.sites.all()]
+                    documents.append(text_index.get_document(content_obj, site_ids, category_ids))
+            yield documents
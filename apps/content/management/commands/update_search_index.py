@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.content import search
+from apps.utilities.bulk.bulk_utils import chunked
+
+
+class Command(BaseCommand):
+    """
+        Adds the search_vector column to tables that predate it, then rebuilds every row's search vector in batches.
+        Saves keep the vectors current after that. Run it again after changing settings.SEARCH_CONFIG, or after
+        loading rows without signals, such as with the corpus generator's COPY.
+    """
+    help = "Builds the full-text search vectors for content."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=5000, help='Rows updated per statement.'),
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Full-text search vectors need Postgres; other databases search with icontains.")
+
+        for model in search.registered_models:
+            if search.install(model):
+                self.stdout.write("%s: added the %s column\n" % (model._meta.object_name, search.VECTOR_COLUMN))
+            updated = 0
+            ids = list(model._default_manager.order_by('id').values_list('id', flat = True))
+            for batch in chunked(ids, options['batch_size']):
+                updated += search.update_search_vectors(model, batch)
+            self.stdout.write("%s: indexed %d rows\n" % (model._meta.object_name, updated))
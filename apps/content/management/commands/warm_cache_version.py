@@ -0,0 +1,103 @@
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models.loading import get_model
+
+from apps.categories.models import Category
+from apps.contentinfo.models import GFContentType
+from apps.utilities.bulk.bulk_utils import chunked
+from apps.utilities.cache.cache_utils import get_cache_versions, get_content_type_cache_key, get_model_cache_key, get_model_cache_mapping
+from apps.utilities.cache.tags import get_tag, get_tag_generations, make_tagged
+
+
+def warm_batch(model, version, site_id, ids):
+    """
+        Caches a batch of public objects, with their categories, under the keys for a group cache version.
+        Runs in a worker thread, so it closes the thread's DB connection when done.
+
+        @rtype: int
+        @return: The number of objects cached.
+    """
+    try:
+        mapping = {}
+        count = 0
+        for content_obj in model.published.filter(pk__in = ids):
+            count += 1
+            mapping.update(get_model_cache_mapping(model, content_obj, site_id, version))
+            categories = content_obj.get_categories()
+            # Tagged like get_categories does, against the tag generations of the version being warmed.
+            tags = [get_tag(model, content_obj.id)] + [get_tag(Category, category.id) for category in categories or []]
+            mapping[get_model_cache_key(model, content_obj.id, version = version) + "::categories"] = make_tagged(categories, get_tag_generations(tags, version))
+        cache.set_many(mapping, settings.CACHE_LONG_SECONDS)
+        return count
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    """
+        Fills the cache keys for a group cache version ahead of switching to it.
+
+        Bumping GROUP_CACHE_VERSION orphans every content key at once. Run this with --cache-version set to the new version
+        before the deploy, so the most requested content is already cached when the switch happens. By default the
+        most recently updated public content is warmed; --ids-file can supply ids from access logs or stats instead,
+        one "<content type short name> <id>" pair per line, most requested first.
+
+        Deploy settings.GROUP_CACHE_NEXT_VERSION set to the new version first, so edits made after the warm-up clear the
+        keys it filled. settings.CACHE_VERSION doesn't key any of these caches, so bumping it needs no warm-up.
+    """
+    help = "Warms the content cache keys for a group cache version."
+    option_list = BaseCommand.option_list + (
+        make_option('--cache-version', dest='cache_version', type='int', default=None, help='The group cache version to warm. Defaults to settings.GROUP_CACHE_VERSION.'),
+        make_option('--limit', dest='limit', type='int', default=10000, help='Number of objects to warm per content type.'),
+        make_option('--ids-file', dest='ids_file', default=None, help='File of "<short name> <id>" lines to warm, instead of the most recently updated content.'),
+        make_option('--workers', dest='workers', type='int', default=4, help='Number of worker threads.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=200, help='Number of objects fetched and cached per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        version = options['cache_version'] or settings.GROUP_CACHE_VERSION
+        if version not in get_cache_versions():
+            self.stderr.write("Warning: edits won't clear the keys for version %s until it is deployed. Set GROUP_CACHE_NEXT_VERSION to it first.\n" % version)
+        requested = self.read_ids_file(options['ids_file'])
+
+        pool = ThreadPool(options['workers'])
+        try:
+            for ctype in GFContentType.objects.all():
+                cache.set(get_content_type_cache_key(ctype.short_name, version), ctype.model_name, settings.CACHE_LONG_SECONDS)
+                model = get_model('content', ctype.model_name.lower())
+                if model is None:
+                    continue
+
+                if requested is not None:
+                    ids = requested.get(ctype.short_name.lower(), [])[:options['limit']]
+                else:
+                    ids = list(model.published.order_by('-updated_at').values_list('id', flat = True)[:options['limit']])
+
+                warm = partial(warm_batch, model, version, settings.SITE_ID)
+                count = sum(pool.map(warm, list(chunked(ids, options['batch_size']))))
+                self.stdout.write("%s: cached %d objects for version %s\n" % (ctype.full_name, count, version))
+        finally:
+            pool.close()
+            pool.join()
+
+    def read_ids_file(self, path):
+        """
+            Reads the ids to warm from a file.
+
+            @rtype: dict or None
+            @return: Maps content type short names to lists of ids, in file order. None if no file was given.
+        """
+        if not path:
+            return None
+        requested = {}
+        for line in open(path):
+            parts = line.split()
+            if len(parts) == 2 and parts[1].isdigit():
+                requested.setdefault(parts[0].lower(), []).append(int(parts[1]))
+        return requested
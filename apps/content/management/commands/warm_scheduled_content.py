@@ -0,0 +1,119 @@
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.http import Http404
+
+from apps.content.bake import bake
+from apps.content.models import Article
+from apps.content.prerender import prime_object_cache, render_public_page
+from apps.utilities.cache.cache_utils import get_model_cache_key
+
+# The content models whose publish queues are watched.
+WARMED_MODELS = (Article,)
+
+
+class Command(BaseCommand):
+    """
+        Watches the publish queue and warms the caches for scheduled content as it goes live.
+
+        A few seconds ahead of an object's publish_at, its content type, object, slug and category caches are filled.
+        content_display won't show a cached object to the public before it is live, so this is safe to do early.
+        Once publish_at passes, the page itself is rendered, which fills the HTML cache when settings.CACHE_HTML is on,
+        and bakes it when settings.STATIC_BAKE_ROOT is set.
+
+        Each step is claimed with cache.add before it runs, so any number of warmers can watch the same queue and each
+        object is only warmed once. Rescheduling an object gives it new claims.
+    """
+    help = "Warms the caches for content scheduled to publish in the near future."
+    option_list = BaseCommand.option_list + (
+        make_option('--lead', dest='lead', type='int', default=5, help='Seconds ahead of publish_at to fill the object caches.'),
+        make_option('--horizon', dest='horizon', type='int', default=60, help='Seconds ahead to look in the publish queue on each pass.'),
+        make_option('--loop', dest='loop', action='store_true', default=False, help='Keep watching the queue instead of making a single pass.'),
+    )
+
+    def handle(self, *args, **options):
+        self.lead = timedelta(seconds = options['lead'])
+        self.horizon = timedelta(seconds = options['horizon'])
+        self.worker = "%s:%s" % (socket.gethostname(), os.getpid())
+
+        since = datetime.now()
+        while True:
+            read_at = datetime.now()
+            pass_end = read_at + self.horizon
+            self.warm_until(since, pass_end)
+            if not options['loop']:
+                break
+            self.sleep_until(pass_end)
+            # The next pass reads the queue from when this one read it, so anything scheduled during this pass to
+            # publish before it ended is still picked up, even though it's live by then. The claims stop anything
+            # this pass warmed from being warmed again.
+            since = read_at
+
+    def get_schedule(self, since, until):
+        """
+            Returns the warm-up steps for everything publishing after since and by until, in the order they should run.
+
+            @rtype: list
+            @return: List of (run_at, step, model, id, publish_at) tuples.
+        """
+        steps = []
+        for model in WARMED_MODELS:
+            queue = model.objects.filter(status = model.STATUS_CHOICES.public, sites__id__exact = settings.SITE_ID, publish_at__gt = since, publish_at__lte = until + self.lead).values_list('id', 'publish_at').distinct()
+            for id, publish_at in queue:
+                steps.append((publish_at - self.lead, 'object', model, id, publish_at))
+                steps.append((publish_at, 'page', model, id, publish_at))
+        steps.sort(key = lambda step: step[0])
+        return steps
+
+    def warm_until(self, since, until):
+        """
+            Runs every warm-up step due before until for content publishing after since, sleeping between them. Steps
+            already due run straight away.
+        """
+        for run_at, step, model, id, publish_at in self.get_schedule(since, until):
+            if run_at > until:
+                break
+            self.sleep_until(run_at)
+
+            # Re-read the object, since it may have been edited or unscheduled since the queue was read.
+            try:
+                content_obj = model.objects.get(id = id, sites__id__exact = settings.SITE_ID)
+            except model.DoesNotExist:
+                continue
+            if content_obj.status != model.STATUS_CHOICES.public or content_obj.publish_at != publish_at:
+                continue
+            if not self.claim(content_obj, step):
+                continue
+
+            if step == 'object':
+                prime_object_cache(content_obj, settings.SITE_ID)
+            elif settings.STATIC_BAKE_ROOT:
+                # Baking renders the page too, filling the same caches.
+                bake(content_obj)
+            else:
+                try:
+                    render_public_page(content_obj)
+                except Http404:
+                    pass
+            self.stdout.write("%s %s %s %s\n" % (datetime.now().isoformat(), step, model._meta.object_name, id))
+
+    def claim(self, content_obj, step):
+        """
+            Claims a warm-up step for this worker.
+
+            @rtype: boolean
+            @return: True if this worker should run the step, False if another worker already has.
+        """
+        claim_key = "%s::warm::%s::%s" % (get_model_cache_key(content_obj.__class__, content_obj.id, settings.SITE_ID), step, content_obj.publish_at.strftime('%Y%m%d%H%M%S'))
+        return cache.add(claim_key, self.worker, int((self.horizon + self.lead).total_seconds()) * 2)
+
+    def sleep_until(self, moment):
+        delay = (moment - datetime.now()).total_seconds()
+        if delay > 0:
+            time.sleep(delay)
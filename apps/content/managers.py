@@ -1,23 +1,95 @@
-from datetime import datetime
+from datetime import datetime, date
 
 from django.db import models
-from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+
+from apps.utilities.sites.current import get_site_id
 
 class GenericContentManager(models.Manager):
     """
         Manager class which only displays results which have been published and are public.
     """
     def get_query_set(self):
-        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 2, sites__id__exact=settings.SITE_ID).filter(models.Q(expires_at__isnull =True) | models.Q(expires_at__gte = datetime.now()))
+        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 2, sites__id__exact=get_site_id()).filter(models.Q(expires_at__isnull =True) | models.Q(expires_at__gte = datetime.now()))
 
     def all(self):
-        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 2, sites__id__exact=settings.SITE_ID).filter(models.Q(expires_at__isnull =True) | models.Q(expires_at__gte = datetime.now()))
+        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 2, sites__id__exact=get_site_id()).filter(models.Q(expires_at__isnull =True) | models.Q(expires_at__gte = datetime.now()))
+
+    def for_site(self, site_id):
+        """
+            Like all(), for any site rather than just the current one, for work such as feeds that spans the sites in a group.
+        """
+        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 2, sites__id__exact=site_id).filter(models.Q(expires_at__isnull =True) | models.Q(expires_at__gte = datetime.now()))
 
     def filter_is_future(self):
-        return super(GenericContentManager, self).get_query_set().filter(publish_at__gte = datetime.now(), status = 2, sites__id__exact=settings.SITE_ID)
+        return super(GenericContentManager, self).get_query_set().filter(publish_at__gte = datetime.now(), status = 2, sites__id__exact=get_site_id())
 
     def filter_is_draft(self):
-        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 1, sites__id__exact=settings.SITE_ID)
+        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 1, sites__id__exact=get_site_id())
 
     def filter_disallow_comments(self):
-        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 2, allow_comments__exact=False, sites__id__exact=settings.SITE_ID)
+        return super(GenericContentManager, self).get_query_set().filter(publish_at__lte = datetime.now(), status = 2, allow_comments__exact=False, sites__id__exact=get_site_id())
+
+class ContentDateCountManager(models.Manager):
+    """
+        Manager for the ContentDateCount histogram. Reads the dates which have content from the histogram, so date
+        drilldowns and archive navigation never aggregate over the content tables.
+    """
+    def for_model(self, model, site_id = None, status = None):
+        """
+            Returns the non-empty histogram rows for a content model, optionally narrowed to a site and/or status.
+        """
+        qs = self.get_query_set().filter(content_type = ContentType.objects.get_for_model(model), count__gt = 0)
+        if site_id:
+            qs = qs.filter(site__id = site_id)
+        if status:
+            qs = qs.filter(status = status)
+        return qs
+
+    def dates(self, model, kind, year = None, month = None, site_id = None, status = None):
+        """
+            The histogram equivalent of QuerySet.dates('publish_at', kind).
+            
+            @param model: The content model.
+            @type model: class
+            
+            @param kind: One of 'year', 'month' or 'day'.
+            @type kind: string
+            
+            @param year: Restrict the results to this year.
+            @type year: int
+            
+            @param month: Restrict the results to this month. Only used with year.
+            @type month: int
+            
+            @rtype: list
+            @return: A list of (date, count) tuples in date order.
+        """
+        qs = self.for_model(model, site_id, status)
+        if year:
+            qs = qs.filter(year = year)
+            if month:
+                qs = qs.filter(month = month)
+        
+        fields = {'year': ['year'], 'month': ['year', 'month'], 'day': ['year', 'month', 'day']}[kind]
+        rows = qs.values(*fields).annotate(total = models.Sum('count')).order_by(*fields)
+        return [(date(row['year'], row.get('month', 1), row.get('day', 1)), row['total']) for row in rows]
+
+    def date_range(self, model, site_id = None, status = None):
+        """
+            Returns the first and last dates with content, or (None, None) if there isn't any.
+        """
+        qs = self.for_model(model, site_id, status).values_list('year', 'month', 'day')
+        first = list(qs.order_by('year', 'month', 'day')[:1])
+        last = list(qs.order_by('-year', '-month', '-day')[:1])
+        if not first:
+            return (None, None)
+        return (date(*first[0]), date(*last[0]))
+
+    def archive(self, model, kind, year = None, month = None, site_id = None):
+        """
+            The dates with public content on a site, for public archive navigation. Dates in the future are left out,
+            since content scheduled for them isn't visible yet.
+        """
+        today = date.today()
+        return [(day, count) for day, count in self.dates(model, kind, year, month, site_id, status = 2) if day <= today]
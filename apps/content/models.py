@@ -1,15 +1,21 @@
 from datetime import datetime
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.conf import settings
 from django.core.cache import cache
 from django.contrib.sites.models import Site
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 
 from apps.categories.models import Category
-from apps.content.managers import GenericContentManager
+from apps.content import api, bake, date_histogram, feeds, related, search, sitemaps, text_index
+from apps.content.managers import GenericContentManager, ContentDateCountManager
 from apps.utilities.easychoice import EasyChoice, EasyChoices
+from apps.utilities.jsonl import export
+from apps.utilities.cache.cache_utils import get_model_cache_key, invalidate_fragments, resave_model_cache, delete_model_cache
+from apps.utilities.cache.tags import get_tag, get_tag_generations, get_tagged, set_tagged, invalidate_tags, invalidate_object_tag, invalidate_m2m_tags
 from apps.utilities.managers.content_cache_manager import GenericContentCacheManager
 
 ######################################
@@ -102,6 +108,12 @@ class GenericContent(models.Model):
         get_latest_by = 'updated_at'
         
 
+    def get_content_type_id(self):
+        """
+            Returns the id of the object's ContentType. get_for_model keeps its own cache, so this doesn't query once warm.
+        """
+        return ContentType.objects.get_for_model(self.__class__).id
+
     def get_version_number(self):
         """
             Return the Reversion number of the content.
@@ -236,10 +248,11 @@ class GenericContent(models.Model):
         else:
             return False
 
-    def save(self, *args, **kwargs):
+    def normalize_fields(self):
         """
             If no updated date is defined, it becomes the publish date.
-            No updated date can pre-date the publish date.
+            No updated or expiry date can pre-date the publish date.
+            Called by save(), and by bulk_import, which doesn't call save(), for each object it creates.
         """
         if not self.updated_at or self.updated_at < self.publish_at:
             self.updated_at = self.publish_at
@@ -247,7 +260,12 @@ class GenericContent(models.Model):
         if self.expires_at:
             if self.expires_at < self.publish_at:
                 self.expires_at = self.publish_at
-           
+
+    def save(self, *args, **kwargs):
+        """
+            Normalizes the dates, then saves.
+        """
+        self.normalize_fields()
         super(GenericContent, self).save(*args, **kwargs)
             
     def __unicode__(self):
@@ -264,21 +282,21 @@ class GenericContent(models.Model):
             @rtype: list or None
             @return: A list of L{Category} objects sorted by path, or None if no categories were found.
         """
-        categories = self.categories.all()
-
         cache_key = get_model_cache_key(self.__class__, self.id) + "::categories"
-        final_cats = cache.get(cache_key)
+        final_cats = get_tagged(cache_key)
         if not final_cats:
-            final_cats = []
-            # Iterate through the member categories
-            for category in categories:
-                # If it isn't in the final list, add it
-                if category not in final_cats:
-                    final_cats.append(category)
-                # Get all the categories ancestors, and if they aren't in the list, add them.
-                for cat in category.get_ancestors():
-                    if cat not in final_cats:
-                        final_cats.append(cat)
+            content_tag = get_tag(self.__class__, self.id)
+            generations = get_tag_generations([content_tag])
+            final_cats = list(self.categories.all())
+            # Ancestor paths are prefixes of a category's own path, so every missing ancestor can be fetched in one query
+            # instead of calling get_ancestors for each category.
+            paths = set([category.path for category in final_cats])
+            ancestor_paths = set()
+            for category in final_cats:
+                for depth in range(1, category.depth):
+                    ancestor_paths.add(category.path[0:depth * Category.steplen])
+            if ancestor_paths - paths:
+                final_cats.extend(Category.objects.filter(path__in = list(ancestor_paths - paths)))
             
             # Sort the whole thing by path, or set the list to None if nothing was found.
             if len(final_cats) > 0:        
@@ -286,10 +304,85 @@ class GenericContent(models.Model):
             else:
                 final_cats = None
             
-            cache.set(cache_key, final_cats, settings.CACHE_LONG_SECONDS)
+            # Tagged with each category as well as the object, so renaming or moving any of them drops the list.
+            generations.update(get_tag_generations([get_tag(Category, category.id) for category in final_cats or []]))
+            set_tagged(cache_key, final_cats, generations)
         
         return final_cats
         
+    def get_cache_tags(self):
+        """
+            Returns the tags for everything shown on the object's page: the object itself, its categories and their
+            parents, its authors, its sites, its photo and its related content. Pages and fragments cached with these tags are dropped when any
+            of those objects change. See L{apps.utilities.cache.tags}.
+            
+            @rtype: list
+            @return: The tags.
+        """
+        cache_key = get_model_cache_key(self.__class__, self.id) + "::tags"
+        tags = get_tagged(cache_key)
+        if tags is None:
+            tags = [get_tag(self.__class__, self.id)]
+            tags.extend([get_tag(Category, category.id) for category in self.get_categories() or []])
+            tags.extend([get_tag(User, user_id) for user_id in self.authors.values_list('id', flat = True)])
+            site_ids = set(self.sites.values_list('id', flat = True))
+            if self.primary_site_id:
+                site_ids.add(self.primary_site_id)
+            tags.extend([get_tag(Site, site_id) for site_id in site_ids])
+            photo = self.get_photo()
+            if photo is not None:
+                tags.append(get_tag(photo.__class__, photo.id))
+            tags.extend([get_tag(self.__class__, related_id) for related_id in related.related_for(self.__class__, [self.id])[self.id]])
+            # The list is tagged with its own tags, so it's rebuilt when the categories move or the relations change.
+            set_tagged(cache_key, tags, get_tag_generations(tags))
+        return tags
+        
+
+    def get_cache_keys(self, site_ids = ()):
+        """
+            Returns the cache keys kept alongside the object's own, for clearing them along with other objects' in one
+            pass. See L{apps.utilities.cache.cache_utils.delete_model_cache_many}.
+            
+            @type site_ids: list
+            @param site_ids: The sites whose cached pages should be included.
+            
+            @rtype: list
+            @return: The cache keys.
+        """
+        model_key = get_model_cache_key(self.__class__, self.id)
+        keys = [model_key + "::categories", model_key + "::versions", model_key + "::commentcount"]
+        keys.extend([get_model_cache_key(self.__class__, self.id, site_id) + ".html" for site_id in site_ids])
+        return keys
+
+    def clear_cache(self, site_id = None):
+        """
+            Clears the cache keys kept alongside the object's own, when the object is saved or deleted.
+            
+            @type site_id: int
+            @param site_id: The site whose cached page should be cleared, or None for the keys shared by all sites.
+        """
+        if site_id is not None:
+            cache.delete(get_model_cache_key(self.__class__, self.id, site_id) + ".html")
+            return
+        cache.delete_many(self.get_cache_keys())
+        # Orphans the cached page shell and fragments.
+        invalidate_fragments(self.__class__, self.id)
+        # Drops the cached pages on every site, and anything else tagged with the object.
+        invalidate_tags([get_tag(self.__class__, self.id)])
+
+    def get_related(self, limit = 5):
+        """
+            Returns the object's related content, from the lists kept by L{apps.content.related}.
+            
+            @type limit: int
+            @param limit: The most objects to return.
+            
+            @rtype: list
+            @return: The related objects that are currently published, best first.
+        """
+        related_ids = related.related_for(self.__class__, [self.id])[self.id]
+        objects = self.__class__.published.in_bulk(related_ids)
+        return [objects[pk] for pk in related_ids if pk in objects][:limit]
 
     def get_photo(self):
         """
@@ -370,9 +463,219 @@ class Article(GenericContent):
         get_latest_by = "updated_at"
         
     def get_absolute_url(self):
-        return reverse('content_detail', args=[self.created_at.year, self.created_at.strftime('%b').lower(), self.created_at.day, self.slug, 'ar', self.id])
+        # content_display redirects any URL whose date doesn't match publish_at, so the URL has to be built from it.
+        return reverse('content_detail', args=[self.publish_at.year, self.publish_at.strftime('%b').lower(), self.publish_at.day, self.slug, 'ar', self.id])
+    
+    @classmethod
+    def get_url_format(cls):
+        """
+            Returns the URL get_absolute_url builds as a format string, for building many URLs from values() rows without
+            instantiating objects or calling reverse() for each.
+            
+            @rtype: string
+            @return: The format, taking year, month (the lowercase abbreviation), day, slug and id keys.
+        """
+        sample = reverse('content_detail', args=['1999', 'qqq', '28', 'zzslugzz', 'ar', '1234567890']).replace('%', '%%')
+        for value, key in (('1234567890', 'id'), ('zzslugzz', 'slug'), ('1999', 'year'), ('qqq', 'month'), ('28', 'day')):
+            sample = sample.replace(value, "%%(%s)s" % key, 1)
+        return sample
     
 try:
     reversion.register(Article)
 except:
-    pass
\ No newline at end of file
+    pass
+
+date_histogram.register(Article)
+search.register(Article)
+
+post_save.connect(resave_model_cache, sender=Article)
+post_delete.connect(delete_model_cache, sender=Article)
+# Cached pages are tagged with the relations they show, which change without the article being saved.
+m2m_changed.connect(invalidate_m2m_tags, sender=Article.categories.through)
+m2m_changed.connect(invalidate_m2m_tags, sender=Article.authors.through)
+m2m_changed.connect(invalidate_m2m_tags, sender=Article.sites.through)
+bake.register(Article)
+text_index.register(Article)
+related.register(Article)
+feeds.register(Article)
+sitemaps.register(Article)
+api.register(Article)
+export.register(Article)
+
+# The User fields content pages show for an author.
+AUTHOR_FIELDS = ('first_name', 'last_name', 'username')
+
+def invalidate_author_tag(sender, instance, update_fields = None, **kwargs):
+    """
+        User post_save handler. Logging in saves the user with update_fields=['last_login'], which no page shows, so
+        only saves that may have changed a displayed field invalidate the pages tagged with the user.
+    """
+    if update_fields is not None and not set(update_fields) & set(AUTHOR_FIELDS):
+        return
+    invalidate_object_tag(sender, instance, **kwargs)
+
+# Authors and sites show up on content pages, so renaming one drops the pages tagged with it.
+post_save.connect(invalidate_author_tag, sender=User)
+post_delete.connect(invalidate_object_tag, sender=User)
+post_save.connect(invalidate_object_tag, sender=Site)
+post_delete.connect(invalidate_object_tag, sender=Site)
+
+
+######################################
+# CONTENT DATE COUNT
+#######################################
+class ContentDateCount(models.Model):
+    """
+        @summary: Histogram of the number of content objects published on each day, per content type, site and status.
+        Kept up to date by L{apps.content.date_histogram} as content is saved and deleted, so date drilldowns can read it
+        instead of aggregating over the content tables.
+        
+        @type content_type: L{ContentType}
+        @cvar content_type: The content model being counted.
+        
+        @type site: L{Site}
+        @cvar site: The site the content belongs to.
+        
+        @type status: IntegerField
+        @cvar status: The status of the content.
+        
+        @type year: PositiveSmallIntegerField
+        @cvar year: The year of publish_at.
+        
+        @type month: PositiveSmallIntegerField
+        @cvar month: The month of publish_at.
+        
+        @type day: PositiveSmallIntegerField
+        @cvar day: The day of publish_at.
+        
+        @type count: IntegerField
+        @cvar count: The number of content objects in this bucket.
+        
+    """
+    content_type = models.ForeignKey(ContentType)
+    site = models.ForeignKey(Site)
+    status = models.IntegerField('status')
+    year = models.PositiveSmallIntegerField('year')
+    month = models.PositiveSmallIntegerField('month')
+    day = models.PositiveSmallIntegerField('day')
+    count = models.IntegerField('count', default = 0)
+    objects = ContentDateCountManager()
+    
+    class Meta:
+        unique_together = ('content_type', 'site', 'status', 'year', 'month', 'day')
+        verbose_name = "Content Date Count"
+        verbose_name_plural = "Content Date Counts"
+        
+    def __unicode__(self):
+        return u"%s-%02d-%02d: %s" % (self.year, self.month, self.day, self.count)
+
+######################################
+# RELATED CONTENT
+#######################################
+class RelatedContent(models.Model):
+    """
+        @summary: A content object's precomputed related content, kept by L{apps.content.related}. The lists are short,
+        so they're stored as comma separated ids rather than a row per pair.
+        
+        @type content_type: L{ContentType}
+        @cvar content_type: The content object's model. Related content is always of the same model.
+        
+        @type object_id: PositiveIntegerField
+        @cvar object_id: The content object's primary key.
+        
+        @type related_ids: CommaSeparatedIntegerField
+        @cvar related_ids: The related objects' primary keys, best first.
+        
+        @type scores: CommaSeparatedIntegerField
+        @cvar scores: The related objects' scores in thousandths, in the same order.
+        
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField('object id')
+    related_ids = models.CommaSeparatedIntegerField('related ids', max_length = 255, blank = True)
+    scores = models.CommaSeparatedIntegerField('scores', max_length = 255, blank = True)
+    
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+        verbose_name = "Related Content"
+        verbose_name_plural = "Related Content"
+        
+    def __unicode__(self):
+        return u"%s %s: %s" % (self.content_type, self.object_id, self.related_ids)
+        
+    def get_related_ids(self):
+        return [int(pk) for pk in self.related_ids.split(',') if pk]
+        
+    def get_scores(self):
+        """
+            @rtype: list
+            @return: (score, pk) tuples, best first.
+        """
+        return zip([int(score) / float(related.SCORE_SCALE) for score in self.scores.split(',') if score], self.get_related_ids())
+        
+    def set_scores(self, top):
+        """
+            @type top: list
+            @param top: (score, pk) tuples, best first.
+        """
+        self.related_ids = ','.join([str(pk) for score, pk in top])
+        self.scores = ','.join([str(int(round(score * related.SCORE_SCALE))) for score, pk in top])
+
+######################################
+# BAKED TAG
+#######################################
+class BakedTag(models.Model):
+    """
+        @summary: One of the cache tags of a baked page, kept by L{apps.content.bake} so that invalidating a tag, such as
+        on a category rename, can find and rebake the pages showing the tagged object.
+        
+        @type content_type: L{ContentType}
+        @cvar content_type: The baked object's model.
+        
+        @type object_id: PositiveIntegerField
+        @cvar object_id: The baked object's primary key.
+        
+        @type tag: CharField
+        @cvar tag: The tag, such as category:4.
+        
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField('object id')
+    tag = models.CharField('tag', max_length = 100, db_index = True)
+    
+    class Meta:
+        unique_together = ('content_type', 'object_id', 'tag')
+        verbose_name = "Baked Tag"
+        verbose_name_plural = "Baked Tags"
+        
+    def __unicode__(self):
+        return u"%s %s: %s" % (self.content_type, self.object_id, self.tag)
+
+######################################
+# SITEMAP CHANGE
+#######################################
+class SitemapChange(models.Model):
+    """
+        @summary: A content object whose URL changed on a site since that site's sitemaps were last generated, kept by
+        L{apps.content.sitemaps} so the next run rewrites the shard listing it.
+        
+        @type content_type: L{ContentType}
+        @cvar content_type: The object's model.
+        
+        @type object_id: PositiveIntegerField
+        @cvar object_id: The object's primary key.
+        
+        @type site: L{Site}
+        @cvar site: The site whose sitemap lists the object.
+        
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField('object id')
+    site = models.ForeignKey(Site)
+    
+    class Meta:
+        verbose_name = "Sitemap Change"
+        verbose_name_plural = "Sitemap Changes"
+        
+    def __unicode__(self):
+        return u"%s %s on %s" % (self.content_type, self.object_id, self.site_id)
@@ -0,0 +1,66 @@
+"""
+    Helpers for filling the content caches outside of a real request, for warmers and other background jobs.
+"""
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.urlresolvers import resolve
+from django.test.client import RequestFactory
+
+from apps.contentinfo.models import GFContentType
+from apps.utilities.cache.cache_utils import get_content_type_cache_key, set_model_cache
+from apps.utilities.sites.current import get_domain, get_site_id
+
+
+def anonymous_request(path):
+    """
+        Builds a GET request for a path on the current site, as made by an anonymous visitor.
+
+        @type path: string
+        @param path: The path being requested.
+
+        @rtype: L{HttpRequest}
+        @return: The request.
+    """
+    request = RequestFactory().get(path, SERVER_NAME = get_domain().split(':')[0])
+    request.user = AnonymousUser()
+    request.session = {}
+    return request
+
+def prime_object_cache(content_obj, site_id = None):
+    """
+        Fills the caches content_display reads before rendering: the content type lookup, the object and slug keys,
+        and the object's categories.
+
+        @type content_obj: L{GenericContent}
+        @param content_obj: The object to cache.
+
+        @type site_id: int
+        @param site_id: The site the object is being cached for. Defaults to the current site.
+
+        @rtype: None
+        @return: None
+    """
+    site_id = site_id or get_site_id()
+    content_class = content_obj.__class__
+    for ctype in GFContentType.objects.filter(model_name__iexact = content_class.__name__):
+        cache.set(get_content_type_cache_key(ctype.short_name), ctype.model_name, settings.CACHE_LONG_SECONDS)
+
+    # get_categories caches its own result.
+    content_obj.get_categories()
+    set_model_cache(content_class, content_obj, site_id)
+
+def render_public_page(content_obj):
+    """
+        Renders the object's page through its URL's view as an anonymous visitor would see it, which also fills
+        any caches the view writes to, including the HTML cache when settings.CACHE_HTML is on.
+
+        @type content_obj: L{GenericContent}
+        @param content_obj: The object to render. It must already be public, or the view will 404.
+
+        @rtype: L{HttpResponse}
+        @return: The view's response.
+    """
+    path = content_obj.get_absolute_url()
+    match = resolve(path)
+    return match.func(anonymous_request(path), *match.args, **match.kwargs)
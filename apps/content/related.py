@@ -0,0 +1,440 @@
+"""
+    Precomputed related content.
+
+    Each object's related stories are worked out ahead of time and stored in a RelatedContent row as its best
+    settings.RELATED_CONTENT_COUNT ids and their scores, so a page shows them with a primary key lookup instead of joining
+    the category and author tables on every view. Two objects score for:
+
+        - each category path they share, including the parents of their categories. A shared category counts 1, a shared
+          parent of one of the object's categories 1/2, a grandparent 1/4 and so on, so content filed in the same
+          category outranks content that only shares a section, which in turn outranks content sharing just the root.
+        - each author they share, settings.RELATED_CONTENT_AUTHOR_WEIGHT apiece.
+
+    and the total is halved for every settings.RELATED_CONTENT_HALF_LIFE_DAYS between their publish dates. Only public
+    content published within settings.RELATED_CONTENT_WINDOW_DAYS of the object is considered.
+
+    When an object's categories, authors, status or publish date change, its own list is recomputed once the request is
+    done (see L{apps.utilities.deferred.queue}), and it's added to, moved in or dropped from the lists of the objects it's
+    now most related to. Lists it falls out of otherwise keep it until the rebuild_related_content command next runs, as
+    do lists that scheduled content should join once it goes live; results are loaded through the published manager,
+    which drops anything that stopped being public in the meantime.
+"""
+import heapq
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.contrib.contenttypes.models import ContentType
+
+from apps.categories.models import Category
+from apps.utilities.bulk.bulk_utils import post_bulk_save, pre_bulk_delete, chunked
+from apps.utilities.cache.cache_utils import get_model_cache_key
+from apps.utilities.cache.tags import get_tag, invalidate_tags
+from apps.utilities.deferred.queue import defer
+
+# The content models whose related content is maintained.
+registered_models = set()
+
+# Scores are stored as integers, in thousandths.
+SCORE_SCALE = 1000
+
+
+def to_days(value):
+    return time.mktime(value.timetuple()) / 86400.0
+
+def expand_paths(paths):
+    """
+        Maps category paths and the paths of all their parents to how far each is from a category the object is in.
+
+        @type paths: list
+        @param paths: The paths of the object's own categories.
+
+        @rtype: dict
+        @return: The distance of each path, 0 for the object's own categories, 1 for their parents and so on.
+    """
+    expanded = {}
+    for path in paths:
+        depth = len(path) // Category.steplen
+        for distance in range(depth):
+            ancestor = path[0:(depth - distance) * Category.steplen]
+            if expanded.get(ancestor, distance + 1) > distance:
+                expanded[ancestor] = distance
+    return expanded
+
+
+class RelatedScorer(object):
+    """
+        Scores objects against each other from their category paths, authors and publish dates, held in memory.
+        The rebuild loads every object at once; an update loads just the objects updated and their candidates.
+    """
+    def __init__(self):
+        self.paths = {}
+        self.authors = {}
+        self.days = {}
+        self.public = set()
+        # Public objects by category path and by author, each as parallel (days, pks) lists sorted by publish date.
+        self.by_path = defaultdict(list)
+        self.by_author = defaultdict(list)
+        self.postings = {}
+        self.author_weight = settings.RELATED_CONTENT_AUTHOR_WEIGHT
+        self.half_life = float(settings.RELATED_CONTENT_HALF_LIFE_DAYS)
+
+    def add(self, pk, paths, author_ids, publish_at, public = True):
+        """
+            @type paths: list
+            @param paths: The paths of the object's own categories.
+
+            @type public: boolean
+            @param public: Whether the object may show up in other objects' lists.
+        """
+        # Kept as the weight each path scores with, 1 for the object's own categories and halving for each parent up.
+        self.paths[pk] = dict((path, 0.5 ** distance) for path, distance in expand_paths(paths).items())
+        self.authors[pk] = frozenset(author_ids)
+        self.days[pk] = to_days(publish_at)
+        if public:
+            self.public.add(pk)
+            for path in self.paths[pk]:
+                self.by_path[path].append(pk)
+            for author_id in author_ids:
+                self.by_author[author_id].append(pk)
+
+    def finalize(self):
+        """
+            Sorts the postings by publish date. Call it after the last add.
+        """
+        self.postings = {}
+        for prefix, lists in (('path', self.by_path), ('author', self.by_author)):
+            for key, pks in lists.items():
+                pks.sort(key = self.days.get)
+                self.postings[(prefix, key)] = ([self.days[pk] for pk in pks], pks)
+
+    def score(self, pk, other):
+        """
+            @rtype: float
+            @return: How related other is to pk, 0 if not at all.
+        """
+        weights = self.paths[pk]
+        shared = sum([weights[path] for path in weights.viewkeys() & self.paths[other].viewkeys()])
+        authors = self.authors[pk]
+        if authors:
+            shared += len(authors & self.authors[other]) * self.author_weight
+        if not shared:
+            return 0.0
+        return shared * 0.5 ** (abs(self.days[pk] - self.days[other]) / self.half_life)
+
+    def candidates(self, pk):
+        """
+            Returns the public objects worth scoring against an object: those sharing its categories, their parents or
+            its authors, published closest to it and within the window. Sharing only grandparents or the root doesn't
+            make an object a candidate, since those hold most of the content for little score.
+
+            @rtype: set
+            @return: The candidates' pks.
+        """
+        keys = [('path', path) for path, weight in self.paths[pk].items() if weight >= 0.5]
+        keys.extend([('author', author_id) for author_id in self.authors[pk]])
+        day = self.days[pk]
+        window = settings.RELATED_CONTENT_WINDOW_DAYS
+        half = settings.RELATED_CONTENT_CANDIDATES // 2
+        found = set()
+        for key in keys:
+            if key not in self.postings:
+                continue
+            days, pks = self.postings[key]
+            start, end = bisect_left(days, day - window), bisect_right(days, day + window)
+            middle = bisect_left(days, day, start, end)
+            found.update(pks[max(start, middle - half):min(end, middle + half)])
+        found.discard(pk)
+        return found
+
+    def top(self, pk, count = None):
+        """
+            @rtype: list
+            @return: The object's most related objects as (score, pk) tuples, best first.
+        """
+        score = self.score
+        scored = [(score(pk, other), other) for other in self.candidates(pk)]
+        return [(value, other) for value, other in heapq.nlargest(count or settings.RELATED_CONTENT_COUNT, scored) if value > 0]
+
+
+def load(model, scorer, pk_list):
+    """
+        Adds objects to a scorer, with a few queries per chunk of them.
+
+        @type pk_list: list
+        @param pk_list: The objects' pks.
+
+        @rtype: None
+        @return: None
+    """
+    public = model.STATUS_CHOICES.public
+    now = datetime.now()
+    categories_field = model._meta.get_field('categories')
+    authors_field = model._meta.get_field('authors')
+    for chunk in chunked(list(pk_list)):
+        paths = defaultdict(list)
+        for pk, path in categories_field.rel.through.objects.filter(**{categories_field.m2m_field_name() + '__in': chunk}).values_list(categories_field.m2m_field_name(), categories_field.m2m_reverse_field_name() + '__path'):
+            paths[pk].append(path)
+        authors = defaultdict(list)
+        for pk, user_id in authors_field.rel.through.objects.filter(**{authors_field.m2m_field_name() + '__in': chunk}).values_list(authors_field.m2m_field_name(), authors_field.m2m_reverse_field_name()):
+            authors[pk].append(user_id)
+        for pk, publish_at, status in model._default_manager.filter(pk__in = chunk).values_list('pk', 'publish_at', 'status'):
+            scorer.add(pk, paths[pk], authors[pk], publish_at, status == public and publish_at <= now)
+
+def find_candidates(model, scorer, pk):
+    """
+        Queries for the public objects that could be related to one already in the scorer, sharing its categories, their
+        parents or its authors and published in the window, newest first. The scorer only needs to load these.
+
+        @rtype: set
+        @return: The candidates' pks.
+    """
+    categories_field = model._meta.get_field('categories')
+    authors_field = model._meta.get_field('authors')
+    publish_at = datetime.fromtimestamp(scorer.days[pk] * 86400)
+    window = timedelta(days = settings.RELATED_CONTENT_WINDOW_DAYS)
+    limit = settings.RELATED_CONTENT_CANDIDATES
+
+    found = set()
+    seed_paths = [path for path, weight in scorer.paths[pk].items() if weight >= 0.5]
+    for field, lookup, values in ((categories_field, '__path__in', seed_paths), (authors_field, '__in', list(scorer.authors[pk]))):
+        if not values:
+            continue
+        content_field = field.m2m_field_name()
+        rows = field.rel.through.objects.filter(**{
+            field.m2m_reverse_field_name() + lookup: values,
+            content_field + '__status': model.STATUS_CHOICES.public,
+            content_field + '__publish_at__range': (publish_at - window, min(publish_at + window, datetime.now())),
+        }).order_by('-%s__publish_at' % content_field).values_list(content_field, flat = True)
+        found.update(rows[:limit * len(values)])
+    found.discard(pk)
+    return found
+
+
+def get_related_cache_key(model, pk):
+    return get_model_cache_key(model, pk) + "::related"
+
+def store(model, results):
+    """
+        Saves objects' related lists, and drops their cached lists and pages.
+
+        @type results: dict
+        @param results: Maps pks to lists of (score, pk) tuples, best first.
+
+        @rtype: None
+        @return: None
+    """
+    from apps.content.models import RelatedContent
+
+    if not results:
+        return
+    ctype = ContentType.objects.get_for_model(model)
+    for pk, top in results.items():
+        related = RelatedContent(content_type = ctype, object_id = pk)
+        related.set_scores(top)
+        if not RelatedContent.objects.filter(content_type = ctype, object_id = pk).update(related_ids = related.related_ids, scores = related.scores):
+            related.save()
+    cache.delete_many([get_related_cache_key(model, pk) for pk in results])
+    invalidate_tags([get_tag(model, pk) for pk in results])
+
+def update_neighbours(model, scorer, candidates):
+    """
+        Adds, moves or drops objects in the stored lists of the candidates they score best with. Dropping one can leave
+        a list one short until the next rebuild.
+
+        @type candidates: dict
+        @param candidates: Maps the objects' pks to (score, pk) tuples for their candidates, best first.
+    """
+    from apps.content.models import RelatedContent
+
+    count = settings.RELATED_CONTENT_COUNT
+    placed = defaultdict(set)
+    for pk, top in candidates.items():
+        for score, other in top[:count * 2]:
+            placed[other].add(pk)
+    changed = {}
+    ctype = ContentType.objects.get_for_model(model)
+    for chunk in chunked(placed.keys()):
+        for related in RelatedContent.objects.filter(content_type = ctype, object_id__in = chunk):
+            pk_set = placed[related.object_id]
+            top = related.get_scores()
+            kept = [(score, other) for score, other in top if other not in pk_set]
+            scored = [(scorer.score(related.object_id, pk), pk) for pk in pk_set if pk in scorer.public]
+            kept = heapq.nlargest(count, kept + [(score, pk) for score, pk in scored if score > 0])
+            if [other for score, other in kept] != [other for score, other in top]:
+                changed[related.object_id] = kept
+    store(model, changed)
+
+def update(model, pk_list):
+    """
+        Recomputes objects' related lists, and their places in the lists of the objects they're most related to. The
+        objects are scored together, loading each candidate once however many of them it's a candidate for, so a batch,
+        such as an import, costs a few queries per object.
+
+        @type pk_list: list
+        @param pk_list: The objects' pks.
+
+        @rtype: None
+        @return: None
+    """
+    scorer = RelatedScorer()
+    load(model, scorer, set(pk_list))
+    pk_list = [pk for pk in set(pk_list) if pk in scorer.days]
+    if not pk_list:
+        return
+    found = set()
+    for pk in pk_list:
+        found.update(find_candidates(model, scorer, pk))
+    load(model, scorer, found - set(scorer.days))
+    scorer.finalize()
+
+    candidates = dict([(pk, scorer.top(pk, settings.RELATED_CONTENT_COUNT * 2)) for pk in pk_list])
+    store(model, dict([(pk, top[:settings.RELATED_CONTENT_COUNT]) for pk, top in candidates.items()]))
+    update_neighbours(model, scorer, candidates)
+
+def rebuild(model, batch_size = 20000):
+    """
+        Recomputes every object's related list from the database, holding the categories, authors and publish dates of
+        all the model's content in memory, and replaces the stored lists.
+
+        @rtype: int
+        @return: The number of lists stored.
+    """
+    from apps.content.models import RelatedContent
+
+    scorer = RelatedScorer()
+    pk_list = list(model._default_manager.order_by('pk').values_list('pk', flat = True))
+    for batch in chunked(pk_list, batch_size):
+        load(model, scorer, batch)
+    scorer.finalize()
+
+    ctype = ContentType.objects.get_for_model(model)
+    RelatedContent.objects.filter(content_type = ctype).delete()
+    stored = 0
+    for batch in chunked(pk_list, batch_size):
+        rows = []
+        for pk in batch:
+            related = RelatedContent(content_type = ctype, object_id = pk)
+            related.set_scores(scorer.top(pk))
+            if related.related_ids:
+                rows.append(related)
+        # bulk_create is chunked too, for SQLite's limit on query parameters.
+        for chunk in chunked(rows, 100):
+            RelatedContent.objects.bulk_create(chunk)
+        stored += len(rows)
+    cache.delete_many([get_related_cache_key(model, pk) for pk in pk_list])
+    return stored
+
+def related_for(model, pk_list):
+    """
+        Returns the related ids of several objects, from the cache where possible and otherwise with one query.
+
+        @type model: class
+        @param model: The content model.
+
+        @type pk_list: list
+        @param pk_list: The objects' pks.
+
+        @rtype: dict
+        @return: Maps each pk to a list of related pks, best first. Objects without a stored list map to an empty list.
+    """
+    from apps.content.models import RelatedContent
+
+    keys = dict((get_related_cache_key(model, pk), pk) for pk in pk_list)
+    found = cache.get_many(keys.keys())
+    results = dict((keys[key], list(value)) for key, value in found.items())
+    missing = [pk for pk in pk_list if pk not in results]
+    if missing:
+        loaded = {}
+        ctype = ContentType.objects.get_for_model(model)
+        for chunk in chunked(missing):
+            for related in RelatedContent.objects.filter(content_type = ctype, object_id__in = chunk):
+                loaded[related.object_id] = related.get_related_ids()
+        for pk in missing:
+            results[pk] = loaded.get(pk, [])
+        cache.set_many(dict((get_related_cache_key(model, pk), tuple(results[pk])) for pk in missing), settings.CACHE_LONG_SECONDS)
+    return results
+
+
+def remember_previous(sender, instance, raw = False, **kwargs):
+    """
+        pre_save handler. Stores the object's status and publish date in the database, so post_save can tell if they
+        changed.
+    """
+    instance._related_previous = None
+    if instance.pk and not raw:
+        instance._related_previous = tuple(sender._default_manager.filter(pk = instance.pk).values_list('status', 'publish_at')[:1])
+
+def update_on_save(sender, instance, created, raw = False, **kwargs):
+    """
+        post_save handler. New objects get their lists when their categories and authors are added.
+    """
+    if raw or created:
+        return
+    if getattr(instance, '_related_previous', None) != ((instance.status, instance.publish_at),):
+        defer(update, sender, [instance.pk])
+
+def update_on_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+        m2m_changed handler for the categories and authors relations. Changes made from the category or user side
+        update the content they added or removed; a clear from that side doesn't say which, and is left to the rebuild.
+        The update is deferred, so an admin save, which clears and adds both relations, scores the object once with
+        all of them saved.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        defer(update, instance.__class__, [instance.pk])
+    elif pk_set:
+        defer(update, model, pk_set)
+
+def delete_on_delete(sender, instance, **kwargs):
+    """
+        post_delete handler.
+    """
+    delete_lists(sender, [instance.pk])
+
+def update_on_bulk_save(sender, instances, created, previous, **kwargs):
+    """
+        post_bulk_save handler. Imports are scored as created, and transitions only when they moved the status or
+        publish date.
+    """
+    moved = []
+    for instance in instances:
+        old = (previous or {}).get(instance.pk, {})
+        if created or old.get('status', instance.status) != instance.status or old.get('publish_at', instance.publish_at) != instance.publish_at:
+            moved.append(instance.pk)
+    update(sender, moved)
+
+def delete_on_bulk_delete(sender, pk_list, **kwargs):
+    """
+        pre_bulk_delete handler.
+    """
+    delete_lists(sender, pk_list)
+
+def delete_lists(model, pk_list):
+    from apps.content.models import RelatedContent
+
+    RelatedContent.objects.filter(content_type = ContentType.objects.get_for_model(model), object_id__in = list(pk_list)).delete()
+    cache.delete_many([get_related_cache_key(model, pk) for pk in pk_list])
+
+def register(model):
+    """
+        Starts maintaining a content model's related content. The model needs categories and authors relations, a
+        status and a publish date, as GenericContent subclasses have.
+    """
+    if model in registered_models:
+        return
+    registered_models.add(model)
+
+    pre_save.connect(remember_previous, sender = model)
+    post_save.connect(update_on_save, sender = model)
+    post_delete.connect(delete_on_delete, sender = model)
+    m2m_changed.connect(update_on_m2m_changed, sender = model.categories.through)
+    m2m_changed.connect(update_on_m2m_changed, sender = model.authors.through)
+    post_bulk_save.connect(update_on_bulk_save, sender = model)
+    pre_bulk_delete.connect(delete_on_bulk_delete, sender = model)
@@ -0,0 +1,272 @@
+"""
+    Full-text search over content.
+
+    On Postgres, each registered model's table has a search_vector tsvector column with a GIN index, created by the
+    model's custom SQL (see apps/content/sql) or by install(). The vector weights the title over the
+    abstract over the body, and is rebuilt in the database from the saved row on every post_save, so a search is an index
+    lookup instead of an ILIKE scan of the table. Results are ranked with ts_rank_cd and paged with a keyset on
+    (rank, id), so deep pages cost the same as the first. The rank is rounded to an integer number of millionths for both:
+    ts_rank_cd returns a real, which doesn't survive the trip to Python and back exactly, and the keyset's equality test
+    would then miss the rows tied with the last one on the page.
+
+    Elsewhere, settings.SEARCH_INDEX_ROOT switches searches to the on-disk text index kept by L{apps.content.text_index},
+    ranked with BM25. Without either, searches fall back to icontains matching on the title and abstract, newest first,
+    which is fine for development but scans the table.
+"""
+import base64
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+
+from apps.content import text_index
+from apps.utilities.bulk.bulk_utils import post_bulk_save
+
+VECTOR_COLUMN = 'search_vector'
+# Ranks are compared and paged on in units of 1/RANK_SCALE.
+RANK_SCALE = 1000000
+
+# The content models with a search vector.
+registered_models = set()
+
+
+def is_indexed(model):
+    """
+        @rtype: boolean
+        @return: True if the model's searches go through the Postgres index.
+    """
+    return model in registered_models and connection.vendor == 'postgresql'
+
+def has_index(model):
+    """
+        @rtype: boolean
+        @return: True if the model's searches are answered by the Postgres index or the text index, rather than icontains.
+    """
+    return is_indexed(model) or text_index.is_enabled(model)
+
+def get_vector_sql(model):
+    """
+        Returns the SQL expression that builds a row's search vector from its own columns. The body is stored as HTML,
+        so its tags are stripped first.
+
+        @rtype: tuple
+        @return: (sql, params)
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    sql = ("setweight(to_tsvector(%%s::regconfig, coalesce(%(table)s.title, '')), 'A') || "
+           "setweight(to_tsvector(%%s::regconfig, coalesce(%(table)s.abstract, '')), 'B') || "
+           "setweight(to_tsvector(%%s::regconfig, regexp_replace(coalesce(%(table)s.body, ''), E'<[^>]+>', ' ', 'g')), 'C')") % {'table': table}
+    return sql, [settings.SEARCH_CONFIG] * 3
+
+def get_query_sql(model):
+    """
+        @rtype: tuple
+        @return: (match sql, rank sql, the params each of them takes), for a query string added to the params. The rank
+        is a bigint, in units of 1/RANK_SCALE.
+    """
+    vector = "%s.%s" % (connection.ops.quote_name(model._meta.db_table), VECTOR_COLUMN)
+    tsquery = "plainto_tsquery(%s::regconfig, %s)"
+    rank = "round(ts_rank_cd(%s, %s)::float8 * %d)::bigint" % (vector, tsquery, RANK_SCALE)
+    return "%s @@ %s" % (vector, tsquery), rank, [settings.SEARCH_CONFIG]
+
+def update_search_vectors(model, pk_list = None):
+    """
+        Rebuilds the search vectors of some rows, or of the whole table, with one UPDATE.
+
+        @type pk_list: list
+        @param pk_list: The primary keys of the rows, or None for every row.
+
+        @rtype: int
+        @return: The number of rows updated.
+    """
+    vector_sql, params = get_vector_sql(model)
+    sql = "UPDATE %s SET %s = %s" % (connection.ops.quote_name(model._meta.db_table), VECTOR_COLUMN, vector_sql)
+    if pk_list is not None:
+        if not pk_list:
+            return 0
+        sql += " WHERE id IN (%s)" % ', '.join(['%s'] * len(pk_list))
+        params = params + list(pk_list)
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    transaction.commit_unless_managed()
+    return cursor.rowcount
+
+def install(model):
+    """
+        Adds the search_vector column and its GIN index to a model's table, if it doesn't have them yet. Tables created
+        by syncdb get them from the model's custom SQL.
+
+        @rtype: boolean
+        @return: True if the column was added.
+    """
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s", [table, VECTOR_COLUMN])
+    if cursor.fetchone():
+        return False
+    quote = connection.ops.quote_name
+    cursor.execute("ALTER TABLE %s ADD COLUMN %s tsvector" % (quote(table), VECTOR_COLUMN))
+    cursor.execute("CREATE INDEX %s ON %s USING gin(%s)" % (quote("%s_%s" % (table, VECTOR_COLUMN)), quote(table), VECTOR_COLUMN))
+    transaction.commit_unless_managed()
+    return True
+
+def filter_queryset(queryset, query, ranked = True):
+    """
+        Narrows a queryset to the rows matching a search.
+
+        @type query: string
+        @param query: The words searched for, as typed. Every word has to match, after stemming.
+
+        @type ranked: boolean
+        @param ranked: Order the results best first. Otherwise the queryset's own ordering is kept.
+
+        @rtype: L{QuerySet}
+        @return: The queryset. When ranked, each row has a search_rank attribute, in units of 1/RANK_SCALE.
+    """
+    model = queryset.model
+    if not is_indexed(model) and text_index.is_enabled(model):
+        # The text index ranks outside the database, so only its best matches can be handed to the queryset, unranked.
+        hits = text_index.search(model, query, limit = settings.SEARCH_INDEX_ADMIN_LIMIT, public = False)
+        return queryset.filter(pk__in = [pk for score, pk in hits])
+    if not is_indexed(model):
+        for word in query.split():
+            queryset = queryset.filter(Q(title__icontains = word) | Q(abstract__icontains = word))
+        return queryset
+
+    match_sql, rank_sql, params = get_query_sql(model)
+    queryset = queryset.extra(where = [match_sql], params = params + [query])
+    if ranked:
+        queryset = queryset.extra(select = {'search_rank': rank_sql}, select_params = params + [query]).order_by('-search_rank', '-pk')
+    return queryset
+
+def encode_token(rank, pk, generation = None):
+    """
+        Returns the opaque token for the page after a result. repr keeps a float rank exact, so the next page starts
+        right after it. Text index searches add the index generation the rank was worked out in.
+    """
+    if isinstance(rank, float):
+        rank = repr(rank)
+    if generation is not None:
+        return base64.urlsafe_b64encode("%s:%d:%d" % (rank, pk, generation))
+    return base64.urlsafe_b64encode("%s:%d" % (rank, pk))
+
+def decode_token(token):
+    """
+        @rtype: tuple or None
+        @return: (rank, id) from a token, or None if it isn't one of ours. rank is None for unranked searches, an int
+        for Postgres searches and a float for text index searches, which also give (rank, id, generation).
+    """
+    try:
+        parts = base64.urlsafe_b64decode(str(token)).split(':')
+        if len(parts) == 3:
+            return float(parts[0]), int(parts[1]), int(parts[2])
+        rank, pk = parts
+        if rank == 'None':
+            return None, int(pk)
+        if rank.lstrip('-').isdigit():
+            return int(rank), int(pk)
+        return float(rank), int(pk)
+    except (TypeError, ValueError):
+        return None
+
+def search(model, query, after = None, limit = None, category = None):
+    """
+        Searches a model's public content on the current site, best matches first.
+
+        @type model: class
+        @param model: The content model.
+
+        @type query: string
+        @param query: The words searched for.
+
+        @type category: L{Category}
+        @param category: Only find content in this category or the categories under it.
+
+        @type after: string
+        @param after: The token of the last result on the previous page, or None for the first page.
+
+        @type limit: int
+        @param limit: Results per page. Defaults to settings.SEARCH_RESULTS_PER_PAGE.
+
+        @rtype: tuple
+        @return: (results, the token for the next page or None if this is the last one)
+    """
+    limit = limit or settings.SEARCH_RESULTS_PER_PAGE
+    query = query.strip()
+    if not query:
+        return [], None
+    position = after and decode_token(after)
+    if not is_indexed(model) and text_index.is_enabled(model):
+        return search_text_index(model, query, position, limit, category)
+
+    queryset = model.published.all()
+    if category is not None:
+        queryset = queryset.filter(categories__path__startswith = category.path).distinct()
+    queryset = filter_queryset(queryset, query)
+
+    if is_indexed(model):
+        if position:
+            match_sql, rank_sql, params = get_query_sql(model)
+            pk_column = "%s.id" % connection.ops.quote_name(model._meta.db_table)
+            keyset = "(%s < %%s OR (%s = %%s AND %s < %%s))" % (rank_sql, rank_sql, pk_column)
+            rank = int(position[0] or 0)
+            queryset = queryset.extra(where = [keyset], params = params + [query, rank] + params + [query, rank, position[1]])
+    else:
+        queryset = queryset.order_by('-pk')
+        if position:
+            queryset = queryset.filter(pk__lt = position[1])
+
+    results = list(queryset[:limit + 1])
+    next_token = None
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        next_token = encode_token(getattr(last, 'search_rank', None), last.pk)
+    return results, next_token
+
+def search_text_index(model, query, position, limit, category = None):
+    """
+        search() for models in the text index. The index is updated as content is saved, but the objects are still
+        loaded through the published manager, which drops any result that stopped being public since. The token
+        carries the index generation, so the next page can score its anchor again if the index has changed.
+    """
+    filters = category is not None and ["category:%d" % category.id] or []
+    hits = text_index.search(model, query, filters, limit + 1, position and position[0] is not None and position or None)
+    objects = model.published.in_bulk([pk for score, pk in hits[:limit]])
+    results = []
+    for score, pk in hits[:limit]:
+        if pk in objects:
+            objects[pk].search_rank = score
+            results.append(objects[pk])
+    next_token = None
+    if len(hits) > limit:
+        score, pk = hits[limit - 1]
+        next_token = encode_token(score, pk, hits.generation)
+    return results, next_token
+
+
+def update_on_save(sender, instance, raw = False, **kwargs):
+    """
+        post_save handler. Rebuilds the saved row's search vector.
+    """
+    if connection.vendor == 'postgresql':
+        update_search_vectors(sender, [instance.pk])
+
+def update_on_bulk_save(sender, instances, created, **kwargs):
+    """
+        post_bulk_save handler. Bulk transitions don't touch the indexed text, so only created rows need vectors.
+    """
+    if created and connection.vendor == 'postgresql':
+        update_search_vectors(sender, [instance.pk for instance in instances])
+
+def register(model):
+    """
+        Starts maintaining a content model's search vector. The model needs title, abstract and body fields, and its
+        table needs the search_vector column, which its custom SQL or the update_search_index command adds.
+    """
+    if model in registered_models:
+        return
+    registered_models.add(model)
+    post_save.connect(update_on_save, sender = model)
+    post_bulk_save.connect(update_on_bulk_save, sender = model)
@@ -0,0 +1,305 @@
+"""
+    Sitemaps for the whole archive, written to settings.SITEMAP_ROOT for the web server to serve from
+    settings.SITEMAP_URL.
+
+    Each registered model's public content on a site is split into shards of up to settings.SITEMAP_SHARD_SIZE URLs by
+    id range, each written gzipped as sitemap-<site>-<model>-<first id>.xml.gz, and listed in the site's index,
+    sitemap-<site>.xml. Rows are read in keyset batches of values_list() tuples and their URLs filled into the model's
+    URL format, so no objects are instantiated and nothing is reversed per URL.
+
+    Each shard's id range, URL count, sum of ids and latest updated_at are kept in a manifest beside the index. A later
+    run compares them with one aggregate query per shard and rewrites only the shards that changed, whether by edits,
+    by content being published, unpublished, expired or deleted, or by new content past the last shard. A shard that
+    grows past the limit is split. Edits to a slug or publish date change the URL without moving any of those, so saves
+    that make them leave a SitemapChange for each of the object's sites, and the shards holding them are rewritten too.
+"""
+import gzip
+import json
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.db.models import Count, Max, Sum
+from django.db.models.signals import pre_save, post_save
+
+from apps.content.bake import write_atomic
+from apps.utilities.bulk.bulk_utils import chunked, post_bulk_save
+
+# The content models with sitemaps.
+registered_models = set()
+
+MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+
+
+def fill_url(url_format, pk, slug, publish_at):
+    """
+        @type url_format: string
+        @param url_format: A URL format from get_url_format, such as Article.get_url_format.
+
+        @rtype: string
+        @return: The URL of the object with a pk, slug and publish date.
+    """
+    return url_format % {'year': publish_at.year, 'month': MONTHS[publish_at.month - 1], 'day': publish_at.day, 'slug': slug, 'id': pk}
+
+def get_index_name(site_id):
+    return "sitemap-%s.xml" % site_id
+
+def get_shard_name(model, site_id, start_id):
+    return "sitemap-%s-%s-%s.xml.gz" % (site_id, model._meta.object_name.lower(), start_id)
+
+def get_manifest_path(site_id):
+    return os.path.join(settings.SITEMAP_ROOT, "sitemap-%s.json" % site_id)
+
+def read_manifest(site_id):
+    """
+        @rtype: dict
+        @return: The shards written for each model last time, by model name, or an empty dict for a first run.
+    """
+    try:
+        with open(get_manifest_path(site_id)) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+def format_updated(value):
+    return value and value.strftime('%Y-%m-%dT%H:%M:%S') or None
+
+def get_queryset(model, site_id, start_id, end_id = None):
+    """
+        @type end_id: int
+        @param end_id: The first id after the range, or None for no end.
+
+        @rtype: L{QuerySet}
+        @return: The public content on a site in an id range.
+    """
+    queryset = model.published.for_site(site_id).filter(id__gte = start_id)
+    if end_id is not None:
+        queryset = queryset.filter(id__lt = end_id)
+    return queryset
+
+def get_fingerprint(model, site_id, start_id, end_id = None):
+    """
+        @rtype: list
+        @return: [count, sum of ids, latest updated_at] of a shard's range in the database, to compare with the manifest.
+    """
+    totals = get_queryset(model, site_id, start_id, end_id).aggregate(count = Count('id'), ids = Sum('id'), updated = Max('updated_at'))
+    return [totals['count'], totals['ids'] or 0, format_updated(totals['updated'])]
+
+def iter_rows(model, site_id, start_id, end_id = None, batch_size = 5000):
+    """
+        Yields (id, slug, publish_at, updated_at) for the public content in an id range, in id order, a keyset batch
+        at a time.
+    """
+    last_id = start_id - 1
+    while True:
+        rows = list(get_queryset(model, site_id, last_id + 1, end_id).order_by('id').values_list('id', 'slug', 'publish_at', 'updated_at')[:batch_size])
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+class ShardWriter(object):
+    """
+        Writes one gzipped shard through a temporary file, renamed into place when it's closed.
+    """
+    def __init__(self, model, site_id, start_id):
+        self.start_id = start_id
+        self.name = get_shard_name(model, site_id, start_id)
+        self.fd, self.temp_path = tempfile.mkstemp(dir = settings.SITEMAP_ROOT, prefix = '.sitemap-')
+        self.gz = gzip.GzipFile(fileobj = os.fdopen(self.fd, 'wb'), mode = 'wb', mtime = 0)
+        self.gz.write('<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        self.count = 0
+        self.ids = 0
+        self.updated = None
+
+    def write(self, pk, url, updated_at):
+        updated = format_updated(updated_at)
+        self.gz.write("<url><loc>%s</loc>%s</url>\n" % (escape(url), updated and "<lastmod>%s</lastmod>" % updated or ''))
+        self.count += 1
+        self.ids += pk
+        self.updated = max(self.updated, updated)
+
+    def close(self, end_id):
+        """
+            @type end_id: int
+            @param end_id: The first id after the shard's range, or None if it's the last shard.
+
+            @rtype: dict
+            @return: The shard's manifest entry.
+        """
+        self.gz.write('</urlset>\n')
+        fileobj = self.gz.fileobj
+        self.gz.close()
+        fileobj.close()
+        os.chmod(self.temp_path, 0644)
+        os.rename(self.temp_path, os.path.join(settings.SITEMAP_ROOT, self.name))
+        return {'start': self.start_id, 'end': end_id, 'file': self.name, 'fingerprint': [self.count, self.ids, self.updated]}
+
+def write_range(model, site_id, start_id, end_id = None, batch_size = 5000):
+    """
+        Writes the shards for an id range, splitting it into as many as it takes to stay within
+        settings.SITEMAP_SHARD_SIZE URLs each.
+
+        @rtype: list
+        @return: The shards' manifest entries, in id order.
+    """
+    url_format = "http://%s%s" % (Site.objects.get(pk = site_id).domain.replace('%', '%%'), model.get_url_format())
+    shards = []
+    writer = ShardWriter(model, site_id, start_id)
+    for pk, slug, publish_at, updated_at in iter_rows(model, site_id, start_id, end_id, batch_size):
+        if writer.count >= settings.SITEMAP_SHARD_SIZE:
+            shards.append(writer.close(pk))
+            writer = ShardWriter(model, site_id, pk)
+        writer.write(pk, fill_url(url_format, pk, slug, publish_at), updated_at)
+    shards.append(writer.close(end_id))
+    return shards
+
+def write_index(site_id, manifest):
+    """
+        Writes a site's sitemap index, listing every model's shards.
+    """
+    domain = Site.objects.get(pk = site_id).domain
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+    for name in sorted(manifest):
+        for shard in manifest[name]:
+            if not shard['fingerprint'][0]:
+                continue
+            loc = "http://%s%s%s" % (domain, settings.SITEMAP_URL, shard['file'])
+            lastmod = shard['fingerprint'][2] and "<lastmod>%s</lastmod>" % shard['fingerprint'][2] or ''
+            lines.append("<sitemap><loc>%s</loc>%s</sitemap>" % (escape(loc), lastmod))
+    lines.append('</sitemapindex>\n')
+    write_atomic(os.path.join(settings.SITEMAP_ROOT, get_index_name(site_id)), '\n'.join(lines))
+
+def get_changes(model, site_id):
+    """
+        @rtype: tuple
+        @return: (the ids of the SitemapChanges for a model on a site, the ids of the objects they're for)
+    """
+    from apps.content.models import SitemapChange
+
+    changes = list(SitemapChange.objects.filter(content_type = ContentType.objects.get_for_model(model), site = site_id).values_list('id', 'object_id'))
+    return [change_id for change_id, object_id in changes], set([object_id for change_id, object_id in changes])
+
+def is_changed(shard, changed_ids):
+    """
+        @rtype: boolean
+        @return: True if any of the ids is in a shard's range.
+    """
+    return any(shard['start'] <= pk and (shard['end'] is None or pk < shard['end']) for pk in changed_ids)
+
+def generate(site_id, full = False, batch_size = 5000):
+    """
+        Brings a site's sitemaps up to date, rewriting only the shards whose content changed since the last run, then
+        writes the index and manifest and removes the files the manifest no longer lists, such as after a full run.
+
+        @type full: boolean
+        @param full: Rewrite every shard.
+
+        @rtype: tuple
+        @return: (shards written, shards left as they were)
+    """
+    from apps.content.models import SitemapChange
+
+    if not os.path.isdir(settings.SITEMAP_ROOT):
+        os.makedirs(settings.SITEMAP_ROOT)
+    previous = read_manifest(site_id)
+    manifest = {}
+    written = kept = 0
+    # Read before the shards, so a change made during the run is left for the next one.
+    change_ids = []
+    for model in sorted(registered_models, key = lambda model: model._meta.object_name):
+        name = model._meta.object_name.lower()
+        model_change_ids, changed_ids = get_changes(model, site_id)
+        change_ids.extend(model_change_ids)
+        old_shards = not full and previous.get(name) or [{'start': 0, 'end': None, 'fingerprint': None}]
+        shards = []
+        for shard in old_shards:
+            if not is_changed(shard, changed_ids) and shard['fingerprint'] == get_fingerprint(model, site_id, shard['start'], shard['end']):
+                shards.append(shard)
+                kept += 1
+                continue
+            new_shards = write_range(model, site_id, shard['start'], shard['end'], batch_size)
+            written += len(new_shards)
+            shards.extend(new_shards)
+        manifest[name] = shards
+
+    write_index(site_id, manifest)
+    write_atomic(get_manifest_path(site_id), json.dumps(manifest, indent = 1))
+    for chunk in chunked(change_ids):
+        SitemapChange.objects.filter(id__in = chunk).delete()
+
+    current = set([shard['file'] for model_shards in manifest.values() for shard in model_shards])
+    stale = set([shard.get('file') for model_shards in previous.values() for shard in model_shards]) - current
+    for file_name in stale:
+        if file_name:
+            try:
+                os.remove(os.path.join(settings.SITEMAP_ROOT, file_name))
+            except OSError:
+                pass
+    return written, kept
+
+def record_changes(model, pk_list):
+    """
+        Leaves a SitemapChange for each of the objects' sites.
+    """
+    from apps.content.models import SitemapChange
+
+    ctype = ContentType.objects.get_for_model(model)
+    sites_field = model._meta.get_field('sites')
+    through = sites_field.rel.through
+    source, target = sites_field.m2m_field_name(), sites_field.m2m_reverse_field_name()
+    changes = []
+    for chunk in chunked(list(pk_list)):
+        for object_id, site_id in through.objects.filter(**{'%s__in' % source: chunk}).values_list(source, target):
+            changes.append(SitemapChange(content_type = ctype, object_id = object_id, site_id = site_id))
+    SitemapChange.objects.bulk_create(changes)
+
+def remember_url(sender, instance, raw = False, **kwargs):
+    """
+        pre_save handler. Stores the object's slug and publish date in the database, so post_save can tell if its URL
+        changed.
+    """
+    instance._sitemap_previous = None
+    if instance.pk and not raw:
+        instance._sitemap_previous = tuple(sender._default_manager.filter(pk = instance.pk).values_list('slug', 'publish_at')[:1])
+
+def record_on_save(sender, instance, created, raw = False, **kwargs):
+    """
+        post_save handler. New objects are found by the shards' id counts and sums.
+    """
+    if raw or created:
+        return
+    previous = getattr(instance, '_sitemap_previous', None)
+    if previous and previous != ((instance.slug, instance.publish_at),):
+        record_changes(sender, [instance.pk])
+
+def record_on_bulk_save(sender, instances, created, previous, **kwargs):
+    """
+        post_bulk_save handler, for transitions that move the publish date.
+    """
+    if created:
+        return
+    moved = []
+    for instance in instances:
+        old = (previous or {}).get(instance.pk, {})
+        if old.get('slug', instance.slug) != instance.slug or old.get('publish_at', instance.publish_at) != instance.publish_at:
+            moved.append(instance.pk)
+    if moved:
+        record_changes(sender, moved)
+
+def register(model):
+    """
+        Adds a content model to the sitemaps. The model needs the published manager, get_url_format and a sites relation,
+        as Article has.
+    """
+    if model in registered_models:
+        return
+    registered_models.add(model)
+
+    pre_save.connect(remember_url, sender = model)
+    post_save.connect(record_on_save, sender = model)
+    post_bulk_save.connect(record_on_bulk_save, sender = model)
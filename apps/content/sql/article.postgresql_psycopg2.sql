@@ -0,0 +1,3 @@
+-- Full-text search vector for apps.content.search, kept up to date from post_save.
+ALTER TABLE content_article ADD COLUMN search_vector tsvector;
+CREATE INDEX content_article_search_vector ON content_article USING gin(search_vector);
@@ -0,0 +1,108 @@
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.views.main import ALL_VAR, ORDER_VAR, ORDER_TYPE_VAR, SEARCH_VAR, TO_FIELD_VAR, IS_POPUP_VAR
+from django.utils import formats
+from django.utils.text import capfirst
+from django.utils.translation import ugettext as _
+
+from apps.content import date_histogram
+from apps.content.models import ContentDateCount
+
+register = template.Library()
+
+# Changelist parameters which don't narrow the results.
+IGNORED_PARAMS = (ALL_VAR, ORDER_VAR, ORDER_TYPE_VAR, TO_FIELD_VAR, IS_POPUP_VAR)
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def cached_date_hierarchy(cl):
+    """
+        Drop-in replacement for the admin's date_hierarchy tag which reads the dates from the ContentDateCount histogram.
+        The histogram can narrow by site and status only, so any other filter or a search falls back to the standard tag.
+    """
+    if not cl.date_hierarchy:
+        return {}
+    if cl.date_hierarchy != 'publish_at' or cl.model not in date_histogram.registered_models:
+        return date_hierarchy(cl)
+
+    field_name = cl.date_hierarchy
+    year_field = '%s__year' % field_name
+    month_field = '%s__month' % field_name
+    day_field = '%s__day' % field_name
+    field_generic = '%s__' % field_name
+
+    params = dict(cl.params)
+    for param in IGNORED_PARAMS:
+        params.pop(param, None)
+    if params.pop(SEARCH_VAR, None):
+        return date_hierarchy(cl)
+    year_lookup = params.pop(year_field, None)
+    month_lookup = params.pop(month_field, None)
+    day_lookup = params.pop(day_field, None)
+    try:
+        site_id = int(params.pop('sites__id__exact', 0))
+        status = int(params.pop('status__exact', 0))
+    except ValueError:
+        return date_hierarchy(cl)
+    if params:
+        return date_hierarchy(cl)
+
+    link = lambda d: cl.get_query_string(d, [field_generic])
+    dates = lambda kind, **kwargs: [day for day, count in ContentDateCount.objects.dates(cl.model, kind, site_id = site_id, status = status, **kwargs)]
+
+    if not (year_lookup or month_lookup or day_lookup):
+        # select appropriate start level
+        first, last = ContentDateCount.objects.date_range(cl.model, site_id = site_id, status = status)
+        if first and last:
+            if first.year == last.year:
+                year_lookup = first.year
+                if first.month == last.month:
+                    month_lookup = first.month
+
+    if year_lookup and month_lookup and day_lookup:
+        day = datetime.date(int(year_lookup), int(month_lookup), int(day_lookup))
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup, month_field: month_lookup}),
+                'title': capfirst(formats.date_format(day, 'YEAR_MONTH_FORMAT'))
+            },
+            'choices': [{'title': capfirst(formats.date_format(day, 'MONTH_DAY_FORMAT'))}]
+        }
+    elif year_lookup and month_lookup:
+        days = dates('day', year = int(year_lookup), month = int(month_lookup))
+        return {
+            'show': True,
+            'back': {
+                'link': link({year_field: year_lookup}),
+                'title': str(year_lookup)
+            },
+            'choices': [{
+                'link': link({year_field: year_lookup, month_field: month_lookup, day_field: day.day}),
+                'title': capfirst(formats.date_format(day, 'MONTH_DAY_FORMAT'))
+            } for day in days]
+        }
+    elif year_lookup:
+        months = dates('month', year = int(year_lookup))
+        return {
+            'show': True,
+            'back': {
+                'link': link({}),
+                'title': _('All dates')
+            },
+            'choices': [{
+                'link': link({year_field: year_lookup, month_field: month.month}),
+                'title': capfirst(formats.date_format(month, 'YEAR_MONTH_FORMAT'))
+            } for month in months]
+        }
+    else:
+        years = dates('year')
+        return {
+            'show': True,
+            'choices': [{
+                'link': link({year_field: str(year.year)}),
+                'title': str(year.year),
+            } for year in years]
+        }
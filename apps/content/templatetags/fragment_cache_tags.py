@@ -0,0 +1,29 @@
+from django import template
+
+from apps.content.fragments import FragmentNode
+
+register = template.Library()
+
+
+@register.tag
+def fragment(parser, token):
+    """
+        Caches part of a content page on its own.
+
+            {% fragment content "comments" 60 %}
+                ...
+            {% endfragment %}
+
+        The first argument is the content object, the second the fragment's name, unique within the page, and the
+        optional third its timeout in seconds. See apps.content.fragments.
+    """
+    bits = token.split_contents()
+    if len(bits) not in (3, 4):
+        raise template.TemplateSyntaxError("%r tag takes a content object, a name and an optional timeout." % bits[0])
+    name = bits[2]
+    if not (name[0] == name[-1] and name[0] in ('"', "'")):
+        raise template.TemplateSyntaxError("%r tag's name must be in quotes." % bits[0])
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    timeout = len(bits) == 4 and parser.compile_filter(bits[3]) or None
+    return FragmentNode(parser.compile_filter(bits[1]), name[1:-1], timeout, nodelist)
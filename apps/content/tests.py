@@ -0,0 +1,277 @@
+import gzip
+import math
+import os
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+
+from apps.categories.models import Category
+from apps.content import related, sitemaps
+from apps.content.models import Article
+from apps.contentinfo.models import GFContentType
+from apps.utilities.bulk.bulk_utils import bulk_delete, bulk_transition
+from apps.utilities.cache.cache_utils import get_model_cache_key, get_model_cache_mapping
+from apps.utilities.cache.tags import get_tagged
+from apps.utilities.deferred.queue import batch
+from apps.utilities.stats.testing import assert_max_queries, assert_no_repeated_queries
+from apps.utilities.textindex.index import B, K1, BLOCK_SIZE, Document, TextIndex
+
+
+def create_article(**kwargs):
+    """
+        Creates a public article on the default site.
+    """
+    values = {'title': 'Test', 'slug': 'test', 'abstract': 'Abstract.', 'body': 'Body.'}
+    values.update(kwargs)
+    article = Article.objects.create(**values)
+    article.sites.add(1)
+    return article
+
+
+class ContentTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        GFContentType.objects.create(full_name = 'Article', model_name = 'Article', short_name = 'ar')
+
+
+@override_settings(CACHE_HTML = 600)
+class BulkDeleteTest(ContentTestCase):
+    def test_cached_page_is_dropped(self):
+        article = create_article()
+        url = article.get_absolute_url()
+        html_key = get_model_cache_key(Article, article.id, 1) + ".html"
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(get_tagged(html_key) is not None)
+
+        self.assertEqual(bulk_delete(Article.objects.filter(id = article.id)), 1)
+        # The instances bulk_delete loads are deferred, and must still clear the model's keys.
+        self.assertTrue(cache.get(html_key) is None)
+        self.assertTrue(get_tagged(html_key) is None)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(GROUP_CACHE_VERSION = 1, GROUP_CACHE_NEXT_VERSION = 2)
+class CacheVersionTest(ContentTestCase):
+    def test_edit_clears_warmed_keys(self):
+        article = create_article()
+        warmed = get_model_cache_mapping(Article, article, 1, version = 2)
+        cache.set_many(warmed, 600)
+
+        article.title = 'Edited'
+        article.save()
+        self.assertEqual(cache.get_many(warmed.keys()), {})
+
+
+class QueryCountTest(ContentTestCase):
+    def test_content_display(self):
+        parent = Category.add_root(name = 'News')
+        article = create_article()
+        article.categories.add(parent, parent.add_child(name = 'Local'), parent.add_child(name = 'Sports'))
+        for number in range(5):
+            article.authors.add(User.objects.create(username = 'author%d' % number))
+        url = article.get_absolute_url()
+
+        # The same however many categories and authors the article has.
+        with assert_max_queries(6):
+            with assert_no_repeated_queries(threshold = 2):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        # Served from the object caches.
+        with assert_max_queries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_admin_changelist(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        authors = [User.objects.create(username = 'author%d' % number) for number in range(3)]
+        for number in range(50):
+            article = create_article(slug = 'test-%d' % number)
+            article.authors.add(*authors[:number % 3 + 1])
+        self.client.login(username = 'admin', password = 'password')
+
+        # The same however many rows are listed.
+        with assert_max_queries(9):
+            with assert_no_repeated_queries(threshold = 3):
+                self.assertEqual(self.client.get('/admin/content/article/').status_code, 200)
+
+
+class ConditionalGetTest(ContentTestCase):
+    def test_etag_only(self):
+        article = create_article()
+        url = article.get_absolute_url()
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH = response['ETag']).status_code, 304)
+
+        # An edit that leaves updated_at alone still reaches clients that only send If-Modified-Since.
+        article.body = 'Edited.'
+        article.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE = 'Fri, 01 Jan 2038 00:00:00 GMT').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH = response['ETag']).status_code, 200)
+
+
+class RelatedContentTest(ContentTestCase):
+    def test_relations_saved_together_update_once(self):
+        category = Category.add_root(name = 'News')
+        author = User.objects.create(username = 'author')
+        other = create_article(slug = 'other')
+        other.categories.add(category)
+        article = create_article()
+
+        updates = []
+        update = related.update
+        related.update = lambda model, pk_list: updates.append(list(pk_list)) or update(model, pk_list)
+        try:
+            # As the admin saves the relations, in a request.
+            with batch():
+                article.categories.clear()
+                article.categories.add(category)
+                article.authors.clear()
+                article.authors.add(author)
+        finally:
+            related.update = update
+        self.assertEqual(updates, [[article.pk]])
+        self.assertEqual(related.related_for(Article, [article.pk])[article.pk], [other.pk])
+
+
+class SitemapTest(ContentTestCase):
+    def setUp(self):
+        super(SitemapTest, self).setUp()
+        self.root = tempfile.mkdtemp(prefix = 'sitemap-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read_shard(self, manifest_entry):
+        return gzip.open(os.path.join(self.root, manifest_entry['file'])).read()
+
+    def test_url_edits_rewrite_the_shard(self):
+        with self.settings(SITEMAP_ROOT = self.root, SITEMAP_SHARD_SIZE = 1000):
+            article = create_article(slug = 'old-slug')
+            self.assertEqual(sitemaps.generate(1), (1, 0))
+            self.assertEqual(sitemaps.generate(1), (0, 1))
+
+            article.slug = 'new-slug'
+            article.save()
+            self.assertEqual(sitemaps.generate(1), (1, 0))
+            shard = self.read_shard(sitemaps.read_manifest(1)['article'][0])
+            self.assertTrue('/new-slug-' in shard and '/old-slug-' not in shard)
+            self.assertEqual(sitemaps.generate(1), (0, 1))
+
+            publish_at = article.publish_at - timedelta(days = 3)
+            bulk_transition(Article.objects.filter(id = article.id), publish_at = publish_at)
+            self.assertEqual(sitemaps.generate(1), (1, 0))
+            shard = self.read_shard(sitemaps.read_manifest(1)['article'][0])
+            self.assertTrue(Article.objects.get(id = article.id).get_absolute_url() in shard)
+
+
+class TextIndexTest(SimpleTestCase):
+    """
+        Checks the pruned search against scoring every document, across pages, deletes, new segments and a merge.
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix = 'text-index-test-')
+        self.index = TextIndex(self.root, max_segments = 10)
+        self.random = random.Random(3)
+        self.vocabulary = [u"w%d" % number for number in range(300)]
+        self.documents = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def make_document(self, pk):
+        frequencies = {}
+        length = self.random.randint(1, 60)
+        for position in range(length):
+            # A Zipf-like spread, so the first few words are in most documents and span many blocks.
+            term = self.vocabulary[min(int(self.random.paretovariate(1.0)) - 1, len(self.vocabulary) - 1)]
+            frequencies[term] = frequencies.get(term, 0) + 1
+        filters = ["site:%d" % self.random.choice([1, 2]), "category:%d" % self.random.randint(1, 30)]
+        return Document(pk, frequencies, length, filters, self.random.choice([0, 0, 2000]), self.random.choice([0, 0, 500, 5000]))
+
+    def add(self, pks):
+        documents = [self.make_document(pk) for pk in pks]
+        self.documents.update((document.pk, document) for document in documents)
+        self.index.add(documents)
+
+    def delete(self, pks):
+        self.index.delete(pks)
+        for pk in pks:
+            self.documents.pop(pk)
+
+    def search_all(self, terms, filters, now, limit, after):
+        """
+            Scores every matching document. Document frequencies and the average length come from the index, since
+            they count deleted documents until a merge.
+        """
+        index = self.index
+        index.refresh()
+        total_docs = len(self.documents)
+        average_length = float(sum(entry['length'] for entry in index.manifest['segments'])) / sum(len(segment.pks) for segment in index.segments)
+        weights = {}
+        for term in terms:
+            frequency = min(sum(segment.document_frequency(term) for segment in index.segments), total_docs)
+            weights[term] = math.log(1 + (total_docs - frequency + 0.5) / (frequency + 0.5)) * (K1 + 1)
+        results = []
+        for document in self.documents.values():
+            if any(term not in document.frequencies for term in terms) or any(term not in document.filters for term in filters):
+                continue
+            if now is not None and (document.publish_at > now or 0 < document.expires_at < now):
+                continue
+            norm = K1 * (1 - B + B * document.length / average_length)
+            score = sum(weights[term] * document.frequencies[term] / (document.frequencies[term] + norm) for term in terms)
+            if after is None or (score, document.pk) < after:
+                results.append((score, document.pk))
+        return sorted(results, reverse = True)[:limit]
+
+    def assert_matches(self, queries, pages = 3, limit = 20):
+        for query, filters, now in queries:
+            terms = sorted(set(query.split()))
+            after = None
+            for page in range(pages):
+                hits = self.index.search(query, filters, now, limit, after)
+                expected = self.search_all(terms, filters, now, limit, after and after[:2])
+                self.assertEqual([pk for score, pk in hits], [pk for score, pk in expected], "%r %r %r page %d" % (query, filters, now, page))
+                for (score, pk), (expected_score, expected_pk) in zip(hits, expected):
+                    self.assertAlmostEqual(score, expected_score, places = 9)
+                if len(hits) < limit:
+                    break
+                after = hits[-1] + (hits.generation,)
+
+    def get_queries(self, count):
+        queries = []
+        for number in range(count):
+            words = self.random.sample(self.vocabulary[:self.random.choice([3, 20, 300])], self.random.choice([1, 1, 2, 3]))
+            filters = self.random.sample(["site:1", "site:2", "category:%d" % self.random.randint(1, 30)], self.random.randint(0, 2))
+            queries.append((u" ".join(words), filters, self.random.choice([None, None, 1000, 3000])))
+        return queries
+
+    def test_matches_scoring_every_document(self):
+        for number in range(6):
+            self.add(self.random.sample(xrange(1, 6000), 2000))
+        self.delete(self.random.sample(self.documents.keys(), 300))
+        # The common words span many blocks, so the pruning is exercised.
+        self.index.refresh()
+        self.assertTrue(max(segment.document_frequency(u"w0") for segment in self.index.segments) > BLOCK_SIZE * 4)
+        self.assert_matches(self.get_queries(150))
+
+        self.index.merge(full = True)
+        self.index.refresh()
+        self.assertEqual(len(self.index.segments), 1)
+        self.assert_matches(self.get_queries(150))
+
+    def test_paging_across_changes(self):
+        self.add(xrange(1, 3000))
+        hits = self.index.search(u"w0", limit = 10)
+        after = hits[-1] + (hits.generation,)
+        # A new segment changes every score, and the next page continues after the last result's new score.
+        self.add(xrange(3000, 3500))
+        self.delete([hits[0][1]])
+        following = self.index.search(u"w0", limit = 10, after = after)
+        self.assertNotEqual(following.generation, hits.generation)
+        rescored = [result for result in self.search_all([u"w0"], [], None, len(self.documents), None) if result[1] == after[1]][0]
+        self.assertEqual([pk for score, pk in following], [pk for score, pk in self.search_all([u"w0"], [], None, 10, rescored)])
@@ -0,0 +1,192 @@
+"""
+    Keeps content in the on-disk text index (see L{apps.utilities.textindex.index}), for deployments that search
+    without Postgres full-text search. Enabled by settings.SEARCH_INDEX_ROOT, with one index directory per model.
+
+    Each object is indexed with its title, abstract and body, weighted in that order, and with filter terms for its
+    sites, its status and its categories along with their parents. Saves and site and category changes re-index the
+    object once, after the request (see L{apps.utilities.deferred.queue}); bulk transitions and deletes update the
+    index as they happen. Once saves have added more than settings.SEARCH_INDEX_MAX_SEGMENTS segments, a background
+    thread merges them. The rebuild_search_index command builds the whole index from the database; run it after moving
+    categories, since content under a moved category stays filed under its old parents until then.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from apps.utilities.bulk.bulk_utils import post_bulk_save, pre_bulk_delete, chunked
+from apps.utilities.deferred.queue import defer
+from apps.utilities.sites.current import get_site_id
+from apps.utilities.textindex.index import Document, TextIndex, analyze
+
+# The content models kept in the text index.
+registered_models = set()
+
+# Open indexes, by model.
+indexes = {}
+merge_lock = threading.Lock()
+
+# How much each field counts towards a document's score.
+FIELD_WEIGHTS = (('title', 3), ('abstract', 2), ('body', 1))
+
+
+def is_enabled(model):
+    return model in registered_models and bool(settings.SEARCH_INDEX_ROOT)
+
+def get_index(model):
+    """
+        @rtype: L{TextIndex}
+        @return: The model's index, opened once per process.
+    """
+    if model not in indexes:
+        root = "%s/%s" % (settings.SEARCH_INDEX_ROOT.rstrip('/'), model._meta.db_table)
+        indexes[model] = TextIndex(root, settings.SEARCH_INDEX_MAX_SEGMENTS)
+    return indexes[model]
+
+def to_epoch(value):
+    return value and int(time.mktime(value.timetuple())) or 0
+
+def get_document(content_obj, site_ids = None, category_ids = None):
+    """
+        Builds an object's index document.
+
+        @type site_ids: list
+        @param site_ids: The object's site ids, if already known, to save a query.
+
+        @type category_ids: list
+        @param category_ids: The ids of the object's categories and their parents, if already known.
+
+        @rtype: L{Document}
+        @return: The document.
+    """
+    frequencies, length = analyze([(getattr(content_obj, field, u''), weight) for field, weight in FIELD_WEIGHTS])
+    if site_ids is None:
+        site_ids = content_obj.sites.values_list('id', flat = True)
+    if category_ids is None:
+        # get_categories includes the parents, so filtering on a category finds the content filed under its children.
+        category_ids = [category.id for category in content_obj.get_categories() or []]
+    filters = ["site:%d" % site_id for site_id in site_ids]
+    filters.append("status:%d" % content_obj.status)
+    filters.extend(["category:%d" % category_id for category_id in category_ids])
+    return Document(content_obj.pk, frequencies, length, filters, to_epoch(content_obj.publish_at), to_epoch(content_obj.expires_at))
+
+def index_objects(model, content_objs):
+    """
+        Adds or replaces objects in their model's index, then starts a merge in the background if it has too many segments.
+
+        @type content_objs: list
+        @param content_objs: Objects of the model.
+
+        @rtype: None
+        @return: None
+    """
+    if not content_objs:
+        return
+    index = get_index(model)
+    index.add([get_document(content_obj) for content_obj in content_objs])
+    if index.needs_merge():
+        merge_in_background(index)
+
+def index_pks(model, pks):
+    """
+        Indexes objects by primary key, reading them from the database, for deferred re-indexing. Objects deleted since
+        were taken out of the index when they were deleted.
+    """
+    for chunk in chunked(list(pks)):
+        index_objects(model, list(model._default_manager.filter(pk__in = chunk)))
+
+def merge_in_background(index):
+    """
+        Merges an index's small segments in a daemon thread, unless this process is already merging.
+    """
+    if not merge_lock.acquire(False):
+        return
+    def run():
+        try:
+            index.merge()
+        finally:
+            merge_lock.release()
+    thread = threading.Thread(target = run, name = 'text-index-merge')
+    thread.daemon = True
+    thread.start()
+
+def search(model, query, filters = (), limit = 20, after = None, public = True):
+    """
+        Searches a model's index.
+
+        @type filters: list
+        @param filters: Filter terms, such as category:4.
+
+        @type after: tuple
+        @param after: The (score, pk, generation) of the last result on the previous page, as given by the results'
+            generation attribute.
+
+        @type public: boolean
+        @param public: Only search content that is public on the current site now.
+
+        @rtype: L{Hits}
+        @return: (score, pk) tuples, best first.
+    """
+    filters = list(filters)
+    now = None
+    if public:
+        filters += ["site:%d" % get_site_id(), "status:%d" % model.STATUS_CHOICES.public]
+        now = int(time.time())
+    return get_index(model).search(query, filters, now, limit, after)
+
+
+def index_on_save(sender, instance, raw = False, **kwargs):
+    """
+        post_save handler.
+    """
+    if settings.SEARCH_INDEX_ROOT and not raw:
+        defer(index_pks, sender, [instance.pk])
+
+def index_on_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+        m2m_changed handler for the sites and categories relations, which the admin saves after the object.
+    """
+    if not settings.SEARCH_INDEX_ROOT or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        defer(index_pks, instance.__class__, [instance.pk])
+    elif pk_set:
+        defer(index_pks, model, pk_set)
+
+def unindex_on_delete(sender, instance, **kwargs):
+    """
+        post_delete handler.
+    """
+    if settings.SEARCH_INDEX_ROOT:
+        get_index(sender).delete([instance.pk])
+
+def index_on_bulk_save(sender, instances, **kwargs):
+    """
+        post_bulk_save handler, for bulk transitions and imports.
+    """
+    if settings.SEARCH_INDEX_ROOT:
+        index_objects(sender, list(instances))
+
+def unindex_on_bulk_delete(sender, pk_list, **kwargs):
+    """
+        pre_bulk_delete handler.
+    """
+    if settings.SEARCH_INDEX_ROOT:
+        get_index(sender).delete(pk_list)
+
+def register(model):
+    """
+        Starts keeping a content model in the text index. The model needs a sites field, a status and
+        get_categories, as GenericContent subclasses have.
+    """
+    if model in registered_models:
+        return
+    registered_models.add(model)
+
+    post_save.connect(index_on_save, sender = model)
+    post_delete.connect(unindex_on_delete, sender = model)
+    m2m_changed.connect(index_on_m2m_changed, sender = model.sites.through)
+    m2m_changed.connect(index_on_m2m_changed, sender = model.categories.through)
+    post_bulk_save.connect(index_on_bulk_save, sender = model)
+    pre_bulk_delete.connect(unindex_on_bulk_delete, sender = model)
@@ -8,6 +8,17 @@ info_dict = {
 
 urlpatterns = patterns('',
 
+    #SEARCH
+    url(r'^search/$', 'apps.content.views.content_search', name="content_search"),
+
+    #API
+    url(r'^api/(?P<model_name>\w+)/$', 'apps.content.views.content_api', name="content_api_list"),
+    url(r'^api/(?P<model_name>\w+)/(?P<id>\d+)/$', 'apps.content.views.content_api', name="content_api_detail"),
+
+    #FEEDS
+    url(r'^feeds/(?P<format>rss|atom)/$', 'apps.content.views.content_feed', name="content_feed"),
+    url(r'^feeds/(?P<format>rss|atom)/category/(?P<category_id>\d+)/$', 'apps.content.views.content_feed', name="content_category_feed"),
+
     #MAIN CONTENT
     url(r'^(?P<year>\d{4})/(?P<month>\w{3})/(?P<day>\d{1,2})/(?P<slug>[\w-]+)-(?P<content_type>\w{2})-(?P<id>\d{1,10})/$', 'apps.content.views.content_display', name="content_detail"),
 )
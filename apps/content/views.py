@@ -1,5 +1,8 @@
 from datetime import date
+import gzip
+import json
 import time
+from cStringIO import StringIO
 
 from django.http import HttpResponse, Http404, HttpResponsePermanentRedirect, HttpResponseServerError
 from django.shortcuts import render_to_response, get_object_or_404, redirect
@@ -11,9 +14,18 @@ from django.views.decorators.cache import never_cache
 from django.views.decorators.vary import vary_on_headers
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
 
-from apps.utilities.cache.cache_utils import get_model_cache_key, get_model_slug_cache_key
+from django.utils.cache import patch_vary_headers
+
+from apps.utilities.cache.cache_utils import get_model_cache_key, get_model_slug_cache_key, get_content_type_cache_key, get_cache_with_fallback, set_model_cache
+from apps.categories.models import Category
+from apps.content import api, feeds, search
+from apps.content.fragments import render_fragmented
 from apps.content.models import GenericContent, Article
 from apps.contentinfo.models import GFContentType
+from apps.utilities.cache.conditional import get_content_etag, get_response_etag, is_not_modified, not_modified, set_validators
+from apps.utilities.cache.tags import get_tag_generations, get_tagged, set_tagged
+from apps.utilities.sites.current import get_site_id
+from apps.utilities.stats import request_stats
 
 ######################################
 # CONTENT DETAIL
@@ -52,18 +64,22 @@ def content_display(request, slug, year, month, day, content_type, id):
         raise Http404('Invalid date.')
     
     # Determine the content type. This will help us look up the cache key for the object.
-    ctype_cache_key = "%s::contenttype::%s::%s" % (settings.GROUP_NAME, str(content_type).lower(), settings.GROUP_CACHE_VERSION)
-    content_type_name = cache.get(ctype_cache_key)
+    ctype_cache_key = get_content_type_cache_key(content_type)
+    with request_stats.timer('content_display.ctype_cache'):
+        content_type_name = get_cache_with_fallback(get_content_type_cache_key, content_type)
+    request_stats.record('content_display.ctype_cache', content_type_name and 'hit' or 'miss')
     if not content_type_name:
-        content_type_name = get_object_or_404(GFContentType, short_name__iexact=content_type).model_name
+        with request_stats.timer('content_display.db'):
+            content_type_name = get_object_or_404(GFContentType, short_name__iexact=content_type).model_name
         cache.set(ctype_cache_key, content_type_name, settings.CACHE_LONG_SECONDS)
     try:
         content_type = get_model('content', content_type_name.lower())
     except Exception:
         return HttpResponseServerError
     
-    # Object Cache Key
-    cache_key = get_model_cache_key(content_type, id, settings.SITE_ID)
+    # Object Cache Key. Each site keeps its own, so a shared process pool serves every site from its own keys.
+    site_id = get_site_id()
+    cache_key = get_model_cache_key(content_type, id, site_id)
 
     # If the URL has ?clear_cache on it, and the user is staff, clear the cache despite any other timers/settings.
     # Otherwise, check the settings/timers normally.
@@ -79,35 +95,48 @@ def content_display(request, slug, year, month, day, content_type, id):
             # If settings for caching entrie HTML page is set then build the html page cache key
             html_cache_key = "%s.html" % cache_key
             # after building the html page cache key, check the cache to see if page exists
-            html = cache.get(html_cache_key)
-            # if page exists, return the cached page
+            # The page is tagged with everything shown on it, so edits to its categories, authors or sites drop it too.
+            with request_stats.timer('content_display.html_cache'):
+                html = get_tagged(html_cache_key)
+            request_stats.record('content_display.html_cache', html and 'hit' or 'miss')
+            # if page exists, return the cached page, or a 304 if the client's copy matches it
             if html:
+                etag = get_response_etag(html)
+                if etag and is_not_modified(request, etag):
+                    request_stats.record('content_display.conditional', 'not_modified')
+                    return not_modified(etag)
                 return html
             # if page does not exits, fall through and build html that will be cached and rendered
         
         # Try cache retrieval for object
-        content_obj = content_type.cache.get(id=id)
+        with request_stats.timer('content_display.object_cache'):
+            content_obj = content_type.cache.get(id=id)
+        # Scheduled content is cached just ahead of its publish time, so make sure it's live before showing it to the public.
+        if content_obj and not request.user.is_staff and not content_obj.is_public():
+            content_obj = None
+        request_stats.record('content_display.object_cache', content_obj and 'hit' or 'miss')
+    else:
+        request_stats.record('content_display.object_cache', 'bypass')
     
     # If cache get failed or cache was ordered to clear, find the content object from the DB.
     if not content_obj:
         # if the user is not staff, only select from published, public articles
         if not request.user.is_staff:
             # get the obj
-            content_obj = get_object_or_404(content_type.published, id=id, sites__id__exact=settings.SITE_ID)
+            with request_stats.timer('content_display.db'):
+                content_obj = get_object_or_404(content_type.published, id=id, sites__id__exact=site_id)
 
             # Don't cache staff requests, or else they'll be visible to all once cached.
-            model_key = get_model_cache_key(content_type, content_obj.id, settings.SITE_ID)
-            slug_key = get_model_slug_cache_key(content_type, content_obj.slug, settings.SITE_ID)
-            cache.set(model_key, content_obj, settings.CACHE_LONG_SECONDS)
-            cache.set(slug_key, model_key, settings.CACHE_LONG_SECONDS)
+            set_model_cache(content_type, content_obj, site_id)
             
         # if the user is staff, they are allowed to see draft/non-published articles
         else:
-            content_obj = get_object_or_404(content_type.objects, id=id, sites__id__exact=settings.SITE_ID)
+            with request_stats.timer('content_display.db'):
+                content_obj = get_object_or_404(content_type.objects, id=id, sites__id__exact=site_id)
             # Axe any cache for the object to be sure it is all clear.
             if clear_cache:
-                model_key = get_model_cache_key(content_type, content_obj.id, settings.SITE_ID)
-                slug_key = get_model_slug_cache_key(content_type, content_obj.slug, settings.SITE_ID)
+                model_key = get_model_cache_key(content_type, content_obj.id, site_id)
+                slug_key = get_model_slug_cache_key(content_type, content_obj.slug, site_id)
                 cache.delete(model_key)
                 cache.delete(slug_key)
     
@@ -120,16 +149,28 @@ def content_display(request, slug, year, month, day, content_type, id):
     # Some content types have external types that go offsite.
     if hasattr(content_obj, "article_type"):
         if content_obj.article_type == Article.TYPE_CHOICES.external or content_obj.article_type == Article.TYPE_CHOICES.aggregated:
+            request_stats.record('content_display.redirect', 'external')
             return HttpResponsePermanentRedirect(absolute_url)
 
     # One of the tricky things about caching via ID is that, once cached, it ceases to care what the slug is because it's pulling cache by the ID passed in. Validate the slug.
     if content_obj.slug != slug:
+        request_stats.record('content_display.redirect', 'slug')
         return HttpResponsePermanentRedirect(absolute_url)
      
     # If the date passed in through the URL doesn't match the content's actual publish date, 301 redirect to the correct URL.
     if content_obj.publish_at.date() != valid_date:
+        request_stats.record('content_display.redirect', 'date')
         return HttpResponsePermanentRedirect(absolute_url)
     
+    # Answer conditional GETs from the object alone, before any template work. Staff may be looking at a draft, so their pages are never validated or shared.
+    if not request.user.is_staff:
+        # Read before rendering, so an invalidation during the render leaves the cached page stale rather than lost.
+        tag_generations = get_tag_generations(content_obj.get_cache_tags())
+        etag = get_content_etag(content_obj, tag_generations)
+        if is_not_modified(request, etag):
+            request_stats.record('content_display.conditional', 'not_modified')
+            return not_modified(etag)
+
     # assign the rendered template to a variable that can be cached and/or rendered
     template = "content/"
     template += str(content_type_name).lower()
@@ -137,10 +178,118 @@ def content_display(request, slug, year, month, day, content_type, id):
     context_dict = {
         'content': content_obj,
     }
-    html = render_to_response(template, context_dict, context_instance=RequestContext(request))
+    with request_stats.timer('content_display.render'):
+        # With fragment caching on, public pages are put together from a long-lived shell and separately cached fragments.
+        if settings.CACHE_FRAGMENTS and not request.user.is_staff:
+            html = HttpResponse(render_fragmented(template, content_obj, RequestContext(request, context_dict), tag_generations))
+        else:
+            html = render_to_response(template, context_dict, context_instance=RequestContext(request))
+    if request.user.is_staff:
+        set_validators(html, get_content_etag(content_obj), public = False)
+    else:
+        set_validators(html, etag)
     
     # If HTML caching is on, cache the result before returning
     if settings.CACHE_HTML and not request.user.is_staff:
-        cache.set(html_cache_key, html, settings.CACHE_HTML)
+        set_tagged(html_cache_key, html, tag_generations, settings.CACHE_HTML)
+    
+    return html
+
+
+######################################
+# API
+#######################################
+def content_api(request, model_name, id = None):
+    """
+        The JSON content API. See L{apps.content.api} for the requests it takes.
+        
+        @param model_name: The content model's name in the URL, such as article.
+        @type model_name: string
+        
+        @param id: The object's id for a detail request, or None for bulk and list requests.
+        @type id: string
+        
+        @rtype: L{HttpResponse}
+        @return: The JSON, gzipped if the client accepts it, a 304 if the client's copy is current, or a JSON error.
+    """
+    model = api.registered_models.get(model_name)
+    if model is None:
+        return HttpResponse(json.dumps({'error': "No such content type."}), status = 404, content_type = 'application/json')
+    try:
+        site_id = request.GET.get('site') and api.parse_int(request.GET['site'], 'site') or get_site_id()
+        with request_stats.timer('content_api.response'):
+            data, etag = api.get_response(model, site_id, id and int(id) or None, request.GET)
+    except api.ApiError, e:
+        return HttpResponse(json.dumps({'error': unicode(e)}), status = 400, content_type = 'application/json')
+    if data is None:
+        return HttpResponse(json.dumps({'error': "Not found."}), status = 404, content_type = 'application/json')
+    
+    if is_not_modified(request, etag):
+        request_stats.record('content_api.conditional', 'not_modified')
+        return not_modified(etag)
+    # The response is cached gzipped, and only unzipped for clients that can't take it that way.
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(data, content_type = 'application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.GzipFile(fileobj = StringIO(data)).read(), content_type = 'application/json')
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return set_validators(response, etag)
+
+
+######################################
+# FEEDS
+#######################################
+def content_feed(request, format, category_id = None):
+    """
+        Serves the site's feed, or a category's, from the cached feeds kept by L{apps.content.feeds}.
+        
+        @param format: 'rss' or 'atom'.
+        @type format: string
+        
+        @param category_id: The category of a category feed, or None for the site's feed.
+        @type category_id: string
+        
+        @rtype: L{HttpResponse}
+        @return: The feed document, or a 304 if the client's copy is current.
+    """
+    try:
+        feed = feeds.get_feed(Article, get_site_id(), category_id and int(category_id) or None)
+    except Category.DoesNotExist:
+        raise Http404('No such category.')
     
-    return html
\ No newline at end of file
+    etag, last_modified = feeds.get_validators(Article, feed, format)
+    if is_not_modified(request, etag, last_modified):
+        request_stats.record('content_feed.conditional', 'not_modified')
+        return not_modified(etag, last_modified)
+    response = HttpResponse(feeds.render_feed(feed, format), content_type = feeds.FEED_CLASSES[format].mime_type)
+    return set_validators(response, etag, last_modified)
+
+
+######################################
+# SEARCH
+#######################################
+def content_search(request):
+    """
+        Public search over published articles on this site, best matches first.
+        
+        @param request: Django HttpRequest object. q holds the words searched for, category an optional category id to
+        search within, and after the token for the next page.
+        @type request: L{HttpRequest}
+        
+        @rtype: L{HttpResponse}
+        @return: HttpResponse with the results page.
+    """
+    query = request.GET.get('q', '')[:200]
+    category = None
+    if request.GET.get('category', '').isdigit():
+        category = get_object_or_404(Category, pk = request.GET['category'])
+    with request_stats.timer('content_search.query'):
+        results, next_token = search.search(Article, query, after = request.GET.get('after'), category = category)
+    context_dict = {
+        'query': query,
+        'category': category,
+        'results': results,
+        'next_token': next_token,
+    }
+    return render_to_response("content/search.html", context_dict, context_instance=RequestContext(request))
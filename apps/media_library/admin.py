@@ -0,0 +1,18 @@
+from django.contrib import admin
+
+from apps.media_library.models import GFImage
+from apps.utilities.admin_actions import delete_selected
+from apps.utilities.pagination.estimated_count import EstimatedCountAdminMixin
+
+######################################
+# GFIMAGE
+#######################################
+class GFImageAdmin(EstimatedCountAdminMixin, admin.ModelAdmin):
+    list_display = ('title', 'show_image', 'show_tags', 'created_at')
+    prepopulated_fields = {"slug": ("title",),}
+    search_fields = ['title']
+    actions = [delete_selected]
+    list_per_page = 50
+
+
+admin.site.register(GFImage, GFImageAdmin)
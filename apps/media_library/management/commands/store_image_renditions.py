@@ -0,0 +1,32 @@
+from collections import defaultdict
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.media_library.models import GFImage, ImageRendition
+
+
+class Command(BaseCommand):
+    """
+        Stores the rendition sizes of images saved before they were kept, or of every image after
+        settings.IMAGE_RENDITION_SIZES changes. Saving an image stores its own.
+    """
+    help = "Stores the encoded sizes of image renditions used by feed enclosures."
+    option_list = BaseCommand.option_list + (
+        make_option('--all', dest='all', action='store_true', default=False, help='Recompute images that already have their sizes stored.'),
+    )
+
+    def handle(self, *args, **options):
+        images = GFImage.objects.order_by('id')
+        if not options['all']:
+            sizes = set(settings.IMAGE_RENDITION_SIZES)
+            stored = defaultdict(set)
+            for image_id, width, height in ImageRendition.objects.values_list('image_id', 'width', 'height'):
+                stored[image_id].add((width, height))
+            images = images.exclude(pk__in = [image_id for image_id, found in stored.items() if sizes <= found])
+        count = 0
+        for image in images.iterator():
+            image.store_rendition_sizes()
+            count += 1
+        self.stdout.write("Stored renditions for %d images\n" % count)
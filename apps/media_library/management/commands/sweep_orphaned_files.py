@@ -0,0 +1,66 @@
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from apps.media_library.models import GFImage, OrphanedFile
+
+
+class Command(BaseCommand):
+    """
+        Removes the files queued by bulk deletes, then removes any day/month/year image directories they leave empty,
+        the same way GFImage.delete does for a single image. Run it from cron, or leave it running with --loop.
+    """
+    help = "Removes files left behind by bulk deletes of media."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000, help='Number of queued files handled per pass.'),
+        make_option('--loop', dest='loop', action='store_true', default=False, help='Keep running, sleeping between passes.'),
+        make_option('--interval', dest='interval', type='int', default=60, help='Seconds to sleep between passes with --loop.'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            removed = self.sweep(options['batch_size'])
+            # Keep going while there's a backlog, otherwise sleep or stop.
+            if removed < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+
+    def sweep(self, batch_size):
+        """
+            Handles one batch of queued files.
+
+            @rtype: int
+            @return: The number of queue entries processed.
+        """
+        queued = list(OrphanedFile.objects.all()[:batch_size])
+        if not queued:
+            return 0
+
+        # A new upload may have reused the path since it was queued.
+        paths = set(entry.path for entry in queued)
+        in_use = set(GFImage.objects.filter(image__in = paths).values_list('image', flat = True))
+
+        folders = set()
+        for path in paths - in_use:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            folders.add(os.path.dirname(path))
+
+        # Walk up the day, month and year directories, deepest first. rmdir fails on anything that isn't empty.
+        for level in range(3):
+            parents = set()
+            for folder_path in sorted(folders, reverse = True):
+                try:
+                    os.rmdir(folder_path)
+                    parents.add(os.path.dirname(folder_path))
+                except OSError:
+                    pass
+            folders = parents
+
+        OrphanedFile.objects.filter(id__in = [entry.id for entry in queued]).delete()
+        return len(queued)
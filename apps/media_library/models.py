@@ -10,7 +10,11 @@ from django.http import Http404
 
 from apps.utilities.managers.content_cache_manager import GenericContentCacheManager
 from apps.utilities.cache.cache_utils import resave_model_cache, delete_model_cache
+from apps.utilities.cache.tags import invalidate_object_tag
+from apps.utilities.bulk.bulk_utils import pre_bulk_delete
 from apps.utilities.easychoice import EasyChoices, EasyChoice
+from apps.utilities.jsonl import export
+from apps.utilities.sites.current import get_domain
 
 
 
@@ -127,9 +131,8 @@ class GFImage(models.Model):
         import os
        
         try:
-            # Delete the cache key for the image size used by RSS feeds
-            cache_key = "%s::%s::%s::%s::%s::%s" % (settings.SITE_PREFIX, self.slug, 100, 100, settings.CACHE_VERSION, "size")
-            cache.delete(cache_key)
+            # Delete the cache keys for the image sizes used by RSS feeds, which are recomputed below
+            cache.delete_many([self.get_size_cache_key(width, height) for width, height in settings.IMAGE_RENDITION_SIZES])
         except Exception:
             pass
         
@@ -176,6 +179,8 @@ class GFImage(models.Model):
                     new_im.save(full_image_path)
                 except Exception:
                     os.remove(full_image_path)
+        
+        self.store_rendition_sizes()
             
 
     def delete(self):
@@ -257,7 +262,7 @@ class GFImage(models.Model):
         
     def get_absolute_url(self):
         """Provide the full photo URL."""
-        return 'http://%s/gfmedia/image/full/%s/%s/' % (settings.SITE_DOMAIN, self.id, self.slug)
+        return 'http://%s/gfmedia/image/full/%s/%s/' % (get_domain(), self.id, self.slug)
     
     def get_resize_url(self, width, height):
         """
@@ -272,8 +277,36 @@ class GFImage(models.Model):
             @rtype: string
             @return: The URL of the resized image.
         """
-        return 'http://%s/gfmedia/image/%s/%s/%s/%s/' % (settings.SITE_DOMAIN, width, height, self.id, self.slug)
+        return 'http://%s/gfmedia/image/%s/%s/%s/%s/' % (get_domain(), width, height, self.id, self.slug)
+    
+    
+    def get_size_cache_key(self, width, height):
+        return "%s::%s::%s::%s::%s::%s" % (settings.SITE_PREFIX, self.slug, width, height, settings.CACHE_VERSION, "size")
     
+    def store_rendition_sizes(self):
+        """
+            Encodes the image at each of settings.IMAGE_RENDITION_SIZES once and stores the sizes as L{ImageRendition}s,
+            so feeds can read them instead of encoding the image for every enclosure.
+            
+            @rtype: None
+            @return: None
+        """
+        for width, height in settings.IMAGE_RENDITION_SIZES:
+            size = self.get_resized_size(width, height)
+            if size is None:
+                ImageRendition.objects.filter(image = self, width = width, height = height).delete()
+            elif not ImageRendition.objects.filter(image = self, width = width, height = height).update(size = size):
+                ImageRendition.objects.create(image = self, width = width, height = height, size = size)
+    
+    def get_rendition_size(self, width, height):
+        """
+            Returns the stored size of a resized image, in bytes, without encoding it.
+            
+            @rtype: int or None
+            @return: The size, or None if it hasn't been stored.
+        """
+        sizes = list(self.renditions.filter(width = width, height = height).values_list('size', flat = True)[:1])
+        return sizes and sizes[0] or None
     
     def get_resized_size(self, width, height):
         """
@@ -282,7 +315,7 @@ class GFImage(models.Model):
         """
         from PIL import Image, ImageOps
         
-        cache_key = "%s::%s::%s::%s::%s::%s" % (settings.SITE_PREFIX, self.slug, width, height, settings.CACHE_VERSION, "size")
+        cache_key = self.get_size_cache_key(width, height)
         size = cache.get(cache_key)
     
         if not size:
@@ -412,6 +445,84 @@ class GFImage(models.Model):
         
 post_save.connect(resave_model_cache, sender=GFImage)   
 post_delete.connect(delete_model_cache, sender=GFImage)        
+# Drops the content pages showing the image.
+post_save.connect(invalidate_object_tag, sender=GFImage)
+post_delete.connect(invalidate_object_tag, sender=GFImage)
+
+
+######################################
+# IMAGERENDITION
+#######################################
+class ImageRendition(models.Model):
+    """
+        The encoded size of one resized version of a GFImage, stored by GFImage.store_rendition_sizes when the image is
+        saved, or by the store_image_renditions command for existing images.
+        
+        @type image: L{GFImage}
+        @cvar image: The image.
+        
+        @type width: PositiveIntegerField
+        @cvar width: The width it was resized to, or 0 to keep the aspect ratio.
+        
+        @type height: PositiveIntegerField
+        @cvar height: The height it was resized to, or 0 to keep the aspect ratio.
+        
+        @type size: PositiveIntegerField
+        @cvar size: The size of the resized image, in bytes.
+        
+    """
+    image = models.ForeignKey(GFImage, related_name = 'renditions')
+    width = models.PositiveIntegerField('width')
+    height = models.PositiveIntegerField('height')
+    size = models.PositiveIntegerField('size')
+    
+    class Meta:
+        unique_together = ('image', 'width', 'height')
+        verbose_name = "Image Rendition"
+        verbose_name_plural = "Image Renditions"
+        
+    def __unicode__(self):
+        return u"%s %sx%s: %s" % (self.image_id, self.width, self.height, self.size)
+
+# The images' metadata goes in the JSONL export. The files themselves don't.
+export.register(MLTag)
+export.register(GFImage)
+export.register(ImageRendition)
+
+
+######################################
+# ORPHANEDFILE
+#######################################
+class OrphanedFile(models.Model):
+    """
+        A file left on disk by a bulk delete. Bulk deletes don't touch the filesystem; instead the paths are queued here
+        and removed, along with any day/month/year directories left empty, by the sweep_orphaned_files command.
+        
+        @type path: CharField
+        @cvar path: The full path of the file to remove.
+        
+        @type queued_at: DateTimeField
+        @cvar queued_at: Date/time stamp for when the file was queued.
+        
+    """
+    path = models.CharField('path', max_length=500)
+    queued_at = models.DateTimeField('queued at', auto_now_add = True)
+    
+    class Meta:
+        verbose_name = "Orphaned File"
+        verbose_name_plural = "Orphaned Files"
+        ordering = ('id',)
+        
+    def __unicode__(self):
+        return self.path
+
+def queue_image_files(sender, pk_list, **kwargs):
+    """
+        Queues the files of GFImages that are about to be bulk deleted for the sweeper.
+    """
+    paths = GFImage.objects.filter(pk__in = pk_list).values_list('image', flat = True)
+    OrphanedFile.objects.bulk_create([OrphanedFile(path = path) for path in paths if path])
+pre_bulk_delete.connect(queue_image_files, sender=GFImage)
         
      
 ######################################
@@ -1,35 +1,44 @@
+from django.db.models.deletion import ProtectedError
+from django.http import HttpResponseServerError
+
 from apps.content.models import GenericContent
+from apps.utilities.bulk.bulk_utils import bulk_transition, bulk_delete
 
 def make_public(modeladmin, request, queryset):
     """
-        Sets content to public. Note we iterate and save, rather than doing an update(), because we need the post_save signals
-        to fire.
+        Sets content to public. The status is changed with a bulk update rather than a save() per object;
+        bulk_transition creates the revisions, clears the cache and sends post_bulk_save for the whole batch.
     """
     try:
-        for obj in queryset:
-            obj.status = GenericContent.STATUS.public
-            obj.save()
+        count = bulk_transition(queryset, user = request.user, comment = "Marked as public.", status = GenericContent.STATUS_CHOICES.public)
     except Exception:
-        return HttpResponseServerError
+        return HttpResponseServerError()
+    modeladmin.message_user(request, "%d item(s) marked as public." % count)
 make_public.short_description = 'Mark selected content as public'
 
 def make_draft(modeladmin, request, queryset):
     """
-        Sets content to draft. Note we iterate and save, rather than doing an update(), because we need the post_save signals
-        to fire.
+        Sets content to draft. The status is changed with a bulk update rather than a save() per object;
+        bulk_transition creates the revisions, clears the cache and sends post_bulk_save for the whole batch.
     """
     try:
-        for obj in queryset:
-            obj.status = GenericContent.STATUS.draft
-            obj.save()
+        count = bulk_transition(queryset, user = request.user, comment = "Marked as draft.", status = GenericContent.STATUS_CHOICES.draft)
     except Exception:
-        return HttpResponseServerError
+        return HttpResponseServerError()
+    modeladmin.message_user(request, "%d item(s) marked as draft." % count)
 make_draft.short_description = 'Mark selected content as draft'
 
 def delete_selected(modeladmin, request, queryset):
+    """
+        Deletes the selected objects with set-based queries through bulk_delete. Model delete() methods aren't called;
+        anything they would have cleaned up (such as GFImage files) is handled by pre_bulk_delete listeners.
+    """
     try:
-        for obj in queryset:
-            obj.delete()
+        count = bulk_delete(queryset)
+    except ProtectedError, e:
+        modeladmin.message_user(request, "Nothing was deleted: %s" % e.args[0])
+        return
     except Exception:
-        return HttpResponseServerError
-delete_selected.short_description = 'Delete selected'
\ No newline at end of file
+        return HttpResponseServerError()
+    modeladmin.message_user(request, "%d item(s) deleted." % count)
+delete_selected.short_description = 'Delete selected'
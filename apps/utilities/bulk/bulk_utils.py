@@ -0,0 +1,283 @@
+from django.core.management.color import no_style
+from django.db import connections, models, transaction
+from django.db.models.deletion import Collector
+from django.db.models.sql import DeleteQuery
+from django.dispatch import Signal
+
+import reversion
+from reversion.models import Revision, Version, VERSION_ADD, VERSION_CHANGE, pre_revision_commit, post_revision_commit
+
+from apps.utilities.cache.cache_utils import delete_model_cache_many
+
+# Number of primary keys sent per IN clause. Keeps us under SQLite's 999 variable limit.
+BULK_CHUNK_SIZE = 500
+
+# Sent once per batch after a bulk write, in place of one post_save per object.
+# instances: the objects as they now stand in the DB.
+# created: True if the rows were inserted rather than updated.
+# previous: dict of pk -> dict of the old values of the changed fields, or None when created.
+post_bulk_save = Signal(providing_args=["instances", "created", "previous"])
+
+# Sent for each chunk of a bulk delete, inside the transaction and before any rows are removed.
+# pk_list: the primary keys about to be deleted.
+pre_bulk_delete = Signal(providing_args=["pk_list"])
+
+# Sent once after a bulk delete has been committed.
+# instances: the deleted objects. Only the pk and slug are loaded.
+post_bulk_delete = Signal(providing_args=["instances"])
+
+
+def chunked(items, size = BULK_CHUNK_SIZE):
+    """
+        Splits a list into lists of at most size items.
+
+        @type items: list
+        @param items: The list to split.
+
+        @type size: int
+        @param size: The maximum length of each chunk.
+
+        @rtype: generator
+        @return: Generator yielding the chunks in order.
+    """
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+def save_revisions(instances, user = None, comment = "", type_flag = VERSION_CHANGE):
+    """
+        Creates a single Reversion revision holding a version of every object passed in.
+        The versions are written with one bulk_create rather than one save per object.
+
+        @type instances: list
+        @param instances: Model instances of a single class.
+
+        @type user: L{User}
+        @param user: The user the revision is attributed to.
+
+        @type comment: string
+        @param comment: The revision comment.
+
+        @type type_flag: int
+        @param type_flag: The versions' type, VERSION_CHANGE, or VERSION_ADD for new objects.
+
+        @rtype: L{Revision} or None
+        @return: The new revision, or None if the class isn't registered with Reversion or there was nothing to save.
+    """
+    if not instances:
+        return None
+
+    model = instances[0].__class__
+    if not reversion.is_registered(model):
+        return None
+
+    adapter = reversion.get_adapter(model)
+    revision = Revision(manager_slug = reversion.default_revision_manager._manager_slug, user = user, comment = comment)
+    versions = [Version(**adapter.get_version_data(obj, type_flag)) for obj in instances]
+
+    pre_revision_commit.send(reversion.default_revision_manager, instances = instances, revision = revision, versions = versions)
+    revision.save()
+    for version in versions:
+        version.revision = revision
+    Version.objects.bulk_create(versions)
+    post_revision_commit.send(reversion.default_revision_manager, instances = instances, revision = revision, versions = versions)
+
+    return revision
+
+def bulk_transition(queryset, user = None, comment = "", **values):
+    """
+        Applies the same field values to every object in a queryset with one UPDATE per chunk of primary keys.
+        Revisions are created in one batch and the object caches are cleared in a single pass, after which
+        post_bulk_save is sent once with the refreshed objects so listeners can do the work they would have done in post_save.
+
+        Note that the model's save() is not called, so only use this for fields that save() doesn't normalize, such as status.
+
+        @type queryset: L{QuerySet}
+        @param queryset: The objects to update.
+
+        @type user: L{User}
+        @param user: The user the revision is attributed to.
+
+        @type comment: string
+        @param comment: The revision comment.
+
+        @param values: The field values to set, as keyword arguments.
+
+        @rtype: int
+        @return: The number of objects updated.
+    """
+    model = queryset.model
+    manager = model._default_manager
+    fields = values.keys()
+
+    # The queryset may span joins (admin filters on sites, etc.), so resolve it to a distinct list of pks first.
+    pk_list = list(set(queryset.values_list('pk', flat = True)))
+    if not pk_list:
+        return 0
+
+    previous = {}
+    instances = []
+    count = 0
+    with transaction.commit_on_success():
+        for chunk in chunked(pk_list):
+            for row in manager.filter(pk__in = chunk).values('pk', *fields):
+                previous[row.pop('pk')] = row
+            count += manager.filter(pk__in = chunk).update(**values)
+            instances.extend(manager.filter(pk__in = chunk))
+        save_revisions(instances, user = user, comment = comment)
+
+    delete_model_cache_many(model, instances)
+    post_bulk_save.send(sender = model, instances = instances, created = False, previous = previous)
+
+    return count
+
+def _allocate_pks(model, count, using):
+    """
+        Reserves primary keys for rows about to be inserted, since bulk_create doesn't hand them back. On Postgres they
+        come from the table's sequence. Elsewhere they follow the highest pk in the table, so a concurrent insert can
+        take one first and fail the batch.
+    """
+    connection = connections[using]
+    opts = model._meta
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)", [opts.db_table, opts.pk.column, count])
+        return [row[0] for row in cursor.fetchall()]
+    highest = model._base_manager.using(using).aggregate(highest = models.Max('pk'))['highest'] or 0
+    return range(highest + 1, highest + 1 + count)
+
+def bulk_import(model, instances, relations = None, user = None, comment = "", using = None):
+    """
+        Creates a batch of objects with bulk_create and fills in their many-to-many relations with one insert per
+        relation, in place of a save() per object and an add() per relation. The whole batch is one transaction, with one
+        Reversion revision. Once it commits, the new objects' cache keys and tags are cleared in a single pass and
+        post_bulk_save is sent once, with created set, so listeners can do the work they would have done in post_save
+        and m2m_changed, which aren't sent.
+
+        The model's save() isn't called. A model whose save() fills in fields, such as GenericContent with its dates,
+        does so in normalize_fields(), which is called on each object instead.
+
+        @type instances: list
+        @param instances: Unsaved model instances of a single class. Those without a pk are given one.
+
+        @type relations: list
+        @param relations: For each instance, a dict of many-to-many field name -> list of related pks, or None.
+
+        @type user: L{User}
+        @param user: The user the revision is attributed to.
+
+        @type comment: string
+        @param comment: The revision comment.
+
+        @rtype: list
+        @return: The created objects, with their pks.
+    """
+    if not instances:
+        return []
+    using = using or model._default_manager.db
+    relations = relations or [None] * len(instances)
+    if hasattr(model, 'normalize_fields'):
+        for instance in instances:
+            instance.normalize_fields()
+
+    missing = [instance for instance in instances if instance.pk is None]
+    explicit_pks = len(missing) < len(instances)
+    with transaction.commit_on_success(using = using):
+        for instance, pk in zip(missing, _allocate_pks(model, len(missing), using)):
+            instance.pk = pk
+        model._base_manager.db_manager(using).bulk_create(instances)
+        if explicit_pks and connections[using].vendor == 'postgresql':
+            # Moves the sequence past the pks given, so later inserts don't reuse them.
+            cursor = connections[using].cursor()
+            for sql in connections[using].ops.sequence_reset_sql(no_style(), [model]):
+                cursor.execute(sql)
+
+        for field in model._meta.many_to_many:
+            through = field.rel.through
+            if not through._meta.auto_created:
+                continue
+            source, target = field.m2m_field_name() + '_id', field.m2m_reverse_field_name() + '_id'
+            rows = []
+            for instance, related in zip(instances, relations):
+                for related_pk in set((related or {}).get(field.name) or ()):
+                    rows.append(through(**{source: instance.pk, target: related_pk}))
+            through._default_manager.db_manager(using).bulk_create(rows, batch_size = BULK_CHUNK_SIZE)
+
+        save_revisions(instances, user = user, comment = comment, type_flag = VERSION_ADD)
+
+    # The new pks and slugs may have been cached as missing, by the API for one.
+    delete_model_cache_many(model, instances)
+    post_bulk_save.send(sender = model, instances = instances, created = True, previous = None)
+
+    return instances
+
+def _delete_dependents(model, pk_list, using):
+    """
+        Clears the rows that refer to a set of objects ahead of deleting them: M2M through rows in both directions with
+        set-based deletes, and reverse foreign keys according to their on_delete behavior.
+    """
+    opts = model._meta
+    for field in opts.local_many_to_many:
+        through = field.rel.through
+        DeleteQuery(through).delete_batch(pk_list, using, field = through._meta.get_field(field.m2m_field_name()))
+
+    for related in opts.get_all_related_many_to_many_objects():
+        through = related.field.rel.through
+        DeleteQuery(through).delete_batch(pk_list, using, field = through._meta.get_field(related.field.m2m_reverse_field_name()))
+
+    for related in opts.get_all_related_objects():
+        field = related.field
+        on_delete = field.rel.on_delete
+        if on_delete == models.DO_NOTHING:
+            continue
+        dependents = related.model._base_manager.using(using).filter(**{'%s__in' % field.name: pk_list})
+        if on_delete == models.SET_NULL:
+            dependents.update(**{field.name: None})
+        elif on_delete == models.CASCADE:
+            dependents.delete()
+        elif dependents.exists():
+            # PROTECT raises ProtectedError here, and SET_DEFAULT and SET() record the value to set on the collector.
+            collector = Collector(using = using)
+            on_delete(collector, field, dependents, using)
+            for (update_field, value), objs in collector.field_updates.get(related.model, {}).items():
+                dependents.update(**{update_field.name: value})
+
+def bulk_delete(queryset):
+    """
+        Deletes every object in a queryset with set-based DELETE queries instead of a delete() per object.
+        The model's delete() is not called and no post_delete signals are sent. Instead, pre_bulk_delete is sent for each
+        chunk before its rows are removed (so listeners can read what they need, such as file paths), the object caches
+        are cleared in a single pass, and post_bulk_delete is sent once at the end. Rows referring to the objects are
+        handled according to their foreign keys' on_delete, as delete() would: a PROTECT foreign key raises
+        ProtectedError and rolls the whole delete back.
+
+        @type queryset: L{QuerySet}
+        @param queryset: The objects to delete.
+
+        @rtype: int
+        @return: The number of objects deleted.
+    """
+    model = queryset.model
+    using = queryset.db
+    manager = model._base_manager.using(using)
+
+    pk_list = list(set(queryset.values_list('pk', flat = True)))
+    if not pk_list:
+        return 0
+
+    # Only the fields needed to build the cache keys are loaded.
+    cache_fields = [model._meta.pk.name]
+    if 'slug' in model._meta.get_all_field_names():
+        cache_fields.append('slug')
+
+    instances = []
+    with transaction.commit_on_success(using = using):
+        for chunk in chunked(pk_list):
+            instances.extend(manager.filter(pk__in = chunk).only(*cache_fields))
+            pre_bulk_delete.send(sender = model, pk_list = chunk)
+            _delete_dependents(model, chunk, using)
+            DeleteQuery(model).delete_batch(chunk, using)
+
+    delete_model_cache_many(model, instances)
+    post_bulk_delete.send(sender = model, instances = instances)
+
+    return len(pk_list)
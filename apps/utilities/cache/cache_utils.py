@@ -1,4 +1,5 @@
 import datetime
+import time
 
 from django.conf import settings
 from django.core.cache import cache
@@ -6,45 +7,258 @@ from django.template.defaultfilters import slugify
 from django.contrib.sites.models import Site
 
 
-def get_model_cache_key(content_class, id = None, site_id = None):
+def get_cache_versions():
+    """
+        Returns the group cache versions whose keys must be invalidated. Normally that is just settings.GROUP_CACHE_VERSION,
+        but while settings.GROUP_CACHE_PREVIOUS_VERSION is set after a version bump, the previous version's keys are read as
+        a fallback, and while settings.GROUP_CACHE_NEXT_VERSION is set ahead of one, the next version's keys are being
+        warmed. Both must be invalidated along with the current ones.
+        
+        @rtype: list
+        @return: The current version, followed by the previous and next ones if they are set.
+    """
+    versions = get_readable_versions()
+    upcoming = getattr(settings, 'GROUP_CACHE_NEXT_VERSION', None)
+    if upcoming is not None and upcoming not in versions:
+        versions.append(upcoming)
+    return versions
+
+def get_readable_versions():
+    """
+        Returns the group cache versions whose keys are read: settings.GROUP_CACHE_VERSION, and
+        settings.GROUP_CACHE_PREVIOUS_VERSION as a fallback if it is set.
+        
+        @rtype: list
+        @return: The current version, followed by the previous one if it is set.
+    """
+    versions = [settings.GROUP_CACHE_VERSION]
+    previous = getattr(settings, 'GROUP_CACHE_PREVIOUS_VERSION', None)
+    if previous is not None and previous != settings.GROUP_CACHE_VERSION:
+        versions.append(previous)
+    return versions
+
+def get_model_cache_key(content_class, id = None, site_id = None, version = None):
     """
         Returns the cache key string for the object corresponding to a content type model and a primary key.
         @type content_class: class
-        @param content_class: A content object class.
+        @param content_class: A content object class. The deferred classes of .only() and .defer() get their model's key.
         
         @type id: int
         @param id: The primary key corresponding to the object.
         
+        @type version: int
+        @param version: The group cache version to build the key for. Defaults to settings.GROUP_CACHE_VERSION.
+        
         @rtype: string
         @return: The cache key for the object.
     """
-    module = slugify(str(content_class))
+    if version is None:
+        version = settings.GROUP_CACHE_VERSION
+    module = slugify(str(content_class._meta.concrete_model))
     if id:
-        key = "%s::%s::%s::%s" % (settings.GROUP_NAME, module, id, settings.GROUP_CACHE_VERSION)
+        key = "%s::%s::%s::%s" % (settings.GROUP_NAME, module, id, version)
     else:
-        key = key = "%s::%s::%s" % (settings.GROUP_NAME, module, settings.GROUP_CACHE_VERSION)
+        key = key = "%s::%s::%s" % (settings.GROUP_NAME, module, version)
     if site_id:
         key = key + "::" + str(site_id)
     return key
     
-def get_model_slug_cache_key(content_class, slug, site_id = None):
+def get_model_slug_cache_key(content_class, slug, site_id = None, version = None):
     """
         Returns the ID-based cache key string for the object corresponding to a content type model and a slug.
         @type content_class: class
-        @param content_class: A content object class.
+        @param content_class: A content object class. The deferred classes of .only() and .defer() get their model's key.
         
         @type slug: string
         @param slug: The slug corresponding to the object.
         
+        @type version: int
+        @param version: The group cache version to build the key for. Defaults to settings.GROUP_CACHE_VERSION.
+        
         @rtype: string
         @return: The cache key for the object.
     """
-    module = slugify(str(content_class))
-    key =  "%s::%s::%s::%s" % (settings.GROUP_NAME, module, slug, settings.GROUP_CACHE_VERSION)
+    if version is None:
+        version = settings.GROUP_CACHE_VERSION
+    module = slugify(str(content_class._meta.concrete_model))
+    key =  "%s::%s::%s::%s" % (settings.GROUP_NAME, module, slug, version)
     if site_id:
         key = key + "::" + str(site_id)
     return key
 
+def get_content_type_cache_key(short_name, version = None):
+    """
+        Returns the cache key holding the model name for a GFContentType short name, as used in content URLs.
+        @type short_name: string
+        @param short_name: The short name of the content type, such as ar.
+        
+        @type version: int
+        @param version: The group cache version to build the key for. Defaults to settings.GROUP_CACHE_VERSION.
+        
+        @rtype: string
+        @return: The cache key for the content type.
+    """
+    if version is None:
+        version = settings.GROUP_CACHE_VERSION
+    return "%s::contenttype::%s::%s" % (settings.GROUP_NAME, str(short_name).lower(), version)
+
+def get_fragment_generation_key(content_class, id, version = None):
+    """
+        Returns the cache key holding an object's fragment generation, which is part of every fragment key for the object.
+        
+        @type content_class: class
+        @param content_class: A content object class.
+        
+        @type id: int
+        @param id: The primary key of the object.
+        
+        @type version: int
+        @param version: The group cache version to build the key for. Defaults to settings.GROUP_CACHE_VERSION.
+        
+        @rtype: string
+        @return: The cache key.
+    """
+    return get_model_cache_key(content_class, id, version = version) + "::fragments"
+
+def get_fragment_cache_key(content_class, id, name, generation, site_id = None, version = None):
+    """
+        Returns the cache key for one rendered fragment of an object's page.
+        
+        @type name: string
+        @param name: The fragment's name, unique within the page, such as comments. The page shell is stored as the shell fragment.
+        
+        @type generation: int
+        @param generation: The object's current fragment generation, from get_fragment_generation.
+        
+        @rtype: string
+        @return: The cache key.
+    """
+    return "%s::fragment::%s::%s" % (get_model_cache_key(content_class, id, site_id, version), name, generation)
+
+def get_fragment_generation(content_class, id):
+    """
+        Returns an object's fragment generation, starting one if there isn't one. New generations are numbered from the
+        current time, so a generation lost from the cache can't bring back fragments from before it.
+        
+        @rtype: int
+        @return: The generation.
+    """
+    key = get_fragment_generation_key(content_class, id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), settings.CACHE_LONG_SECONDS)
+        generation = cache.get(key) or 0
+    return generation
+
+def invalidate_fragments(content_class, id):
+    """
+        Moves an object to a new fragment generation, which orphans its page shell and every cached fragment at once.
+        
+        @rtype: None
+        @return: None
+    """
+    invalidate_fragments_many(content_class, [id])
+
+def invalidate_fragments_many(content_class, ids):
+    """
+        Moves a batch of objects of the same class to new fragment generations.
+        
+        @type ids: list
+        @param ids: The primary keys of the objects.
+        
+        @rtype: None
+        @return: None
+    """
+    for version in get_cache_versions():
+        for id in ids:
+            key = get_fragment_generation_key(content_class, id, version)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, int(time.time() * 1000), settings.CACHE_LONG_SECONDS)
+
+def invalidate_fragment(content_class, id, name):
+    """
+        Deletes one of an object's cached fragments on every site, leaving the shell and the other fragments alone.
+        
+        @type name: string
+        @param name: The fragment's name.
+        
+        @rtype: None
+        @return: None
+    """
+    site_ids = [None] + list(Site.objects.values_list('id', flat = True))
+    keys = []
+    for version in get_cache_versions():
+        generation = cache.get(get_fragment_generation_key(content_class, id, version))
+        if generation is None:
+            continue
+        keys.extend([get_fragment_cache_key(content_class, id, name, generation, site_id, version) for site_id in site_ids])
+    cache.delete_many(keys)
+
+def get_cache_with_fallback(key_function, *args):
+    """
+        Reads a key built by one of the key functions above. On a miss, the key for settings.GROUP_CACHE_PREVIOUS_VERSION
+        is tried, if set, and a hit there is copied forward to the current version.
+        Only use this for values which don't refer to other keys; objects should go through set_model_cache instead.
+        
+        @type key_function: function
+        @param key_function: The key function, which must accept a version keyword argument.
+        
+        @param args: The arguments for the key function.
+        
+        @return: The cached value, or None.
+    """
+    key = key_function(*args)
+    value = cache.get(key)
+    if value is None:
+        for version in get_readable_versions()[1:]:
+            value = cache.get(key_function(*args, version = version))
+            if value is not None:
+                cache.set(key, value, settings.CACHE_LONG_SECONDS)
+                break
+    return value
+
+def get_model_cache_mapping(content_class, instance, site_id = None, version = None):
+    """
+        Returns the cache entries for an object: the object under its id key, and its slug key pointing at the id key.
+        @type content_class: class
+        @param content_class: A content object class.
+        
+        @type instance: Model
+        @param instance: The object to cache.
+        
+        @type site_id: int
+        @param site_id: The site the object is being cached for.
+        
+        @type version: int
+        @param version: The group cache version to build the keys for. Defaults to settings.GROUP_CACHE_VERSION.
+        
+        @rtype: dict
+        @return: The cache keys and values, ready for cache.set_many.
+    """
+    model_key = get_model_cache_key(content_class, instance.id, site_id, version)
+    slug_key = get_model_slug_cache_key(content_class, instance.slug, site_id, version)
+    return {model_key: instance, slug_key: model_key}
+
+def set_model_cache(content_class, instance, site_id = None):
+    """
+        Caches an object under its id key, and points its slug key at the id key.
+        @type content_class: class
+        @param content_class: A content object class.
+        
+        @type instance: Model
+        @param instance: The object to cache.
+        
+        @type site_id: int
+        @param site_id: The site the object is being cached for.
+        
+        @rtype: string
+        @return: The id cache key.
+    """
+    cache.set_many(get_model_cache_mapping(content_class, instance, site_id), settings.CACHE_LONG_SECONDS)
+    return get_model_cache_key(content_class, instance.id, site_id)
+
 def resave_model_cache(sender, instance, created, **kwargs):
     """
         Recreates model cache keys after a save is performed, but doesn't cache if the user is staff or the object isn't public.
@@ -66,11 +280,13 @@ def resave_model_cache(sender, instance, created, **kwargs):
     # To start with, kill the cache.
     try:
         if instance.id:
-            cache.delete(get_model_cache_key(instance.__class__, instance.id))
             if hasattr(instance, "clear_cache"):
                 instance.clear_cache()
+            for version in get_cache_versions():
+                cache.delete(get_model_cache_key(instance.__class__, instance.id, version = version))
             for site in Site.objects.all():
-                cache.delete(get_model_cache_key(instance.__class__, instance.id, site.id))
+                for version in get_cache_versions():
+                    cache.delete(get_model_cache_key(instance.__class__, instance.id, site.id, version))
                 # Kill associated cache keys if applicable.
                 if hasattr(instance, "clear_cache"):
                     instance.clear_cache(site.id)
@@ -81,9 +297,11 @@ def resave_model_cache(sender, instance, created, **kwargs):
         
     try:
         if instance.slug:
-            cache.delete(get_model_slug_cache_key(instance.__class__, instance.slug))
+            for version in get_cache_versions():
+                cache.delete(get_model_slug_cache_key(instance.__class__, instance.slug, version = version))
             for site in Site.objects.all():
-                cache.delete(get_model_slug_cache_key(instance.__class__, instance.slug, site.id))
+                for version in get_cache_versions():
+                    cache.delete(get_model_slug_cache_key(instance.__class__, instance.slug, site.id, version))
     except Exception:
         pass
     
@@ -103,11 +321,13 @@ def delete_model_cache(sender, instance, **kwargs):
 
     """
     try:
-        cache.delete(get_model_cache_key(instance.__class__, instance.id))
         if hasattr(instance, "clear_cache"):
             instance.clear_cache()
+        for version in get_cache_versions():
+            cache.delete(get_model_cache_key(instance.__class__, instance.id, version = version))
         for site in Site.objects.all():
-            cache.delete(get_model_cache_key(instance.__class__, instance.id, site.id))
+            for version in get_cache_versions():
+                cache.delete(get_model_cache_key(instance.__class__, instance.id, site.id, version))
             # Kill associated cache keys if applicable.
             if hasattr(instance, "clear_cache"):
                 instance.clear_cache(site.id)
@@ -115,10 +335,55 @@ def delete_model_cache(sender, instance, **kwargs):
         pass
         
     try:
-        cache.delete(get_model_slug_cache_key(instance.__class__, instance.slug))
+        for version in get_cache_versions():
+            cache.delete(get_model_slug_cache_key(instance.__class__, instance.slug, version = version))
         for site in Site.objects.all():
-            cache.delete(get_model_slug_cache_key(instance.__class__, instance.slug, site.id))
+            for version in get_cache_versions():
+                cache.delete(get_model_slug_cache_key(instance.__class__, instance.slug, site.id, version))
     except Exception:
         pass
 
 
+def delete_model_cache_many(content_class, instances):
+    """
+        Clears the caches for a batch of objects of the same class in a single pass. Every id and slug key, and every
+        key the objects keep alongside them (see GenericContent.get_cache_keys), is removed with one delete_many call,
+        then the objects' fragment generations are moved on and their tags are invalidated together, so listeners such
+        as the baker get a single tags_invalidated for the whole batch.
+        
+        @type content_class: class
+        @param content_class: The class of the objects being cleared. Keys and tags are built from it rather than from
+        the instances, which may be deferred.
+        
+        @type instances: list
+        @param instances: The model instances whose caches should be cleared. Only id and slug are read.
+        
+        @rtype: None
+        @return: None
+    """
+    # The tags module builds its keys with this one.
+    from apps.utilities.cache.tags import get_tag, invalidate_tags
+    
+    if not instances:
+        return
+    
+    site_ids = [None] + list(Site.objects.values_list('id', flat=True))
+    versions = get_cache_versions()
+    keys = []
+    fragment_ids = []
+    for instance in instances:
+        for site_id in site_ids:
+            for version in versions:
+                if instance.id:
+                    keys.append(get_model_cache_key(content_class, instance.id, site_id, version))
+                if getattr(instance, 'slug', None):
+                    keys.append(get_model_slug_cache_key(content_class, instance.slug, site_id, version))
+        # Kill associated cache keys if applicable.
+        if hasattr(instance, "get_cache_keys"):
+            keys.extend(instance.get_cache_keys(site_ids[1:]))
+            fragment_ids.append(instance.id)
+    
+    cache.delete_many(keys)
+    invalidate_fragments_many(content_class, fragment_ids)
+    # Drops the cached pages on every site, and anything else tagged with the objects.
+    invalidate_tags([get_tag(content_class, instance.pk) for instance in instances])
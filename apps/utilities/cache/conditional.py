@@ -0,0 +1,94 @@
+"""
+    Validators for conditional GETs on content pages, worked out from the content object alone so a 304 can be sent
+    before any template is rendered.
+"""
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+from apps.utilities.sites.current import get_site_id
+
+
+def get_content_etag(content_obj, tag_generations = None):
+    """
+        Returns the ETag for a content object's page.
+
+        The ETag covers the object's field values as well as its id and updated_at, since editors don't always move
+        updated_at when they make a change, plus the site, the cache versions and CONTENT_TEMPLATE_VERSION, so bumping
+        any of those also changes every page's ETag. With tag_generations, it also changes when anything else shown
+        on the page, such as a category name, is invalidated.
+
+        Content pages carry no Last-Modified, since nothing dates all of those changes, so clients that only send
+        If-Modified-Since always get the full page.
+
+        @type content_obj: L{GenericContent}
+        @param content_obj: The object, usually straight from the object cache.
+
+        @type tag_generations: dict
+        @param tag_generations: The generations of the page's cache tags, from get_tag_generations.
+
+        @rtype: string
+        @return: The ETag, unquoted.
+    """
+    values = [unicode(getattr(content_obj, field.attname)) for field in content_obj._meta.fields]
+    values += [u"%s=%s" % item for item in sorted((tag_generations or {}).items())]
+    parts = [content_obj._meta.object_name, get_site_id(), settings.GROUP_CACHE_VERSION, settings.CACHE_VERSION, getattr(settings, 'CONTENT_TEMPLATE_VERSION', 1)]
+    return hashlib.md5(u"|".join([unicode(part) for part in parts] + values).encode('utf-8')).hexdigest()
+
+def get_response_etag(response):
+    """
+        @rtype: string or None
+        @return: The unquoted ETag of a response, without the suffix GZipMiddleware adds, or None if it has none.
+    """
+    if not response.has_header('ETag'):
+        return None
+    etags = parse_etags(response['ETag'])
+    return etags and etags[0].replace(';gzip', '') or None
+
+def is_not_modified(request, etag, last_modified = None):
+    """
+        Checks a request's If-None-Match and If-Modified-Since headers against a page's validators. If-None-Match wins
+        when both are sent.
+
+        @rtype: boolean
+        @return: True if the client's copy is current and a 304 can be sent.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = [value.replace(';gzip', '') for value in parse_etags(if_none_match)]
+        return etag in etags or '*' in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since and last_modified is not None:
+        return int(last_modified) <= if_modified_since
+    return False
+
+def set_validators(response, etag, last_modified = None, public = True):
+    """
+        Sets the ETag, Last-Modified and Cache-Control headers on a page response.
+
+        Public pages can be kept by browsers for CONTENT_MAX_AGE seconds and by shared proxies for CONTENT_SHARED_MAX_AGE,
+        and must be revalidated after that. Anything else is marked private and uncacheable, so drafts seen by staff
+        never reach a proxy.
+
+        @rtype: L{HttpResponse}
+        @return: The response.
+    """
+    response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if public:
+        patch_cache_control(response, public = True, max_age = getattr(settings, 'CONTENT_MAX_AGE', 60), s_maxage = getattr(settings, 'CONTENT_SHARED_MAX_AGE', 300), must_revalidate = True)
+    else:
+        patch_cache_control(response, private = True, no_cache = True, max_age = 0)
+    return response
+
+def not_modified(etag, last_modified = None):
+    """
+        @rtype: L{HttpResponseNotModified}
+        @return: A 304 carrying the same validators and Cache-Control a full response would.
+    """
+    return set_validators(HttpResponseNotModified(), etag, last_modified)
@@ -0,0 +1,186 @@
+"""
+    Tag-based invalidation for cached pages and fragments.
+
+    A tagged entry is stored with the generations its tags had when the data behind it was read, such as
+    {'article:12': 1381234567890, 'category:4': 1381234567123}. Each tag's current generation is a counter in the cache,
+    and invalidating a tag just increments it, so every entry stored under an older generation of the tag is
+    treated as a miss when it is next read. An entry can be tagged with the content, categories, authors, sites and
+    images it shows, so a category rename or a change to an article's authors reaches every page they appear on without
+    knowing those pages' keys, and without flushing anything else.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import Signal
+
+from apps.utilities.cache.cache_utils import get_cache_versions
+
+# Sent after tags are invalidated, for anything kept outside the cache that shows the tagged objects, such as baked pages.
+# tags: the tags.
+tags_invalidated = Signal(providing_args=["tags"])
+
+
+def get_tag(model_class, id):
+    """
+        Returns the tag for one object.
+
+        @type model_class: class
+        @param model_class: The object's model. The deferred classes of .only() and .defer() get their model's tag.
+
+        @type id: int
+        @param id: The object's primary key.
+
+        @rtype: string
+        @return: The tag, such as article:12.
+    """
+    return "%s:%s" % (model_class._meta.concrete_model._meta.object_name.lower(), id)
+
+def get_tag_cache_key(tag, version = None):
+    """
+        Returns the cache key holding a tag's current generation.
+
+        @type version: int
+        @param version: The group cache version to build the key for. Defaults to settings.GROUP_CACHE_VERSION.
+
+        @rtype: string
+        @return: The cache key.
+    """
+    if version is None:
+        version = settings.GROUP_CACHE_VERSION
+    return "%s::tag::%s::%s" % (settings.GROUP_NAME, tag, version)
+
+def get_tag_generations(tags, version = None):
+    """
+        Returns the current generation of each tag, starting one for tags that don't have one. New generations are numbered
+        from the current time, so a generation lost from the cache can't match entries stored before it was lost.
+
+        Read the generations before the data being cached, and store the entry with them, so an invalidation that
+        lands while the entry is being built makes it stale instead of being lost.
+
+        @type tags: list
+        @param tags: The tags.
+
+        @type version: int
+        @param version: The group cache version to read the generations for. Defaults to settings.GROUP_CACHE_VERSION.
+
+        @rtype: dict
+        @return: The generation of each tag.
+    """
+    tags = set(tags)
+    if not tags:
+        return {}
+    keys = dict((get_tag_cache_key(tag, version), tag) for tag in tags)
+    found = cache.get_many(keys.keys())
+    generations = {}
+    for key, tag in keys.items():
+        if key not in found:
+            cache.add(key, int(time.time() * 1000), settings.CACHE_LONG_SECONDS)
+            found[key] = cache.get(key) or 0
+        generations[tag] = found[key]
+    return generations
+
+def invalidate_tags(tags):
+    """
+        Moves tags to new generations, which makes every entry tagged with them stale, then sends tags_invalidated.
+
+        @type tags: list
+        @param tags: The tags.
+
+        @rtype: None
+        @return: None
+    """
+    tags = set(tags)
+    for tag in tags:
+        for version in get_cache_versions():
+            key = get_tag_cache_key(tag, version)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, int(time.time() * 1000), settings.CACHE_LONG_SECONDS)
+    if tags:
+        tags_invalidated.send(sender = None, tags = list(tags))
+
+def make_tagged(value, generations):
+    """
+        Returns the entry set_tagged stores for a value, for callers filling several keys with one set_many.
+
+        @type generations: dict
+        @param generations: The tags' generations from get_tag_generations, read before the value was built.
+
+        @rtype: tuple
+        @return: The entry.
+    """
+    return (value, generations)
+
+def set_tagged(key, value, generations, timeout = None):
+    """
+        Caches a value along with the tag generations it was built under.
+
+        @type generations: dict
+        @param generations: The tags' generations from get_tag_generations, read before the value was built.
+
+        @type timeout: int
+        @param timeout: Defaults to settings.CACHE_LONG_SECONDS.
+
+        @rtype: None
+        @return: None
+    """
+    cache.set(key, make_tagged(value, generations), timeout or settings.CACHE_LONG_SECONDS)
+
+def get_many_tagged(keys):
+    """
+        Reads tagged entries, with one get_many for the entries and one for all of their tags' generations. Entries
+        whose tags have moved on are left out, as if they had expired.
+
+        @type keys: list
+        @param keys: The cache keys.
+
+        @rtype: dict
+        @return: The current values, by key.
+    """
+    # Anything not stored by set_tagged, such as a value cached before its key was tagged, counts as a miss.
+    found = dict((key, entry) for key, entry in cache.get_many(keys).items() if isinstance(entry, tuple) and len(entry) == 2)
+    tags = set()
+    for entry in found.values():
+        tags.update(entry[1])
+    current = tags and cache.get_many([get_tag_cache_key(tag) for tag in tags]) or {}
+
+    values = {}
+    for key, (value, generations) in found.items():
+        if all(current.get(get_tag_cache_key(tag)) == generation for tag, generation in generations.items()):
+            values[key] = value
+    return values
+
+def get_tagged(key):
+    """
+        Reads a tagged entry.
+
+        @rtype: object or None
+        @return: The value, or None if it's missing or any of its tags has been invalidated since it was stored.
+    """
+    return get_many_tagged([key]).get(key)
+
+
+def invalidate_object_tag(sender, instance, **kwargs):
+    """
+        post_save and post_delete handler. Invalidates everything tagged with the object, for models such as categories,
+        authors and sites which show up on other objects' pages.
+    """
+    invalidate_tags([get_tag(instance.__class__, instance.pk)])
+
+def invalidate_m2m_tags(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+        m2m_changed handler for relations shown on content pages, such as categories and authors. Invalidates the
+        content whose relations changed. A clear from the other side, such as category.article_set.clear(), doesn't say
+        which content it removed, so it invalidates the related object instead, whose tag every such page carries.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        tags = [get_tag(instance.__class__, instance.pk)]
+    elif pk_set:
+        tags = [get_tag(model, pk) for pk in pk_set]
+    else:
+        tags = [get_tag(instance.__class__, instance.pk)]
+    invalidate_tags(tags)
@@ -0,0 +1,16 @@
+from apps.utilities.deferred import queue
+
+
+class DeferredWorkMiddleware(object):
+    """
+        Runs the work saves deferred during a request once the response is ready. See L{apps.utilities.deferred.queue}.
+
+        Put it before TransactionMiddleware in MIDDLEWARE_CLASSES, so the work runs after the request's transaction
+        has been committed, or rolled back, and reads what the database holds.
+    """
+    def process_request(self, request):
+        queue.start()
+
+    def process_response(self, request, response):
+        queue.flush()
+        return response
@@ -0,0 +1,89 @@
+"""
+    Work that saves set off, run once per object after the request that made them.
+
+    An admin save sends post_save for the object, then m2m_changed for each relation the form saves after it, so a
+    handler that rebuilds something from the object's saved state, such as its baked page or its text index document,
+    would run several times, and the first runs would miss the relations. Such handlers defer() the work instead: it is
+    queued by primary key, and DeferredWorkMiddleware runs it once for all the objects queued, after the transaction
+    has been committed. Outside a request, such as in a management command, the work runs straight away, unless it is
+    queued inside a batch() block.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.utils.datastructures import SortedDict
+
+logger = logging.getLogger('griffoncms.deferred')
+
+_local = threading.local()
+
+
+def defer(callback, model, pks, last = False):
+    """
+        Queues callback(model, pks) to run once at the end of the request, along with the pks queued for it by other
+        calls. Runs it straight away if nothing is queueing.
+
+        @type callback: function
+        @param callback: Called with the model and a list of primary keys. It should read the objects from the database,
+            and cope with any that have been deleted since.
+
+        @type pks: list
+        @param pks: The primary keys of the objects to do the work for.
+
+        @type last: boolean
+        @param last: Run the work after the work queued without it, for work that reads what other deferred work
+            stores, such as pages showing related content.
+    """
+    queue = getattr(_local, 'queue', None)
+    if queue is None:
+        callback(model, list(pks))
+        return
+    queue.setdefault((callback, model), set()).update(pks)
+    if last:
+        _local.last.add(callback)
+
+def start():
+    """
+        Starts queueing deferred work for this thread. Work left queued by a request that didn't finish is run first.
+    """
+    flush()
+    _local.queue = SortedDict()
+    _local.last = set()
+
+def flush():
+    """
+        Runs the work queued for this thread, in the order it was first queued with the work deferred with last after
+        the rest, and stops queueing. Work the callbacks defer joins the queue, along with any of its kind still
+        waiting, so a callback that sets off other work, such as related lists rebaking the pages showing them,
+        doesn't run that work twice. Failures are logged rather than raised, so one callback can't stop the rest or
+        fail the response.
+    """
+    queue = getattr(_local, 'queue', None)
+    try:
+        while queue:
+            key = ([key for key in queue if key[0] not in _local.last] or queue.keys())[0]
+            callback, model = key
+            pks = sorted(queue.pop(key))
+            try:
+                callback(model, pks)
+            except Exception:
+                logger.exception("Deferred %s for %s %s failed." % (callback.__name__, model._meta.object_name, pks))
+    finally:
+        _local.queue = None
+
+@contextmanager
+def batch():
+    """
+        Queues the work deferred in a with block, and runs it at the end of the block, for scripts and commands that
+        save objects one by one. Inside a request, or another batch, the work runs with theirs.
+    """
+    if getattr(_local, 'queue', None) is not None:
+        yield
+        return
+    _local.queue = SortedDict()
+    _local.last = set()
+    try:
+        yield
+    finally:
+        flush()
@@ -0,0 +1,286 @@
+"""
+    Streaming JSONL exports of the registered models, for backups, migrations and analytics extracts.
+
+    Each registered model is exported as a stream of its rows and one more stream for each of its many-to-many fields,
+    holding the (object id, related id) pairs, named <model> and <model>.<field>. A stream is written in pk order, one
+    JSON object per line, to <stream>-<partition>.jsonl files in the output directory. Rows are read with values_list()
+    SQL and never become model instances.
+
+    On PostgreSQL each window of up to window_size rows is read through a named, server-side cursor, batch_size rows
+    per fetch, so memory use doesn't grow with the table. Other databases read each batch as its own keyset query.
+    Either way every window is a separate short transaction, so the export never holds locks or a snapshot for long,
+    though it isn't a point in time copy either: each row is as it stood when its window was read.
+
+    A stream can be split into partitions by pk range and the partitions written by several processes. Each file has a
+    resume token beside it, <file>.state, holding the last pk written and the file's length at that point, rewritten
+    after every batch. Running the export again with resume picks every unfinished file up from its token, cutting off
+    anything written after it, so an interrupted export carries on without writing any row twice.
+"""
+import json
+import os
+import tempfile
+import uuid
+from collections import OrderedDict
+from datetime import datetime, date, time
+from decimal import Decimal
+from multiprocessing import Pool
+
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+# The models exported, in the order they were registered.
+registered_models = []
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class ExportError(Exception):
+    pass
+
+
+class Stream(object):
+    """
+        The rows of one table, read through a model.
+
+        @type name: string
+        @cvar name: The stream's name, used for its file names.
+
+        @type model: Model
+        @cvar model: The model, or the through model of a many-to-many field.
+
+        @type fields: tuple
+        @cvar fields: The field names read with values_list(), the pk first.
+
+        @type keys: tuple
+        @cvar keys: The keys the fields are written under, their column names.
+    """
+    def __init__(self, name, model, fields, keys):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.keys = keys
+
+    def get_queryset(self):
+        return self.model._base_manager.order_by('pk')
+
+    def get_range(self):
+        """
+            @rtype: tuple
+            @return: (the lowest pk, one past the highest pk), or (0, 0) for an empty table.
+        """
+        totals = self.get_queryset().aggregate(low = Min('pk'), high = Max('pk'))
+        if totals['low'] is None:
+            return 0, 0
+        return totals['low'], totals['high'] + 1
+
+def get_streams():
+    """
+        @rtype: list
+        @return: The L{Stream}s of every registered model, in registration order.
+    """
+    streams = []
+    for model in registered_models:
+        name = model._meta.object_name.lower()
+        fields = [model._meta.pk] + [field for field in model._meta.fields if field != model._meta.pk]
+        streams.append(Stream(name, model, tuple([field.name for field in fields]), tuple([field.column for field in fields])))
+        for field in model._meta.many_to_many:
+            through = field.rel.through
+            if not through._meta.auto_created:
+                # Through models with their own fields are exported by registering them.
+                continue
+            streams.append(Stream("%s.%s" % (name, field.name), through, ('id', field.m2m_field_name(), field.m2m_reverse_field_name()), ('id', field.m2m_column_name(), field.m2m_reverse_name())))
+    return streams
+
+def get_stream(name):
+    for stream in get_streams():
+        if stream.name == name:
+            return stream
+    raise ExportError("No such stream: %s" % name)
+
+def to_json(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(repr(value))
+
+def iter_batches(stream, after, end, batch_size = 5000, window_size = 100000):
+    """
+        Reads a stream's rows in pk order.
+
+        @type after: int
+        @param after: Read the rows after this pk.
+
+        @type end: int
+        @param end: Read the rows before this pk.
+
+        @rtype: generator
+        @return: Generator yielding lists of up to batch_size values_list() tuples.
+    """
+    server_side = connection.vendor == 'postgresql'
+    if not server_side:
+        window_size = batch_size
+    while True:
+        queryset = stream.get_queryset().filter(pk__gt = after, pk__lt = end).values_list(*stream.fields)[:window_size]
+        read = 0
+        if server_side:
+            sql, params = queryset.query.sql_with_params()
+            # Django has no API for named cursors, so the window is run through one on the psycopg2 connection.
+            connection.cursor()
+            cursor = connection.connection.cursor(name = "export_%s" % uuid.uuid4().hex)
+            try:
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    read += len(rows)
+                    after = rows[-1][0]
+                    yield rows
+            finally:
+                cursor.close()
+                # Ends the window's transaction.
+                transaction.rollback_unless_managed()
+        else:
+            rows = list(queryset)
+            if rows:
+                read = len(rows)
+                after = rows[-1][0]
+                yield rows
+        if read < window_size:
+            return
+
+def read_state(path):
+    """
+        @rtype: dict
+        @return: The resume token of a partition's file: {'last': the last pk written, 'offset': the file's length
+        after it, 'rows': rows written, 'done': whether the partition is finished}.
+    """
+    try:
+        with open(path + '.state') as state_file:
+            return json.load(state_file)
+    except (IOError, ValueError):
+        return None
+
+def write_state(path, state):
+    fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = '.export-')
+    with os.fdopen(fd, 'w') as temp_file:
+        json.dump(state, temp_file)
+    os.rename(temp_path, path + '.state')
+
+def export_partition(output_dir, stream_name, partition, batch_size = 5000, window_size = 100000):
+    """
+        Writes one partition of a stream, or finishes it from its resume token.
+
+        @type partition: dict
+        @param partition: The partition's manifest entry: {'file', 'start', 'end'}.
+
+        @rtype: int
+        @return: The rows written this time.
+    """
+    stream = get_stream(stream_name)
+    path = os.path.join(output_dir, partition['file'])
+    state = read_state(path) or {'last': partition['start'] - 1, 'offset': 0, 'rows': 0, 'done': False}
+    if state['done']:
+        return 0
+
+    written = 0
+    with open(path, 'ab') as data_file:
+        # Cuts off anything written after the token.
+        data_file.truncate(state['offset'])
+        for rows in iter_batches(stream, state['last'], partition['end'], batch_size, window_size):
+            data_file.write(''.join([json.dumps(OrderedDict(zip(stream.keys, row)), default = to_json, separators = (',', ':')) + '\n' for row in rows]))
+            data_file.flush()
+            os.fsync(data_file.fileno())
+            written += len(rows)
+            state.update(last = rows[-1][0], offset = data_file.tell(), rows = state['rows'] + len(rows))
+            write_state(path, state)
+    state['done'] = True
+    write_state(path, state)
+    return written
+
+def plan(streams, partitions = 1):
+    """
+        Splits each stream's pk range into partitions of equal width.
+
+        @rtype: dict
+        @return: The manifest: {'created': when, 'streams': [{'name', 'partitions': [{'file', 'start', 'end'}]}]}.
+    """
+    manifest = {'created': datetime.now().isoformat(), 'streams': []}
+    for stream in streams:
+        low, high = stream.get_range()
+        count = max(min(partitions, high - low), 1)
+        width = -(-(high - low) // count)
+        manifest['streams'].append({'name': stream.name, 'partitions': [
+            {'file': "%s-%03d.jsonl" % (stream.name, i), 'start': low + i * width, 'end': min(low + (i + 1) * width, high)}
+            for i in xrange(count)
+        ]})
+    return manifest
+
+def init_worker():
+    # Forked workers must not share the parent's DB connection.
+    connection.close()
+
+def run_partition(args):
+    output_dir, stream_name, partition, batch_size, window_size = args
+    return stream_name, export_partition(output_dir, stream_name, partition, batch_size, window_size)
+
+def export(output_dir, stream_names = None, partitions = 1, resume = False, batch_size = 5000, window_size = 100000):
+    """
+        Exports the registered models to a directory, or finishes an interrupted export there.
+
+        @type stream_names: list
+        @param stream_names: The streams to export, or None for all of them. Ignored when resuming.
+
+        @type partitions: int
+        @param partitions: The partitions each stream is split into, which is also the number of processes writing them.
+        A resumed export keeps the partitions it started with.
+
+        @type resume: boolean
+        @param resume: Finish the export already in output_dir rather than starting a new one.
+
+        @rtype: dict
+        @return: The rows written this time, by stream.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if resume:
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (IOError, ValueError):
+            raise ExportError("%s doesn't hold an export to resume." % output_dir)
+        partitions = max([len(entry['partitions']) for entry in manifest['streams']] or [1])
+    else:
+        if os.path.exists(manifest_path):
+            raise ExportError("%s already holds an export. Resume it, or export to another directory." % output_dir)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        streams = stream_names and [get_stream(name) for name in stream_names] or get_streams()
+        manifest = plan(streams, partitions)
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent = 1)
+
+    jobs = [(output_dir, entry['name'], partition, batch_size, window_size) for entry in manifest['streams'] for partition in entry['partitions']]
+    written = dict([(entry['name'], 0) for entry in manifest['streams']])
+    if partitions > 1:
+        # Close the connection before forking, so each worker opens its own.
+        connection.close()
+        pool = Pool(partitions, initializer = init_worker)
+        try:
+            for stream_name, rows in pool.imap_unordered(run_partition, jobs):
+                written[stream_name] += rows
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            stream_name, rows = run_partition(job)
+            written[stream_name] += rows
+    return written
+
+def register(model):
+    """
+        Adds a model to the export, along with its many-to-many relations.
+    """
+    if model not in registered_models:
+        registered_models.append(model)
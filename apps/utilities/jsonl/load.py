@@ -0,0 +1,121 @@
+"""
+    Bulk loading of new objects from JSONL or CSV, such as wire stories, through bulk_import.
+
+    Each JSONL line, or CSV row under a header row, is one object. Keys are field names, or column names such as
+    primary_site_id, so a model's stream from the JSONL export loads as it is. Values are converted with the fields'
+    to_python(), so dates can be given as 2013-02-01T09:30:00, and empty CSV cells leave nullable fields null. Many-to-
+    many fields take lists of related pks: JSON lists, or comma or space separated pks in a CSV cell. Fields left out
+    take their defaults. An id keeps its pk, otherwise one is allocated.
+
+    Objects are created batch_size at a time, each batch a single transaction, so a bad row stops the load with the
+    batches before it in place.
+"""
+import csv
+import json
+import re
+
+from django.core.exceptions import ValidationError
+
+from apps.utilities.bulk.bulk_utils import bulk_import
+
+
+class LoadError(Exception):
+    pass
+
+
+def read_jsonl(lines):
+    """
+        @rtype: generator
+        @return: Generator yielding (line number, record dict), skipping blank lines.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError, e:
+            raise LoadError("Line %d: %s" % (number, e))
+        if not isinstance(record, dict):
+            raise LoadError("Line %d: not a JSON object." % number)
+        yield number, record
+
+def read_csv(lines):
+    """
+        @rtype: generator
+        @return: Generator yielding (line number, record dict), read under the header row.
+    """
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, dict([(key, value.decode('utf-8')) for key, value in record.items() if key is not None and value is not None])
+
+def get_fields(model):
+    """
+        @rtype: tuple
+        @return: (the concrete fields by name and column, the auto-created many-to-many fields by name)
+    """
+    fields = {}
+    for field in model._meta.fields:
+        fields[field.name] = field
+        fields[field.column] = field
+    m2m_fields = dict([(field.name, field) for field in model._meta.many_to_many if field.rel.through._meta.auto_created])
+    return fields, m2m_fields
+
+def parse_pks(field, value):
+    if isinstance(value, basestring):
+        value = [item for item in re.split(r'[\s,]+', value) if item]
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return [field.rel.to._meta.pk.to_python(item) for item in value]
+
+def build(model, record, fields, m2m_fields):
+    """
+        Makes an unsaved instance from a record.
+
+        @rtype: tuple
+        @return: (the instance, its many-to-many relations as field name -> list of related pks)
+    """
+    values = {}
+    relations = {}
+    for key, value in record.items():
+        if key in m2m_fields:
+            relations[key] = parse_pks(m2m_fields[key], value)
+            continue
+        field = fields.get(key)
+        if field is None:
+            raise ValidationError("%s has no field %s." % (model._meta.object_name, key))
+        if value == '' and field.null:
+            value = None
+        values[field.attname] = field.to_python(value)
+    return model(**values), relations
+
+def load(model, records, batch_size = 500, user = None, comment = ""):
+    """
+        Creates objects from records with bulk_import, batch_size at a time.
+
+        @type records: iterable
+        @param records: (line number, record dict) pairs, from read_jsonl or read_csv.
+
+        @type user: L{User}
+        @param user: The user the revisions are attributed to.
+
+        @rtype: int
+        @return: The number of objects created.
+    """
+    fields, m2m_fields = get_fields(model)
+    count = 0
+    instances = []
+    relations = []
+    for number, record in records:
+        try:
+            instance, related = build(model, record, fields, m2m_fields)
+        except ValidationError, e:
+            raise LoadError("Line %d: %s" % (number, '; '.join(e.messages)))
+        instances.append(instance)
+        relations.append(related)
+        if len(instances) >= batch_size:
+            count += len(bulk_import(model, instances, relations, user = user, comment = comment))
+            instances = []
+            relations = []
+    if instances:
+        count += len(bulk_import(model, instances, relations, user = user, comment = comment))
+    return count
@@ -2,7 +2,8 @@ from django.db import models
 from django.core.cache import cache
 from django.conf import settings
 
-from apps.utilities.cache.cache_utils import get_model_slug_cache_key, get_model_cache_key
+from apps.utilities.cache.cache_utils import get_model_slug_cache_key, get_model_cache_key, get_readable_versions, set_model_cache
+from apps.utilities.sites.current import get_site_id
 
 class GenericContentCacheManager(models.Manager):
     """
@@ -15,19 +16,36 @@ class GenericContentCacheManager(models.Manager):
         @param cache_key: accepts object cache key
 
         @return: content object from cache or None.  Will need to test response and do db api call if necessary
+        
+        If settings.GROUP_CACHE_PREVIOUS_VERSION is set, a miss on the id or slug falls back to the previous version's keys,
+        and a hit there is cached again under the current version.
     """
     def get(self, id = None, slug = None, cache_key = None):
         if cache_key:
             return cache.get(cache_key)
         elif slug:
-            slug_cache_key = get_model_slug_cache_key(self.model, slug, settings.SITE_ID)
-            id_cache_key = cache.get(slug_cache_key)
-            return cache.get(id_cache_key)
             # lookup and return
+            for version in get_readable_versions():
+                slug_cache_key = get_model_slug_cache_key(self.model, slug, get_site_id(), version)
+                id_cache_key = cache.get(slug_cache_key)
+                content_obj = id_cache_key and cache.get(id_cache_key)
+                if content_obj:
+                    return self._carry_forward(content_obj, version)
+            return None
         elif id:
             # lookup and return
-            cache_key = get_model_cache_key(self.model, id, settings.SITE_ID)
-            return cache.get(cache_key)
+            for version in get_readable_versions():
+                cache_key = get_model_cache_key(self.model, id, get_site_id(), version)
+                content_obj = cache.get(cache_key)
+                if content_obj:
+                    return self._carry_forward(content_obj, version)
+            return None
         else:
             return None
 
+    def _carry_forward(self, content_obj, version):
+        """ Copies an object found under the previous cache version to the current one. """
+        if version != settings.GROUP_CACHE_VERSION:
+            set_model_cache(self.model, content_obj, get_site_id())
+        return content_obj
+
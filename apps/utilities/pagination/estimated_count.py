@@ -0,0 +1,153 @@
+import re
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, InvalidPage
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.db import connections
+
+from apps.utilities.cache.cache_utils import get_model_cache_key
+
+EXPLAIN_ROWS_RE = re.compile(r'rows=(\d+)')
+
+
+def get_count_cache_key(queryset):
+    """
+        Returns the cache key for the row count of a queryset. The key is built from the model's cache key and a hash
+        of the query's SQL, so every filter combination gets its own count.
+
+        @type queryset: L{QuerySet}
+        @param queryset: The queryset being counted.
+
+        @rtype: string
+        @return: The cache key for the count.
+    """
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    digest = md5(repr((sql, tuple(params)))).hexdigest()
+    return "%s::count::%s" % (get_model_cache_key(queryset.model), digest)
+
+def get_planner_estimate(queryset):
+    """
+        Asks Postgres for an estimate of the number of rows in a queryset, without counting them.
+        Unfiltered querysets use the table's reltuples from pg_class; filtered ones use the row estimate of the top EXPLAIN node.
+
+        @type queryset: L{QuerySet}
+        @param queryset: The queryset being counted.
+
+        @rtype: int or None
+        @return: The estimated row count, or None if the database isn't Postgres or no estimate is available.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    cursor = connection.cursor()
+    try:
+        if not queryset.query.where:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            # reltuples is 0 or -1 for tables that have never been analyzed.
+            if row and row[0] > 0:
+                return int(row[0])
+            return None
+
+        sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+        cursor.execute("EXPLAIN " + sql, params)
+        match = EXPLAIN_ROWS_RE.search(cursor.fetchone()[0])
+        if match:
+            return int(match.group(1))
+    except Exception:
+        pass
+    return None
+
+def estimate_count(queryset):
+    """
+        Returns the row count of a queryset, using the planner's estimate when it is at or above
+        settings.ADMIN_COUNT_ESTIMATE_THRESHOLD, and an exact COUNT(*) otherwise. Either way, the result is cached per
+        filter combination for settings.ADMIN_COUNT_CACHE_SECONDS.
+
+        @type queryset: L{QuerySet}
+        @param queryset: The queryset being counted.
+
+        @rtype: tuple
+        @return: The count, and True if it is an estimate.
+    """
+    cache_key = get_count_cache_key(queryset)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    estimate = get_planner_estimate(queryset)
+    if estimate is not None and estimate >= settings.ADMIN_COUNT_ESTIMATE_THRESHOLD:
+        result = (estimate, True)
+    else:
+        result = (queryset.count(), False)
+
+    cache.set(cache_key, result, settings.ADMIN_COUNT_CACHE_SECONDS)
+    return result
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+        Paginator which gets its count from estimate_count instead of running COUNT(*) on every page.
+
+        @type count_is_estimate: boolean
+        @cvar count_is_estimate: True if the count came from the query planner rather than an exact count.
+    """
+    count_is_estimate = False
+
+    def _get_count(self):
+        # Lists and other non-querysets are counted the usual way.
+        if not hasattr(self.object_list, 'query'):
+            return super(EstimatedCountPaginator, self)._get_count()
+        if self._count is None:
+            self._count, self.count_is_estimate = estimate_count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+
+class EstimatedCountChangeList(ChangeList):
+    """
+        ChangeList which uses estimate_count for the unfiltered total as well as for the filtered result count.
+    """
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.query_set, self.list_per_page)
+        # Get the number of objects, with admin filters applied.
+        result_count = paginator.count
+
+        # Get the total number of objects, with no admin filters applied. If no filters were given it's the same number.
+        if not self.query_set.query.where:
+            full_result_count = result_count
+        else:
+            full_result_count = estimate_count(self.root_query_set)[0]
+
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+
+        # Get the list of objects to display on this page.
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num+1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
+class EstimatedCountAdminMixin(object):
+    """
+        ModelAdmin mixin which switches the changelist over to estimated counts. List it ahead of the ModelAdmin base class.
+    """
+    paginator = EstimatedCountPaginator
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
@@ -0,0 +1,31 @@
+from django.conf import settings
+
+from apps.utilities.replicas import router
+
+
+class ReplicaMiddleware(object):
+    """
+        Lets public requests read from the replicas: GET and HEAD requests outside settings.REPLICA_PRIMARY_PATHS, from
+        visitors who aren't staff and haven't written in the last settings.REPLICA_PIN_SECONDS. A request that writes
+        sets the cookie that keeps its visitor on the primary for that long.
+
+        Put it after AuthenticationMiddleware. See L{apps.utilities.replicas.router}.
+    """
+    def process_request(self, request):
+        router.reset()
+        if not settings.DATABASE_REPLICAS:
+            return
+        if request.method not in ('GET', 'HEAD') or settings.REPLICA_PIN_COOKIE in request.COOKIES:
+            return
+        if request.path.startswith(tuple(settings.REPLICA_PRIMARY_PATHS)):
+            return
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return
+        router.allow_replicas()
+
+    def process_response(self, request, response):
+        if settings.DATABASE_REPLICAS and router.has_written():
+            response.set_cookie(settings.REPLICA_PIN_COOKIE, '1', max_age = settings.REPLICA_PIN_SECONDS, httponly = True)
+        router.reset()
+        return response
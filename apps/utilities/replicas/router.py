@@ -0,0 +1,158 @@
+"""
+    Read replicas of the default database.
+
+    With settings.DATABASE_REPLICAS listing the DATABASES aliases of replicas of the default database, the primary,
+    ReplicaRouter sends the reads of public requests to one of them, picked at random for each request. Everything else
+    stays on the primary:
+
+        - writes, and every read after the request's first write or get_or_create(), so the request sees what it
+          wrote.
+        - reads outside the requests ReplicaMiddleware allows on replicas, such as staff and admin requests, POSTs, and
+          management commands and other background jobs, unless they run inside replica_reads().
+        - reads of settings.REPLICA_PRIMARY_APPS, such as sessions and auth, which must see a login at once.
+        - reads of an app any process wrote to in the last settings.REPLICA_LAG_SECONDS. A write invalidates cached
+          pages and objects, and the next request refills them; this keeps it from refilling them from a replica that
+          hasn't caught up with the write.
+
+    A request that writes sets a cookie keeping the visitor's requests on the primary for settings.REPLICA_PIN_SECONDS,
+    so an editor sees their save straight away on the next page, whatever the replicas' lag.
+
+    Replicas get their tables by replication, not syncdb. For tests, give each replica 'TEST_MIRROR': 'default' in
+    DATABASES, or point two local SQLite databases at copies of the same file.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+_local = threading.local()
+# When this process last marked each app as written, so a run of writes costs one cache set a second.
+_marked = {}
+_connected = []
+
+
+def allow_replicas():
+    """
+        Lets this thread's reads go to a replica, picked at random, until reset().
+    """
+    _local.replica = settings.DATABASE_REPLICAS and random.choice(settings.DATABASE_REPLICAS) or None
+    _local.on_primary = False
+    _local.wrote = False
+    _local.written_apps = {}
+
+def reset():
+    """
+        Sends this thread's reads back to the primary, and forgets its writes.
+    """
+    _local.replica = None
+    _local.on_primary = False
+    _local.wrote = False
+    _local.written_apps = {}
+
+def has_written():
+    """
+        @rtype: boolean
+        @return: Whether this thread has saved or deleted anything since allow_replicas() or reset(), other than in
+        settings.REPLICA_PRIMARY_APPS.
+    """
+    return getattr(_local, 'wrote', False)
+
+@contextmanager
+def replica_reads():
+    """
+        Lets the reads in a with block go to a replica, for background jobs such as exports that can read slightly stale
+        data.
+    """
+    previous = (getattr(_local, 'replica', None), getattr(_local, 'on_primary', False), has_written(), getattr(_local, 'written_apps', {}))
+    allow_replicas()
+    try:
+        yield
+    finally:
+        _local.replica, _local.on_primary, _local.wrote, _local.written_apps = previous
+
+def get_written_key(app_label):
+    return "%s::replica::written::%s" % (settings.GROUP_NAME, app_label)
+
+def mark_written(app_label):
+    """
+        Keeps the app's reads on the primary, in every process, for settings.REPLICA_LAG_SECONDS.
+    """
+    if app_label in settings.REPLICA_PRIMARY_APPS:
+        return
+    _local.wrote = True
+    now = time.time()
+    if now - _marked.get(app_label, 0) >= 1:
+        _marked[app_label] = now
+        # A second longer than the lag, to cover the writes made in the second after the mark.
+        cache.set(get_written_key(app_label), now, settings.REPLICA_LAG_SECONDS + 1)
+
+def recently_written(app_label):
+    """
+        @rtype: boolean
+        @return: Whether any process wrote to the app in the last settings.REPLICA_LAG_SECONDS. Read from the cache
+        once per app per request.
+    """
+    written_apps = getattr(_local, 'written_apps', None)
+    if written_apps is None:
+        written_apps = _local.written_apps = {}
+    if app_label not in written_apps:
+        written_apps[app_label] = cache.get(get_written_key(app_label)) is not None
+    return written_apps[app_label]
+
+def mark_on_save(sender, **kwargs):
+    """
+        post_save, post_delete, m2m_changed, post_bulk_save and pre_bulk_delete handler.
+    """
+    mark_written(sender._meta.app_label)
+
+def connect_signals():
+    """
+        Connects mark_on_save on first use: Django loads the routers before the models, so this module can't import
+        the signals when it loads. Writes are marked from the signals rather than db_for_write(), which also picks the
+        database for reads that must be consistent, such as get_or_create().
+    """
+    if _connected:
+        return
+    _connected.append(True)
+    from django.db.models.signals import post_save, post_delete, m2m_changed
+    from apps.utilities.bulk.bulk_utils import post_bulk_save, pre_bulk_delete
+    for signal in (post_save, post_delete, m2m_changed, post_bulk_save, pre_bulk_delete):
+        signal.connect(mark_on_save, dispatch_uid = 'replicas.mark_on_save')
+
+
+class ReplicaRouter(object):
+    """
+        Routes reads to the replicas when the thread allows it and the primary otherwise, and all writes to the
+        primary. Does nothing without settings.DATABASE_REPLICAS.
+    """
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS:
+            return None
+        connect_signals()
+        replica = getattr(_local, 'replica', None)
+        if replica is None or getattr(_local, 'on_primary', False) or has_written():
+            return DEFAULT_DB_ALIAS
+        app_label = model._meta.app_label
+        if app_label in settings.REPLICA_PRIMARY_APPS or recently_written(app_label):
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        if not settings.DATABASE_REPLICAS:
+            return None
+        connect_signals()
+        _local.on_primary = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary.
+        return True
+
+    def allow_syncdb(self, db, model):
+        if not settings.DATABASE_REPLICAS:
+            return None
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,102 @@
+"""
+    The site being served.
+
+    Everything that works per site, such as the published manager, the object and page cache keys and ETags, reads the
+    site from get_site_id() rather than settings.SITE_ID. Outside a request, and in a deployment with a settings module
+    per site, that is settings.SITE_ID as before. With SiteMiddleware, it is the site whose domain matches the request's
+    Host header, so one pool of processes can serve every site, each under its own cache keys.
+
+    Code that works on one site outside a request, such as a management command, can set it with the site() context
+    manager.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_save, post_delete
+
+_local = threading.local()
+# The sites by domain and by id, read from the Site table at most every settings.SITE_HOSTS_SECONDS.
+_hosts = {'domains': None, 'ids': None, 'loaded_at': 0}
+_lock = threading.Lock()
+
+
+def get_site_id():
+    """
+        @rtype: int
+        @return: The current site's id, or settings.SITE_ID if none is set.
+    """
+    return getattr(_local, 'site_id', None) or settings.SITE_ID
+
+def set_site_id(site_id):
+    """
+        Makes a site current for this thread, until clear() or another set_site_id().
+    """
+    _local.site_id = site_id
+
+def clear():
+    _local.site_id = None
+
+@contextmanager
+def site(site_id):
+    """
+        Makes a site current for the duration of a with block, restoring the one before it afterwards.
+    """
+    previous = getattr(_local, 'site_id', None)
+    _local.site_id = site_id
+    try:
+        yield
+    finally:
+        _local.site_id = previous
+
+def _load_hosts():
+    with _lock:
+        if _hosts['domains'] is not None and time.time() - _hosts['loaded_at'] < settings.SITE_HOSTS_SECONDS:
+            return _hosts
+        domains = {}
+        ids = {}
+        for site_id, domain in Site.objects.values_list('id', 'domain'):
+            domain = domain.lower()
+            ids[site_id] = domain
+            domains[domain] = site_id
+            # A domain stored with a port also matches without it.
+            domains.setdefault(domain.split(':')[0], site_id)
+        _hosts.update(domains = domains, ids = ids, loaded_at = time.time())
+        return _hosts
+
+def reset_hosts(**kwargs):
+    """
+        Site post_save and post_delete handler. Rereads the domains on the next lookup in this process. Other
+        processes pick the change up within settings.SITE_HOSTS_SECONDS.
+    """
+    _hosts['domains'] = None
+
+def resolve_host(host):
+    """
+        @type host: string
+        @param host: A Host header, with or without a port.
+
+        @rtype: int or None
+        @return: The id of the site with that domain, or None if no site has it.
+    """
+    host = host.lower()
+    domains = _load_hosts()['domains']
+    return domains.get(host) or domains.get(host.split(':')[0])
+
+def get_domain(site_id = None):
+    """
+        @type site_id: int
+        @param site_id: The site, or None for the current site.
+
+        @rtype: string
+        @return: settings.SITE_DOMAIN for settings.SITE_ID, as before, and the Site's domain for any other site.
+    """
+    site_id = site_id or get_site_id()
+    if site_id == settings.SITE_ID:
+        return settings.SITE_DOMAIN
+    return _load_hosts()['ids'].get(site_id) or settings.SITE_DOMAIN
+
+post_save.connect(reset_hosts, sender = Site)
+post_delete.connect(reset_hosts, sender = Site)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.http import Http404
+
+from apps.utilities.sites import current
+
+
+class SiteMiddleware(object):
+    """
+        Serves each request as the site whose domain matches its Host header, so one settings module and one pool of
+        processes can serve every site. The site is made current for the request, where get_site_id() and the code
+        reading it find it, and set as request.site_id.
+
+        Hosts no site claims are served as settings.SITE_ID, or get a 404 with SITE_UNKNOWN_HOST_404 on.
+        Put it near the top of MIDDLEWARE_CLASSES, ahead of anything that reads the cache or the database.
+    """
+    def process_request(self, request):
+        site_id = current.resolve_host(request.get_host())
+        if site_id is None:
+            if settings.SITE_UNKNOWN_HOST_404:
+                current.clear()
+                raise Http404("No site is served at this host.")
+            site_id = settings.SITE_ID
+        current.set_site_id(site_id)
+        request.site_id = site_id
+
+    def process_response(self, request, response):
+        current.clear()
+        return response
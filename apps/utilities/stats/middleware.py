@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.util import CursorWrapper
+from django.http import HttpResponse
+from django.template.defaultfilters import slugify
+
+from apps.utilities.stats import request_stats
+from apps.utilities.stats.profiler import SamplingProfiler, TracingProfiler
+from apps.utilities.stats.query_inspector import QueryRecorder
+
+logger = logging.getLogger('griffoncms.stats')
+query_logger = logging.getLogger('griffoncms.queries')
+
+
+class CountingCursorWrapper(CursorWrapper):
+    """
+        Cursor that counts its connection's queries and adds up their time, without keeping their SQL. It wraps
+        whatever cursor the connection would have made, so the debug cursor and query recorders still see every query.
+    """
+    def execute(self, sql, params = ()):
+        self.set_dirty()
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.db._stats_counts[0] += 1
+            self.db._stats_counts[1] += time.time() - start
+
+    def executemany(self, sql, param_list):
+        self.set_dirty()
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.db._stats_counts[0] += 1
+            self.db._stats_counts[1] += time.time() - start
+
+def count_queries(connection):
+    """
+        Starts counting a connection's queries in connection._stats_counts, as [queries, seconds], for the life of the
+        connection object.
+    """
+    if '_stats_counts' in connection.__dict__:
+        return
+    connection._stats_counts = [0, 0.0]
+    make_cursor = connection.cursor
+    connection.cursor = lambda: CountingCursorWrapper(make_cursor(), connection)
+
+
+class RequestStatsMiddleware(object):
+    """
+        Collects per-request timings, layer outcomes and DB query counts and times, folds them into the process
+        histograms served by the stats view, and writes one structured log line per request to the griffoncms.stats logger.
+
+        Queries are counted and timed by CountingCursorWrapper, which doesn't keep their SQL; QueryInspectorMiddleware
+        records that. Set REQUEST_STATS_QUERIES to False to skip the counting, and REQUEST_STATS_LOG
+        to False to skip the log line.
+        Put it first in MIDDLEWARE_CLASSES so the timings cover the rest of the stack.
+    """
+    def process_request(self, request):
+        request._stats = request_stats.start()
+        request._stats_view = None
+        request._stats_queries = {}
+        if getattr(settings, 'REQUEST_STATS_QUERIES', True):
+            for connection in connections.all():
+                count_queries(connection)
+                request._stats_queries[connection.alias] = tuple(connection._stats_counts)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._stats_view = "%s.%s" % (view_func.__module__, getattr(view_func, '__name__', view_func.__class__.__name__))
+
+    def process_response(self, request, response):
+        stats = request_stats.stop()
+        if stats is None or getattr(request, '_stats', None) is not stats:
+            return response
+        total = stats.elapsed()
+
+        db_queries = 0
+        db_time = 0.0
+        for connection in connections.all():
+            if connection.alias not in request._stats_queries:
+                continue
+            start_queries, start_seconds = request._stats_queries[connection.alias]
+            db_queries += connection._stats_counts[0] - start_queries
+            db_time += (connection._stats_counts[1] - start_seconds) * 1000
+
+        view_name = request._stats_view or 'unresolved'
+        request_stats.aggregate(view_name, stats, total, db_queries, db_time)
+
+        if getattr(settings, 'REQUEST_STATS_LOG', True):
+            logger.info(json.dumps({
+                'view': view_name,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total, 2),
+                'db_queries': db_queries,
+                'db_ms': round(db_time, 2),
+                'layers': dict((layer, round(elapsed, 2)) for layer, elapsed in stats.timings.items()),
+                'outcomes': stats.outcomes,
+            }, sort_keys = True))
+        return response
+
+
+class QueryInspectorMiddleware(object):
+    """
+        Opt-in check for N+1 and duplicate queries. Records every query in the request, and when a query shape runs
+        QUERY_INSPECTOR_THRESHOLD or more times from the same line, or the same query repeats, logs a report to the
+        griffoncms.queries logger. With DEBUG on, the count and any problems are also sent back in X-Query-Count
+        and X-Query-Problems headers.
+
+        Recording costs a stack walk per query, so add it to MIDDLEWARE_CLASSES in development or for a short while in production.
+    """
+    def process_request(self, request):
+        request._query_recorder = QueryRecorder().__enter__()
+
+    def process_response(self, request, response):
+        recorder = getattr(request, '_query_recorder', None)
+        if recorder is None:
+            return response
+        recorder.__exit__(None, None, None)
+        del request._query_recorder
+
+        threshold = getattr(settings, 'QUERY_INSPECTOR_THRESHOLD', 5)
+        problems = len(recorder.repeated(threshold)) + len(recorder.duplicates())
+        if problems:
+            query_logger.warning("%s %s\n%s" % (request.method, request.path, recorder.report(threshold)))
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(len(recorder))
+            response['X-Query-Problems'] = str(problems)
+        return response
+
+
+class ProfilerMiddleware(object):
+    """
+        Lets staff profile any page, including the admin, by adding ?profile to its URL. ?profile uses the sampling
+        profiler, which barely slows the request; ?profile=cprofile traces every call instead.
+
+        The profile is saved under PROFILE_ROOT and named in the X-Profile header. Add &profile_show to get the
+        profile back in place of the page.
+
+        Put it last in MIDDLEWARE_CLASSES, after the authentication middleware, since it runs the view itself.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not request.GET.has_key('profile') or not getattr(request, 'user', None) or not request.user.is_staff:
+            return None
+
+        if request.GET.get('profile') == 'cprofile':
+            profiler = TracingProfiler()
+        else:
+            profiler = SamplingProfiler(getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005))
+        show = request.GET.has_key('profile_show')
+
+        # Hide the switches from the view. The admin changelist treats unknown parameters as bad filters.
+        request.GET = request.GET.copy()
+        for key in ('profile', 'profile_show'):
+            if key in request.GET:
+                del request.GET[key]
+
+        profiler.start()
+        try:
+            response = view_func(request, *view_args, **view_kwargs)
+            # Admin views return TemplateResponses, which aren't rendered until after the view returns.
+            if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+                response.render()
+        finally:
+            profiler.stop()
+
+        name = "%s-%s-%s" % (datetime.now().strftime('%Y%m%d-%H%M%S-%f'), slugify(request.path)[:80] or 'root', profiler.__class__.__name__.lower())
+        paths = []
+        try:
+            if not os.path.isdir(settings.PROFILE_ROOT):
+                os.makedirs(settings.PROFILE_ROOT)
+            paths = profiler.save(os.path.join(settings.PROFILE_ROOT, name))
+        except (OSError, IOError), e:
+            logger.warning("Couldn't save profile %s: %s" % (name, e))
+
+        if show:
+            response = HttpResponse(profiler.output(), content_type = 'text/plain')
+        if paths:
+            response['X-Profile'] = ', '.join([os.path.basename(path) for path in paths])
+        return response
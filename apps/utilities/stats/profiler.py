@@ -0,0 +1,186 @@
+"""
+    Profilers for a single request.
+
+    The sampling profiler runs a thread that looks at the request thread's stack every few milliseconds, which costs the
+    request very little, and counts each distinct stack. The counts are written in the collapsed format read by
+    flamegraph.pl and speedscope. The cProfile profiler traces every call instead, which is exact but slows the request.
+
+    Both attribute time to the layers we care about, ORM, cache, PIL and templates, by the files of the frames sampled
+    or the functions traced.
+"""
+import cProfile
+import os
+import pstats
+import sys
+import thread
+import threading
+import time
+from collections import defaultdict
+from StringIO import StringIO
+
+# Maps path fragments to the layer time spent in those files is attributed to. Earlier entries win.
+LAYERS = (
+    (os.sep + os.path.join('django', 'db') + os.sep, 'orm'),
+    (os.sep + os.path.join('django', 'core', 'cache') + os.sep, 'cache'),
+    (os.sep + 'memcache', 'cache'),
+    (os.sep + os.path.join('utilities', 'cache') + os.sep, 'cache'),
+    (os.sep + os.path.join('utilities', 'managers') + os.sep, 'cache'),
+    (os.sep + 'PIL' + os.sep, 'pil'),
+    (os.sep + os.path.join('django', 'template') + os.sep, 'template'),
+    (os.sep + 'templatetags' + os.sep, 'template'),
+)
+
+
+def get_layer(filename):
+    """
+        @rtype: string or None
+        @return: The layer a file belongs to, or None if it isn't one of them.
+    """
+    for fragment, layer in LAYERS:
+        if fragment in filename:
+            return layer
+    return None
+
+def describe_frame(code, line):
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), line)
+
+
+class SamplingProfiler(object):
+    """
+        Samples one thread's stack at a fixed interval until stopped.
+
+        @type stacks: dict
+        @cvar stacks: Maps collapsed stacks, root first and separated by semicolons, to the number of samples.
+
+        @type layers: dict
+        @cvar layers: Maps layers to sample counts. A sample goes to the innermost frame that belongs to a layer, or to python.
+    """
+    def __init__(self, interval = 0.005, thread_id = None):
+        self.interval = interval
+        self.thread_id = thread_id or thread.get_ident()
+        self.stacks = defaultdict(int)
+        self.layers = defaultdict(int)
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self.started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target = self._run, name = 'request-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.elapsed = time.time() - self.started
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+        names = []
+        layer = None
+        while frame is not None:
+            code = frame.f_code
+            names.append(describe_frame(code, frame.f_lineno))
+            if layer is None:
+                layer = get_layer(code.co_filename)
+            frame = frame.f_back
+        names.reverse()
+        self.stacks[';'.join(names)] += 1
+        self.layers[layer or 'python'] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """
+            @rtype: string
+            @return: The samples in collapsed stack format, one "stack count" line per distinct stack.
+        """
+        return ''.join(["%s %d\n" % (stack, count) for stack, count in sorted(self.stacks.items())])
+
+    def hot_frames(self, limit = 20):
+        """
+            @rtype: list
+            @return: (samples, frame) tuples for the frames most often on top of the stack.
+        """
+        counts = defaultdict(int)
+        for stack, count in self.stacks.items():
+            counts[stack.rsplit(';', 1)[-1]] += count
+        return sorted([(count, name) for name, count in counts.items()], reverse = True)[:limit]
+
+    def summary(self):
+        lines = ["%d samples over %.1fms, every %.1fms" % (self.samples, self.elapsed * 1000, self.interval * 1000), "", "By layer:"]
+        for layer, count in sorted(self.layers.items(), key = lambda item: -item[1]):
+            lines.append("  %-8s %5.1f%%  %d" % (layer, count * 100.0 / (self.samples or 1), count))
+        lines += ["", "Hot frames:"]
+        for count, name in self.hot_frames():
+            lines.append("  %5.1f%%  %s" % (count * 100.0 / (self.samples or 1), name))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        """
+            Writes the collapsed stacks to path + '.collapsed' and the summary to path + '.txt'.
+
+            @rtype: list
+            @return: The paths written.
+        """
+        open(path + '.collapsed', 'w').write(self.collapsed())
+        open(path + '.txt', 'w').write(self.summary())
+        return [path + '.collapsed', path + '.txt']
+
+    def output(self):
+        """ The summary and collapsed stacks, for returning in place of the page. """
+        return self.summary() + '\n' + self.collapsed()
+
+
+class TracingProfiler(object):
+    """
+        Runs cProfile over the request. Time is attributed to layers by each function's own time, by its file.
+    """
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.elapsed = 0.0
+
+    def start(self):
+        self.started = time.time()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.elapsed = time.time() - self.started
+
+    def layers(self):
+        layers = defaultdict(float)
+        for (filename, line, function), (calls, primitive, own_time, total_time, callers) in pstats.Stats(self.profile).stats.items():
+            layers[get_layer(filename) or 'python'] += own_time
+        return layers
+
+    def summary(self):
+        layers = self.layers()
+        total = sum(layers.values()) or 1
+        lines = ["cProfile over %.1fms" % (self.elapsed * 1000), "", "By layer:"]
+        for layer, own_time in sorted(layers.items(), key = lambda item: -item[1]):
+            lines.append("  %-8s %5.1f%%  %.1fms" % (layer, own_time * 100 / total, own_time * 1000))
+        stream = StringIO()
+        pstats.Stats(self.profile, stream = stream).sort_stats('cumulative').print_stats(40)
+        return '\n'.join(lines) + '\n\n' + stream.getvalue()
+
+    def save(self, path):
+        """
+            Writes the pstats dump to path + '.prof', for snakeviz or gprof2dot, and the summary to path + '.txt'.
+
+            @rtype: list
+            @return: The paths written.
+        """
+        self.profile.dump_stats(path + '.prof')
+        open(path + '.txt', 'w').write(self.summary())
+        return [path + '.prof', path + '.txt']
+
+    def output(self):
+        return self.summary()
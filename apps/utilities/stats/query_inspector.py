@@ -0,0 +1,167 @@
+"""
+    Records the queries run inside a block of code and finds repeated ones.
+
+    Each query is fingerprinted by the shape of its SQL, with literals and IN lists normalized away, and by the line of
+    project code that ran it. Many queries with the same fingerprint in one request is the N+1 pattern, such as a
+    related lookup per changelist row; the same SQL with the same parameters run twice is a duplicate.
+"""
+import os
+import re
+import traceback
+from collections import defaultdict
+from time import time
+
+import django
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.util import CursorDebugWrapper
+
+# Frames from files under these directories are skipped when finding the line of code that ran a query.
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+IGNORED_PATHS = (os.path.dirname(os.path.abspath(django.__file__)), os.path.dirname(os.path.abspath(__file__)))
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*(?:%s|\?|NULL)\s*,?)+\)", re.IGNORECASE)
+SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """
+        Reduces SQL to its shape, so the same query with different parameters gets the same fingerprint.
+
+        @type sql: string
+        @param sql: The SQL before parameters were interpolated.
+
+        @rtype: string
+        @return: The normalized SQL.
+    """
+    sql = STRING_RE.sub('%s', sql)
+    sql = NUMBER_RE.sub('%s', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+def get_call_site():
+    """
+        Returns the innermost line on the current stack outside Django, installed packages and this module,
+        which is usually the project code that ran the query.
+
+        @rtype: string
+        @return: "path:line in function", with the path relative to the project where it's inside it, or "unknown".
+    """
+    for filename, line, function, text in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(filename)
+        if filename.startswith(IGNORED_PATHS) or 'site-packages' in filename:
+            continue
+        if filename.startswith(PROJECT_ROOT):
+            filename = os.path.relpath(filename, PROJECT_ROOT)
+        return "%s:%d in %s" % (filename, line, function)
+    return 'unknown'
+
+
+class RecordingCursorWrapper(CursorDebugWrapper):
+    """
+        Debug cursor that also hands each query to the recorders active on its connection.
+    """
+    def execute(self, sql, params = ()):
+        start = time()
+        try:
+            return super(RecordingCursorWrapper, self).execute(sql, params)
+        finally:
+            self.db._query_recorders[-1].add(sql, params, time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time()
+        try:
+            return super(RecordingCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            self.db._query_recorders[-1].add(sql, None, time() - start)
+
+
+class QueryRecorder(object):
+    """
+        Context manager that records the queries run on a connection while it is active. Recorders can be nested.
+
+        @type queries: list
+        @cvar queries: One dict per query, with sql, params, fingerprint, call_site and time keys.
+    """
+    def __init__(self, using = DEFAULT_DB_ALIAS):
+        self.using = using
+        self.queries = []
+
+    def __enter__(self):
+        connection = connections[self.using]
+        if not hasattr(connection, '_query_recorders'):
+            connection._query_recorders = []
+        if not connection._query_recorders:
+            self._previous = (connection.use_debug_cursor, connection.__dict__.get('make_debug_cursor'))
+            connection.use_debug_cursor = True
+            connection.make_debug_cursor = lambda cursor: RecordingCursorWrapper(cursor, connection)
+        connection._query_recorders.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        connection = connections[self.using]
+        connection._query_recorders.remove(self)
+        if connection._query_recorders:
+            # Queries from a nested recorder count toward the enclosing one too.
+            connection._query_recorders[-1].queries.extend(self.queries)
+        else:
+            connection.use_debug_cursor, make_debug_cursor = self._previous
+            if make_debug_cursor is None:
+                del connection.make_debug_cursor
+            else:
+                connection.make_debug_cursor = make_debug_cursor
+
+    def add(self, sql, params, duration):
+        self.queries.append({
+            'sql': sql,
+            'params': params,
+            'fingerprint': normalize_sql(sql),
+            'call_site': get_call_site(),
+            'time': duration,
+        })
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold = 5):
+        """
+            Finds the N+1 patterns: query shapes run at least threshold times from the same line.
+
+            @rtype: list
+            @return: (count, total seconds, fingerprint, call site) tuples, most frequent first.
+        """
+        groups = defaultdict(lambda: [0, 0.0])
+        for query in self.queries:
+            group = groups[(query['fingerprint'], query['call_site'])]
+            group[0] += 1
+            group[1] += query['time']
+        found = [(count, elapsed, fingerprint, call_site) for (fingerprint, call_site), (count, elapsed) in groups.items() if count >= threshold]
+        return sorted(found, reverse = True)
+
+    def duplicates(self):
+        """
+            Finds the queries run more than once with the same parameters, whose results could have been reused.
+
+            @rtype: list
+            @return: (count, sql, call sites) tuples, most frequent first.
+        """
+        groups = defaultdict(list)
+        for query in self.queries:
+            if query['params'] is not None:
+                groups[(query['sql'], repr(query['params']))].append(query['call_site'])
+        found = [(len(sites), sql, sorted(set(sites))) for (sql, params), sites in groups.items() if len(sites) > 1]
+        return sorted(found, reverse = True)
+
+    def report(self, threshold = 5):
+        """
+            Describes the queries and any problems found, for logs and assertion messages.
+
+            @rtype: string
+        """
+        lines = ["%d queries, %.1fms" % (len(self.queries), sum(query['time'] for query in self.queries) * 1000)]
+        for count, elapsed, fingerprint, call_site in self.repeated(threshold):
+            lines.append("  N+1: %dx (%.1fms) from %s: %s" % (count, elapsed * 1000, call_site, fingerprint))
+        for count, sql, call_sites in self.duplicates():
+            lines.append("  duplicate: %dx from %s: %s" % (count, ', '.join(call_sites), sql))
+        return '\n'.join(lines)
@@ -0,0 +1,171 @@
+"""
+    Per-request timings and cache outcomes, aggregated into per-process histograms.
+
+    Views mark their layers with timer() and record(). Both are no-ops unless RequestStatsMiddleware has started
+    collecting for the current request, so instrumented code can run anywhere.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in milliseconds for timings and plain numbers for counts.
+TIME_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_local = threading.local()
+_lock = threading.Lock()
+_histograms = {}
+_outcomes = {}
+
+
+class Histogram(object):
+    """
+        Fixed-bucket histogram. Keeping only the bucket counts makes recording cheap and the memory use constant.
+
+        @type buckets: tuple
+        @cvar buckets: The upper bound of each bucket. Anything larger goes into a final overflow bucket.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """
+            Returns the upper bound of the bucket the given fraction of values falls under, or the max for the overflow bucket.
+        """
+        if not self.total:
+            return 0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= self.total * fraction:
+                if i < len(self.buckets):
+                    return self.buckets[i]
+                return self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.total,
+            'mean': self.total and round(self.sum / self.total, 3) or 0,
+            'max': round(self.max, 3),
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['inf'], self.counts)),
+        }
+
+
+class RequestStats(object):
+    """
+        The timings and outcomes collected for one request.
+
+        @type timings: dict
+        @cvar timings: Maps layer names to milliseconds spent in them.
+
+        @type outcomes: dict
+        @cvar outcomes: Maps layer names to their outcome, such as hit or miss.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.timings = {}
+        self.outcomes = {}
+
+    def elapsed(self):
+        """ Returns the milliseconds since the request started. """
+        return (time.time() - self.started) * 1000
+
+
+def start():
+    """ Starts collecting stats for the current thread's request. """
+    _local.stats = RequestStats()
+    return _local.stats
+
+def stop():
+    """ Stops collecting and returns what was collected, or None if nothing was being collected. """
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
+
+def record(layer, outcome):
+    """
+        Records the outcome of a layer, such as a cache hit or miss, for the current request.
+
+        @type layer: string
+        @param layer: The layer name, such as content_display.object_cache.
+
+        @type outcome: string
+        @param outcome: The outcome, such as hit, miss or bypass.
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.outcomes[layer] = outcome
+
+@contextmanager
+def timer(layer):
+    """
+        Times the enclosed block as a layer of the current request. Repeated blocks with the same name add up.
+
+        @type layer: string
+        @param layer: The layer name, such as content_display.render.
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        yield
+        return
+    started = time.time()
+    try:
+        yield
+    finally:
+        stats.timings[layer] = stats.timings.get(layer, 0) + (time.time() - started) * 1000
+
+def add_to_histogram(name, value, buckets = TIME_BUCKETS):
+    """ Adds a value to one of the process histograms, creating it if needed. """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram(buckets)
+        histogram.add(value)
+
+def aggregate(view_name, stats, total, db_queries, db_time):
+    """
+        Folds a finished request into the process histograms and outcome counters.
+    """
+    add_to_histogram('request:%s' % view_name, total)
+    add_to_histogram('db_time:%s' % view_name, db_time)
+    add_to_histogram('db_queries:%s' % view_name, db_queries, COUNT_BUCKETS)
+    for layer, elapsed in stats.timings.items():
+        add_to_histogram(layer, elapsed)
+    with _lock:
+        for layer, outcome in stats.outcomes.items():
+            key = '%s:%s' % (layer, outcome)
+            _outcomes[key] = _outcomes.get(key, 0) + 1
+
+def snapshot():
+    """
+        Returns the process histograms and outcome counters.
+
+        @rtype: dict
+        @return: {'histograms': {name: summary}, 'outcomes': {layer:outcome: count}}
+    """
+    with _lock:
+        return {
+            'histograms': dict((name, histogram.as_dict()) for name, histogram in _histograms.items()),
+            'outcomes': dict(_outcomes),
+        }
+
+def reset():
+    """ Clears the process histograms and outcome counters. """
+    with _lock:
+        _histograms.clear()
+        _outcomes.clear()
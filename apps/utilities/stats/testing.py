@@ -0,0 +1,49 @@
+"""
+    Assertions for tests that keep query counts from creeping up.
+
+        with assert_max_queries(4):
+            self.client.get(article.get_absolute_url())
+
+        with assert_no_repeated_queries(threshold = 3):
+            self.client.get('/admin/content/article/')
+
+    Both raise AssertionError with a report of the queries, so a regression fails the test and says where it came from.
+"""
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS
+
+from apps.utilities.stats.query_inspector import QueryRecorder
+
+
+@contextmanager
+def assert_max_queries(count, using = DEFAULT_DB_ALIAS):
+    """
+        Fails if the enclosed block runs more than count queries.
+
+        @type count: int
+        @param count: The most queries allowed.
+
+        @type using: string
+        @param using: The database alias to watch.
+    """
+    with QueryRecorder(using) as recorder:
+        yield recorder
+    if len(recorder) > count:
+        raise AssertionError("Expected at most %d queries, got %s" % (count, recorder.report()))
+
+@contextmanager
+def assert_no_repeated_queries(threshold = 5, using = DEFAULT_DB_ALIAS):
+    """
+        Fails if the enclosed block runs any query shape threshold or more times from the same line, the N+1 pattern.
+
+        @type threshold: int
+        @param threshold: How many runs of one query shape from one line are allowed, less one.
+
+        @type using: string
+        @param using: The database alias to watch.
+    """
+    with QueryRecorder(using) as recorder:
+        yield recorder
+    if recorder.repeated(threshold):
+        raise AssertionError("Repeated queries found: %s" % recorder.report(threshold))
@@ -0,0 +1,26 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, Http404
+
+from apps.utilities.stats import request_stats
+
+
+def stats_view(request):
+    """
+        Returns this process' request histograms and layer outcome counts as JSON.
+        Only available to INTERNAL_IPS and staff. Add ?reset to clear the counters after reading them.
+        
+        @param request: Django HttpRequest object.
+        @type request: L{HttpRequest}
+        
+        @rtype: L{HttpResponse}
+        @return: JSON response of the stats snapshot.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and not request.user.is_staff:
+        raise Http404
+    
+    data = request_stats.snapshot()
+    if request.GET.has_key('reset'):
+        request_stats.reset()
+    return HttpResponse(json.dumps(data, sort_keys = True, indent = 2), content_type = 'application/json')
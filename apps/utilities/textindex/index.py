@@ -0,0 +1,899 @@
+"""
+    A small on-disk inverted index with BM25 ranking, for full-text search without a database extension.
+
+    The index is a directory of immutable segments listed by manifest.json. Each segment holds a batch of documents
+    sorted by primary key, and its postings as two flat arrays, document numbers and term frequencies, which are
+    memory-mapped and sliced per term, so a query only reads the postings of its own terms. Filters such as site:1 or
+    status:2 are stored as terms with a frequency of 0, which match but don't score.
+
+    Each term's postings are also split into blocks of BLOCK_SIZE, with the last document number of each block stored
+    alongside and what bounds the score of any document in it: the largest frequency, the shortest document, and the
+    best score at the segment's average document length, which can be scaled to any other average. A search visits
+    the blocks with the best bounds first and stops once no remaining block can beat the results it has, so a word in
+    most documents doesn't mean scoring most documents.
+
+    Adding documents writes a new segment and tombstones any older copies of them; deleting only tombstones. Searches
+    read every segment and skip tombstoned documents, so once there are more than max_segments, merge() rewrites the
+    small ones into one segment without the dead documents. Writers take an flock on the directory, so web processes, the merge
+    and the rebuild command can share an index.
+"""
+import array
+import bisect
+import errno
+import fcntl
+import heapq
+import json
+import marshal
+import math
+import mmap
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from itertools import izip
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+TAG_RE = re.compile(r'<[^>]+>')
+STOPWORDS = frozenset(u"a an and are as at be but by for from has have in is it its of on or that the this to was were will with".split())
+
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+
+# Array type codes. Document numbers and lengths are unsigned ints, frequencies are capped to fit unsigned shorts.
+DOC_TYPE = 'I'
+TF_TYPE = 'H'
+MAX_TF = 65535
+
+# Postings per block, for the score bounds searches skip blocks by.
+BLOCK_SIZE = 128
+# A search driven by a query term is reckoned to visit its documents until this many times the results asked for
+# have passed the filters.
+VISIT_RATIO = 50
+# A filter is intersected with the documents left rather than probed for each when it is at most this many times
+# longer: a set operation costs a few dozen times less per document than a lookup.
+INTERSECT_RATIO = 32
+# Slack for rounding when comparing a block's bound with a score, since the two are summed in different orders.
+BOUND_SLACK = 1e-9
+
+
+def tokenize(text):
+    """
+        Splits text into index terms: lowercased words with HTML tags and stopwords dropped, and plural s stripped.
+
+        @type text: unicode
+        @param text: The text.
+
+        @rtype: list
+        @return: The terms, in order.
+    """
+    terms = []
+    for word in TOKEN_RE.findall(TAG_RE.sub(u' ', text or u'').lower()):
+        if word in STOPWORDS or len(word) > 40:
+            continue
+        if len(word) > 3 and word.endswith(u's') and not word.endswith(u'ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+def analyze(fields):
+    """
+        Counts the terms of a document's fields, each weighted by repeating its terms, so a word in a title weighted 3
+        counts as three occurrences.
+
+        @type fields: list
+        @param fields: (text, weight) tuples.
+
+        @rtype: tuple
+        @return: (frequency of each term, document length)
+    """
+    frequencies = {}
+    length = 0
+    for text, weight in fields:
+        for term in tokenize(text):
+            frequencies[term] = frequencies.get(term, 0) + weight
+            length += weight
+    return frequencies, length
+
+
+class Document(object):
+    """
+        A document to add to the index.
+
+        @type pk: int
+        @cvar pk: The primary key of the object indexed.
+
+        @type frequencies: dict
+        @cvar frequencies: Maps terms to their weighted frequencies, from analyze.
+
+        @type length: int
+        @cvar length: The weighted number of terms.
+
+        @type filters: list
+        @cvar filters: Terms for filtering on, such as site:1, which don't count towards the score.
+
+        @type publish_at: int
+        @cvar publish_at: Epoch seconds before which the document is hidden from searches with a time.
+
+        @type expires_at: int
+        @cvar expires_at: Epoch seconds after which the document is hidden from searches with a time, or 0 for never.
+    """
+    def __init__(self, pk, frequencies, length, filters = (), publish_at = 0, expires_at = 0):
+        self.pk = pk
+        self.frequencies = frequencies
+        self.length = length
+        self.filters = filters
+        self.publish_at = publish_at
+        self.expires_at = expires_at
+
+
+def load_array(typecode, path):
+    values = array.array(typecode)
+    with open(path, 'rb') as f:
+        values.fromstring(f.read())
+    return values
+
+def write_array(path, values):
+    with open(path, 'wb') as f:
+        values.tofile(f)
+
+def write_atomic(path, data):
+    """ Writes a file through a temporary file and a rename, so readers never see half of it. """
+    fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = '.tmp-')
+    with os.fdopen(fd, 'wb') as temp_file:
+        temp_file.write(data)
+    os.rename(temp_path, path)
+
+
+def write_segment(directory, name, documents):
+    """
+        Writes documents to a new segment. Later documents win when the same primary key appears twice.
+
+        @rtype: dict
+        @return: The segment's manifest entry.
+    """
+    by_pk = {}
+    for document in documents:
+        by_pk[document.pk] = document
+    documents = [by_pk[pk] for pk in sorted(by_pk)]
+
+    pks, lengths, publish, expires = array.array('i'), array.array(DOC_TYPE), array.array('i'), array.array('i')
+    postings = {}
+    for docno, document in enumerate(documents):
+        pks.append(document.pk)
+        lengths.append(document.length)
+        publish.append(document.publish_at)
+        expires.append(document.expires_at)
+        for term, frequency in document.frequencies.iteritems():
+            postings.setdefault(term, []).append((docno, min(frequency, MAX_TF)))
+        for term in document.filters:
+            postings.setdefault(term, []).append((docno, 0))
+
+    docs, tfs = array.array(DOC_TYPE), array.array(TF_TYPE)
+    terms = {}
+    for term in sorted(postings):
+        entries = postings[term]
+        terms[term] = (len(docs), len(entries))
+        docs.extend([docno for docno, frequency in entries])
+        tfs.extend([frequency for docno, frequency in entries])
+    return write_segment_files(directory, name, pks, lengths, publish, expires, terms, docs, tfs)
+
+def get_average_length(lengths):
+    return float(sum(lengths)) / (len(lengths) or 1)
+
+def get_impact(tf, length, average_length):
+    """ A term's BM25 score in a document, before its weight. """
+    return tf / (tf + K1 * (1 - B + B * length / average_length))
+
+def get_blocks(docs, tfs, lengths, start, count, average_length):
+    """
+        Works out the block bounds of one term's postings.
+
+        @type average_length: float
+        @param average_length: The segment's average document length.
+
+        @rtype: tuple
+        @return: (last document number, largest frequency, shortest document length, best impact) arrays, one entry
+            per block.
+    """
+    last_docs, max_tfs, min_lengths, max_impacts = array.array(DOC_TYPE), array.array(TF_TYPE), array.array(DOC_TYPE), array.array('d')
+    for block_start in xrange(start, start + count, BLOCK_SIZE):
+        block_end = min(block_start + BLOCK_SIZE, start + count)
+        block_docs = docs[block_start:block_end]
+        block_tfs = tfs[block_start:block_end]
+        last_docs.append(block_docs[-1])
+        max_tfs.append(max(block_tfs))
+        min_lengths.append(min([lengths[docno] for docno in block_docs]))
+        max_impacts.append(max([get_impact(tf, lengths[docno], average_length) for docno, tf in izip(block_docs, block_tfs)]))
+    return last_docs, max_tfs, min_lengths, max_impacts
+
+def get_range_bounds(driver_last_docs, postings, term_bounds):
+    """
+        Spreads a term's block bounds over another list's blocks.
+
+        @type driver_last_docs: array
+        @param driver_last_docs: The last document number of each of the other list's blocks.
+
+        @rtype: list
+        @return: The most the term can add to a document in each of the other list's blocks: the best bound of the
+            term's blocks overlapping it, or None past the term's last document.
+    """
+    last_docs = postings.last_docs
+    found = []
+    low = 0
+    for high in driver_last_docs:
+        first = bisect.bisect_left(last_docs, low)
+        if first == len(last_docs):
+            found.extend([None] * (len(driver_last_docs) - len(found)))
+            break
+        last = min(bisect.bisect_left(last_docs, high), len(last_docs) - 1)
+        found.append(max(term_bounds[first:last + 1]))
+        low = high + 1
+    return found
+
+def write_segment_files(directory, name, pks, lengths, publish, expires, terms, docs, tfs):
+    """
+        Writes a segment's arrays, term dictionary and block bounds. Each term's entry gains the number of its first block.
+
+        @rtype: dict
+        @return: The segment's manifest entry.
+    """
+    base = os.path.join(directory, name)
+    average_length = get_average_length(lengths)
+    block_last, block_tfs, block_lengths, block_impacts = array.array(DOC_TYPE), array.array(TF_TYPE), array.array(DOC_TYPE), array.array('d')
+    for term, (offset, count) in terms.items():
+        terms[term] = (offset, count, len(block_last))
+        last_docs, max_tfs, min_lengths, max_impacts = get_blocks(docs, tfs, lengths, offset, count, average_length)
+        block_last.extend(last_docs)
+        block_tfs.extend(max_tfs)
+        block_lengths.extend(min_lengths)
+        block_impacts.extend(max_impacts)
+    for suffix, values in (('pks', pks), ('lengths', lengths), ('publish', publish), ('expires', expires), ('docs', docs), ('tfs', tfs),
+                           ('blast', block_last), ('btfs', block_tfs), ('blengths', block_lengths), ('bimpacts', block_impacts)):
+        write_array("%s.%s" % (base, suffix), values)
+    with open(base + '.terms', 'wb') as f:
+        marshal.dump(terms, f)
+    write_array(base + '.del', array.array(DOC_TYPE))
+    return {'name': name, 'docs': len(pks), 'length': sum(lengths), 'deleted': 0}
+
+def merge_segments(directory, name, sources):
+    """
+        Writes the live documents of several segments to a new one, a term at a time, so memory use is bounded by the
+        term dictionary and the postings rather than by the documents.
+
+        @type sources: list
+        @param sources: The L{Segment} objects, with their tombstones loaded.
+
+        @rtype: dict
+        @return: The new segment's manifest entry.
+    """
+    # Number the live documents by primary key, as write_segment does, and map each source's numbers to them.
+    live = []
+    for index, segment in enumerate(sources):
+        live.extend([(pk, index, docno) for docno, pk in enumerate(segment.pks) if docno not in segment.deleted])
+    live.sort()
+    pks, lengths, publish, expires = array.array('i'), array.array(DOC_TYPE), array.array('i'), array.array('i')
+    remaps = [array.array('i', [-1]) * len(segment.pks) for segment in sources]
+    for new_docno, (pk, index, docno) in enumerate(live):
+        segment = sources[index]
+        remaps[index][docno] = new_docno
+        pks.append(pk)
+        lengths.append(segment.lengths[docno])
+        publish.append(segment.publish[docno])
+        expires.append(segment.expires[docno])
+    del live
+
+    docs, tfs = array.array(DOC_TYPE), array.array(TF_TYPE)
+    terms = {}
+    all_terms = set()
+    for segment in sources:
+        all_terms.update(segment.terms)
+    for term in sorted(all_terms):
+        merged = []
+        for index, segment in enumerate(sources):
+            postings = segment.postings(term)
+            if postings is not None:
+                remap = remaps[index]
+                # A source's documents keep their order, so each mapped list is already sorted.
+                merged.append([(remap[docno], tf) for docno, tf in zip(*postings) if remap[docno] >= 0])
+        entries = len(merged) == 1 and merged[0] or list(heapq.merge(*merged))
+        if entries:
+            terms[term] = (len(docs), len(entries))
+            docs.extend([docno for docno, tf in entries])
+            tfs.extend([tf for docno, tf in entries])
+    return write_segment_files(directory, name, pks, lengths, publish, expires, terms, docs, tfs)
+
+
+class Segment(object):
+    """
+        A segment opened for reading. The per-document arrays and the term dictionary are loaded; the postings are
+        memory-mapped.
+    """
+    def __init__(self, directory, name):
+        self.name = name
+        base = os.path.join(directory, name)
+        self.pks = load_array('i', base + '.pks')
+        self.lengths = load_array(DOC_TYPE, base + '.lengths')
+        self.publish = load_array('i', base + '.publish')
+        self.expires = load_array('i', base + '.expires')
+        with open(base + '.terms', 'rb') as f:
+            self.terms = marshal.load(f)
+        self.docs = self.map(base + '.docs')
+        self.tfs = self.map(base + '.tfs')
+        self.average_length = get_average_length(self.lengths)
+        # Segments written before block bounds were kept work them out per term when first searched.
+        if os.path.exists(base + '.bimpacts'):
+            self.block_arrays = [(DOC_TYPE, self.map(base + '.blast')), (TF_TYPE, self.map(base + '.btfs')),
+                                 (DOC_TYPE, self.map(base + '.blengths')), ('d', self.map(base + '.bimpacts'))]
+        else:
+            self.block_arrays = None
+        self.computed_blocks = {}
+        self.deleted = set()
+        self.doc_size = array.array(DOC_TYPE).itemsize
+        self.tf_size = array.array(TF_TYPE).itemsize
+
+    def map(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def load_deleted(self, directory):
+        self.deleted = set(load_array(DOC_TYPE, os.path.join(directory, self.name + '.del')))
+
+    def document_frequency(self, term):
+        entry = self.terms.get(term)
+        return entry and entry[1] or 0
+
+    def postings(self, term):
+        """
+            @rtype: tuple or None
+            @return: (document numbers, frequencies) arrays for a term, or None if the segment doesn't have it.
+        """
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        return self.read_postings(entry[0], entry[0] + entry[1])
+
+    def read_postings(self, start, end):
+        """
+            @rtype: tuple
+            @return: (document numbers, frequencies) arrays for a range of the postings.
+        """
+        docs, tfs = array.array(DOC_TYPE), array.array(TF_TYPE)
+        docs.fromstring(self.docs[start * self.doc_size:end * self.doc_size])
+        tfs.fromstring(self.tfs[start * self.tf_size:end * self.tf_size])
+        return docs, tfs
+
+    def blocks(self, term):
+        """
+            @rtype: tuple
+            @return: (last document number, largest frequency, shortest document length, best impact) arrays for a
+                term's blocks.
+        """
+        offset, count = self.terms[term][:2]
+        if self.block_arrays is None:
+            if term not in self.computed_blocks:
+                docs, tfs = self.postings(term)
+                self.computed_blocks[term] = get_blocks(docs, tfs, self.lengths, 0, count, self.average_length)
+            return self.computed_blocks[term]
+        first = self.terms[term][2]
+        last = first + (count + BLOCK_SIZE - 1) // BLOCK_SIZE
+        arrays = []
+        for typecode, values in self.block_arrays:
+            found = array.array(typecode)
+            found.fromstring(values[first * found.itemsize:last * found.itemsize])
+            arrays.append(found)
+        return tuple(arrays)
+
+    def posting_list(self, term):
+        """
+            @rtype: L{PostingList} or None
+            @return: The term's postings, or None if the segment doesn't have it.
+        """
+        if term not in self.terms:
+            return None
+        return PostingList(self, term)
+
+
+class PostingList(object):
+    """
+        One term's postings in a segment, for one search. The list driving a search is read from the mapped postings a
+        block at a time, as the search visits them; the lists it looks documents up in are read whole.
+
+        @type last_docs: array
+        @cvar last_docs: The last document number of each block.
+    """
+    def __init__(self, segment, term):
+        self.segment = segment
+        self.offset, self.count = segment.terms[term][:2]
+        self.last_docs, self.max_tfs, self.min_lengths, self.max_impacts = segment.blocks(term)
+        self.read = {}
+        self.all = None
+
+    def __len__(self):
+        return self.count
+
+    def block(self, number):
+        """
+            @rtype: tuple
+            @return: (document numbers, frequencies) arrays for a block.
+        """
+        found = self.read.get(number)
+        if found is None:
+            start = self.offset + number * BLOCK_SIZE
+            found = self.read[number] = self.segment.read_postings(start, min(start + BLOCK_SIZE, self.offset + self.count))
+        return found
+
+    def read_all(self):
+        """
+            Reads the whole list, once. Lists looked in rather than walked are read this way: a copy out of the map
+            is cheaper than finding and reading a block for each lookup.
+
+            @rtype: tuple
+            @return: (document numbers, frequencies) arrays.
+        """
+        if self.all is None:
+            self.all = self.segment.read_postings(self.offset, self.offset + self.count)
+        return self.all
+
+    def find(self, docno):
+        """
+            @rtype: int or None
+            @return: The term's frequency in a document, or None if the document doesn't have the term.
+        """
+        docs, tfs = self.read_all()
+        position = bisect.bisect_left(docs, docno)
+        if position < self.count and docs[position] == docno:
+            return tfs[position]
+        return None
+
+    def bounds(self, weight, average_length):
+        """
+            @rtype: list
+            @return: The most a document in each block can score for the term. BM25 grows with the frequency and
+            shrinks with the document length, so the block's largest frequency and shortest length bound it. So does
+            its best impact at the segment's average length, times how much longer the average is now, if it is.
+        """
+        scale = max(1.0, average_length / self.segment.average_length)
+        return [weight * min(get_impact(tf, length, average_length), impact * scale)
+                for tf, length, impact in izip(self.max_tfs, self.min_lengths, self.max_impacts)]
+
+
+class Hits(list):
+    """
+        Search results: (score, pk) tuples, best first.
+
+        @type generation: int
+        @cvar generation: The generation of the index the scores were worked out from. Scores depend on the whole
+        index, so they're only comparable with others from the same generation.
+    """
+    def __init__(self, results, generation):
+        list.__init__(self, results)
+        self.generation = generation
+
+
+class TextIndex(object):
+    """
+        An index directory.
+
+        @type root: string
+        @cvar root: The directory. It's created if missing.
+
+        @type max_segments: int
+        @cvar max_segments: How many segments needs_merge allows before asking for a merge.
+    """
+    def __init__(self, root, max_segments = 10):
+        self.root = root
+        self.max_segments = max_segments
+        self.segments = []
+        self.manifest = {'generation': 0, 'segments': []}
+        self._manifest_stat = None
+        if not os.path.isdir(root):
+            try:
+                os.makedirs(root)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    @contextmanager
+    def lock(self, name = 'write', blocking = True):
+        """
+            Holds an exclusive flock on a lock file in the index directory. With blocking False, yields False at once
+            if another process holds it.
+        """
+        with open(os.path.join(self.root, name + '.lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (not blocking and fcntl.LOCK_NB or 0))
+            except IOError, e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.root, 'manifest.json')) as f:
+                return json.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return {'generation': 0, 'segments': []}
+
+    def write_manifest(self, manifest):
+        manifest['generation'] += 1
+        write_atomic(os.path.join(self.root, 'manifest.json'), json.dumps(manifest))
+
+    def refresh(self):
+        """
+            Reopens the index if another process has changed it. Called before every search, and costs one stat when
+            nothing has changed.
+        """
+        path = os.path.join(self.root, 'manifest.json')
+        try:
+            stat = os.stat(path)
+            stat = (stat.st_ino, stat.st_mtime, stat.st_size)
+        except OSError:
+            stat = None
+        if stat == self._manifest_stat:
+            return
+        manifest = self.read_manifest()
+        open_segments = dict((segment.name, segment) for segment in self.segments)
+        segments = []
+        for entry in manifest['segments']:
+            segment = open_segments.get(entry['name']) or Segment(self.root, entry['name'])
+            segment.load_deleted(self.root)
+            segments.append(segment)
+        self.segments = segments
+        self.manifest = manifest
+        self._manifest_stat = stat
+
+    def new_segment_name(self):
+        return "seg-%d-%d" % (int(time.time() * 1000), os.getpid())
+
+    def tombstone(self, manifest, pks, skip = ()):
+        """
+            Marks the documents with the given primary keys deleted in every segment of a manifest, except those named in
+            skip. Call with the write lock held.
+        """
+        pks = sorted(set(pks))
+        for entry in manifest['segments']:
+            if entry['name'] in skip:
+                continue
+            base = os.path.join(self.root, entry['name'])
+            segment_pks = load_array('i', base + '.pks')
+            deleted = set(load_array(DOC_TYPE, base + '.del'))
+            found = []
+            for pk in pks:
+                docno = bisect.bisect_left(segment_pks, pk)
+                if docno < len(segment_pks) and segment_pks[docno] == pk and docno not in deleted:
+                    found.append(docno)
+            if found:
+                deleted = array.array(DOC_TYPE, sorted(deleted.union(found)))
+                write_atomic(base + '.del', deleted.tostring())
+                entry['deleted'] = len(deleted)
+
+    def add(self, documents):
+        """
+            Adds documents in a new segment, replacing any older copies of them.
+
+            @type documents: list
+            @param documents: L{Document} objects.
+        """
+        documents = list(documents)
+        if not documents:
+            return
+        name = self.new_segment_name()
+        with self.lock():
+            entry = write_segment(self.root, name, documents)
+            manifest = self.read_manifest()
+            self.tombstone(manifest, [document.pk for document in documents])
+            manifest['segments'].append(entry)
+            self.write_manifest(manifest)
+
+    def delete(self, pks):
+        """
+            Removes documents by primary key.
+        """
+        with self.lock():
+            manifest = self.read_manifest()
+            self.tombstone(manifest, pks)
+            self.write_manifest(manifest)
+
+    def needs_merge(self):
+        self.refresh()
+        return len(self.segments) > self.max_segments
+
+    def choose_merge(self, entries):
+        """
+            Picks the segments to merge. The largest segment is left alone while less than a tenth of it is deleted, so
+            the merges triggered by saves only rewrite the small segments they have been adding.
+
+            @rtype: list
+            @return: The names of the segments to merge.
+        """
+        entries = sorted(entries, key = lambda entry: entry['docs'])
+        if entries and entries[-1]['deleted'] * 10 < entries[-1]['docs']:
+            entries = entries[:-1]
+        if len(entries) < 2:
+            return []
+        return [entry['name'] for entry in entries]
+
+    def merge(self, full = False):
+        """
+            Merges segments into one, leaving out deleted documents. Runs without the write lock except to swap the new
+            segment in, so saves carry on meanwhile; documents deleted or replaced during the merge are tombstoned in
+            the new segment before the swap. Returns at once if another merge is running.
+
+            @type full: boolean
+            @param full: Merge every segment, instead of those chosen by choose_merge.
+
+            @rtype: boolean
+            @return: True if a merge was done.
+        """
+        with self.lock('merge', blocking = False) as locked:
+            if not locked:
+                return False
+            with self.lock():
+                snapshot = self.read_manifest()
+            if full:
+                names = [entry['name'] for entry in snapshot['segments']]
+            else:
+                names = self.choose_merge(snapshot['segments'])
+            if len(names) < 2:
+                return False
+            sources = [Segment(self.root, name) for name in names]
+            for segment in sources:
+                segment.load_deleted(self.root)
+            # Live documents are unique across segments, since adding one tombstones its older copies.
+            entry = merge_segments(self.root, self.new_segment_name(), sources)
+
+            with self.lock():
+                manifest = self.read_manifest()
+                # Carry over what was deleted or replaced in the sources while the merge ran.
+                changed = []
+                for segment in sources:
+                    deleted_before = segment.deleted
+                    segment.load_deleted(self.root)
+                    changed.extend([segment.pks[docno] for docno in segment.deleted - deleted_before])
+                if changed:
+                    self.tombstone({'segments': [entry]}, changed)
+                manifest['segments'] = [entry] + [item for item in manifest['segments'] if item['name'] not in names]
+                self.write_manifest(manifest)
+            for name in names:
+                self.remove_segment_files(name)
+            return True
+
+    def rebuild(self, batches):
+        """
+            Replaces the whole index with new documents. Segments are written a batch at a time, then swapped in for the
+            old ones at once.
+
+            @type batches: iterable
+            @param batches: Lists of L{Document} objects.
+
+            @rtype: int
+            @return: The number of documents indexed.
+        """
+        entries = []
+        count = 0
+        for documents in batches:
+            documents = list(documents)
+            if documents:
+                entries.append(write_segment(self.root, self.new_segment_name() + "-%d" % len(entries), documents))
+                count += len(documents)
+        with self.lock():
+            manifest = self.read_manifest()
+            old_names = [item['name'] for item in manifest['segments']]
+            manifest['segments'] = entries
+            self.write_manifest(manifest)
+        for segment_name in old_names:
+            self.remove_segment_files(segment_name)
+        return count
+
+    def remove_segment_files(self, name):
+        # Other processes may still have the files mapped, which is fine on POSIX; they reopen on their next refresh.
+        for suffix in ('pks', 'lengths', 'publish', 'expires', 'docs', 'tfs', 'blast', 'btfs', 'blengths', 'bimpacts', 'terms', 'del'):
+            try:
+                os.remove(os.path.join(self.root, "%s.%s" % (name, suffix)))
+            except OSError:
+                pass
+
+    def search(self, query, filters = (), now = None, limit = 20, after = None):
+        """
+            Finds the documents containing every term of a query and every filter term, ranked by BM25.
+
+            @type query: unicode
+            @param query: The words searched for.
+
+            @type filters: list
+            @param filters: Filter terms every result must carry, such as site:1.
+
+            @type now: int
+            @param now: Epoch seconds. If given, documents not yet published or already expired at that time are left out.
+
+            @type limit: int
+            @param limit: The number of results to return.
+
+            @type after: tuple
+            @param after: The (score, pk, generation) of the last result on the previous page, from the results'
+                generation. Results continue after it. If the index has changed since, the scores have too, so the
+                document is scored again and the results continue after its new score. (score, pk) is taken as is.
+
+            @rtype: L{Hits}
+            @return: (score, pk) tuples, best first, with ties broken by the highest pk.
+        """
+        terms = sorted(set(tokenize(query)))
+        try:
+            self.refresh()
+        except (IOError, OSError):
+            # A merge removed segment files between reading the manifest and opening them.
+            self._manifest_stat = None
+            self.refresh()
+        segments, manifest = self.segments, self.manifest
+        if not terms:
+            return Hits([], manifest['generation'])
+
+        total_docs = sum(len(segment.pks) - len(segment.deleted) for segment in segments)
+        total_length = sum(entry['length'] for entry in manifest['segments'])
+        indexed_docs = sum(len(segment.pks) for segment in segments)
+        if not total_docs:
+            return Hits([], manifest['generation'])
+        average_length = float(total_length) / (indexed_docs or 1)
+        weights = {}
+        for term in terms:
+            # Deleted documents keep their postings until a merge, so the count can pass the live documents. Capping
+            # it keeps the weight positive, which the block bounds rely on.
+            frequency = min(sum(segment.document_frequency(term) for segment in segments), total_docs)
+            weights[term] = math.log(1 + (total_docs - frequency + 0.5) / (frequency + 0.5)) * (K1 + 1)
+
+        if after is not None and len(after) > 2:
+            score, pk, generation = after
+            if generation != manifest['generation']:
+                rescored = self.score_document(segments, pk, terms, weights, average_length)
+                if rescored is not None:
+                    score = rescored
+            after = (score, pk)
+
+        found = []
+        # The biggest segment first, so the results it finds let the searches of the small ones stop early.
+        for segment in sorted(segments, key = lambda segment: -len(segment.pks)):
+            self.search_segment(segment, terms, filters, now, weights, average_length, after, limit, found)
+        return Hits(sorted(found, reverse = True), manifest['generation'])
+
+    def score_document(self, segments, pk, terms, weights, average_length):
+        """
+            Scores one document for the query terms it has, as search_segment would.
+
+            @rtype: float or None
+            @return: The score, or None if the document isn't in the index.
+        """
+        for segment in segments:
+            docno = bisect.bisect_left(segment.pks, pk)
+            if docno == len(segment.pks) or segment.pks[docno] != pk or docno in segment.deleted:
+                continue
+            norm = K1 * (1 - B + B * segment.lengths[docno] / average_length)
+            score = 0.0
+            for term in terms:
+                postings = segment.posting_list(term)
+                tf = postings is not None and postings.find(docno) or 0
+                score += weights[term] * tf / (tf + norm)
+            return score
+        return None
+
+    def search_segment(self, segment, terms, filters, now, weights, average_length, after, limit, found):
+        """
+            Adds a segment's best matches to found, a heap of the best (score, pk) tuples found so far, at most limit long.
+
+            The shortest term's postings drive the search. Each of its blocks is given the most a document in it could
+            score, from the block bounds of every query term overlapping it, and the blocks are visited best bound first
+            until the bound drops below the worst of the limit results found. Within a block, a document is looked up
+            in the other lists, shortest first, and dropped as soon as what it has scored plus the bounds of the query
+            terms left can't make up the difference.
+        """
+        scoring = []
+        lists = []
+        for term in terms + [term for term in filters if term not in terms]:
+            postings = segment.posting_list(term)
+            if postings is None:
+                return
+            lists.append(postings)
+            if term in weights:
+                scoring.append((postings, weights[term]))
+        # The shortest query term drives the search, unless a filter is shorter than the part of the term's list it
+        # would visit. That shrinks as more of the term's documents pass the filters, since skipping by score starts
+        # once limit of them have been found.
+        weights_by_list = dict(scoring)
+        driver = min([term_postings for term_postings, weight in scoring], key = len)
+        shortest = min(lists, key = len)
+        if shortest is not driver:
+            passing = float(len(driver))
+            for postings in lists:
+                if postings not in weights_by_list:
+                    passing *= float(len(postings)) / len(segment.pks)
+            if len(shortest) < len(driver) * min(1.0, limit * VISIT_RATIO / (passing or 1)):
+                driver = shortest
+        # The shortest lists are looked in first, as they're the likeliest to rule a document out.
+        others = sorted([postings for postings in lists if postings is not driver], key = len)
+        members = None
+        if driver not in weights_by_list:
+            # Nothing can be skipped by score before the filters are checked, so check them all up front with set
+            # operations, probing the lists much longer than the documents left.
+            members = set(driver.read_all()[0])
+            for postings in others:
+                if postings in weights_by_list:
+                    continue
+                if len(postings) <= INTERSECT_RATIO * len(members):
+                    members.intersection_update(postings.read_all()[0])
+                else:
+                    members = set([docno for docno in members if postings.find(docno) is not None])
+            others = [postings for postings in others if postings in weights_by_list]
+
+        # The range of document numbers each of the driver's blocks covers ends at its last one.
+        driver_weight = 0.0
+        bounds = [0.0] * len(driver.last_docs)
+        for postings, weight in scoring:
+            if postings is driver:
+                driver_weight = weight
+                bounds = postings.bounds(weight, average_length)
+        ranges = {}
+        for postings in others:
+            if postings in weights_by_list:
+                ranges[postings] = get_range_bounds(driver.last_docs, postings, postings.bounds(weights_by_list[postings], average_length))
+        for number in xrange(len(bounds)):
+            for term_bounds in ranges.values():
+                if bounds[number] is None or term_bounds[number] is None:
+                    bounds[number] = None
+                else:
+                    bounds[number] += term_bounds[number]
+
+        pks, lengths, publish, expires, deleted = segment.pks, segment.lengths, segment.publish, segment.expires, segment.deleted
+        for number in sorted([number for number, bound in enumerate(bounds) if bound is not None], key = bounds.__getitem__, reverse = True):
+            if len(found) >= limit and bounds[number] + BOUND_SLACK < found[0][0]:
+                break
+            # What the query terms left can add once a document has been looked up in the first i other lists.
+            left = [BOUND_SLACK]
+            for postings in reversed(others):
+                left.insert(0, left[0] + (postings in ranges and ranges[postings][number] or 0.0))
+            docs, tfs = driver.block(number)
+            for position, docno in enumerate(docs):
+                if members is not None and docno not in members:
+                    continue
+                tf = tfs[position]
+                norm = K1 * (1 - B + B * lengths[docno] / average_length)
+                partial = driver_weight * tf / (tf + norm)
+                if len(found) >= limit and partial + left[0] < found[0][0]:
+                    continue
+                if docno in deleted:
+                    continue
+                if now is not None and (publish[docno] > now or 0 < expires[docno] < now):
+                    continue
+                frequencies = {driver: tf}
+                for index, postings in enumerate(others):
+                    tf = postings.find(docno)
+                    if tf is None:
+                        break
+                    frequencies[postings] = tf
+                    weight = weights_by_list.get(postings)
+                    if weight:
+                        partial += weight * tf / (tf + norm)
+                        if len(found) >= limit and partial + left[index + 1] < found[0][0]:
+                            break
+                else:
+                    # Summed in term order, as score_document does, so the same document always gets the same score.
+                    score = 0.0
+                    for postings, weight in scoring:
+                        tf = frequencies[postings]
+                        score += weight * tf / (tf + norm)
+                    result = (score, pks[docno])
+                    if after is not None and not result < after:
+                        continue
+                    if len(found) < limit:
+                        heapq.heappush(found, result)
+                    elif result > found[0]:
+                        heapq.heapreplace(found, result)
@@ -0,0 +1,205 @@
+"""
+    Load benchmark for the content detail page.
+
+    Seeds a throwaway database, then drives content_display through the WSGI application in wsgi.py under three
+    scenarios:
+
+        cold    The cache is cleared before every request, so each one does the content type, object and category
+                lookups from the database and renders the page.
+        warm    The object caches are filled by an untimed pass first; pages are rendered on every request.
+        html    As warm, with settings.CACHE_HTML on, so repeat requests are served from the HTML cache.
+
+    Throughput and p50/p90/p99 latency for each scenario are printed and saved as JSON, named after the current
+    commit, so runs can be compared across commits with --compare. See benchmarks/settings.py for running
+    against Postgres or memcached.
+
+    Usage, from the repository root:
+
+        python -m benchmarks.content_display --articles 5000 --requests 2000
+        python -m benchmarks.content_display --compare benchmarks/results/<commit>.json
+"""
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from optparse import OptionParser
+from StringIO import StringIO
+from wsgiref.util import setup_testing_defaults
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+SCENARIOS = ('cold', 'warm', 'html')
+
+
+def get_commit():
+    try:
+        return subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd = ROOT, stdout = subprocess.PIPE).communicate()[0].strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+def setup_database():
+    """
+        Creates the tables, emptying them first if the database already exists.
+    """
+    from django.conf import settings
+    from django.core.management import call_command
+
+    if settings.DATABASES['default']['ENGINE'].endswith('sqlite3') and os.path.exists(settings.DATABASES['default']['NAME']):
+        os.remove(settings.DATABASES['default']['NAME'])
+    call_command('syncdb', interactive = False, verbosity = 0)
+    call_command('flush', interactive = False, verbosity = 0)
+
+def get_paths(article_ids, count, random_seed):
+    """
+        Picks the paths requested during a run. The same seed always picks the same paths.
+    """
+    from apps.content.models import Article
+
+    rand = random.Random(random_seed)
+    chosen = [rand.choice(article_ids) for i in range(count)]
+    urls = dict((article.id, article.get_absolute_url()) for article in Article.objects.filter(id__in = set(chosen)))
+    return [urls[article_id] for article_id in chosen]
+
+def request(application, path):
+    """
+        Makes one GET request through the WSGI application.
+
+        @rtype: tuple
+        @return: (status code, milliseconds taken)
+    """
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'wsgi.input': StringIO(), 'wsgi.errors': sys.stderr}
+    setup_testing_defaults(environ)
+    status = []
+    def start_response(status_line, headers, exc_info = None):
+        status.append(int(status_line.split(' ', 1)[0]))
+
+    started = time.time()
+    response = application(environ, start_response)
+    try:
+        for chunk in response:
+            pass
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return status[0], (time.time() - started) * 1000
+
+def percentile(ordered, fraction):
+    """ Nearest-rank percentile of an already sorted list. """
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def run_scenario(application, name, paths):
+    """
+        Runs one scenario over the paths.
+
+        @rtype: dict
+        @return: Throughput, latency percentiles and status code counts.
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+
+    # content_display uses CACHE_HTML as the HTML cache timeout, in seconds.
+    settings.CACHE_HTML = name == 'html' and settings.CACHE_LONG_SECONDS or None
+    cache.clear()
+    if name != 'cold':
+        for path in set(paths):
+            request(application, path)
+
+    latencies = []
+    statuses = {}
+    for path in paths:
+        if name == 'cold':
+            cache.clear()
+        status, elapsed = request(application, path)
+        latencies.append(elapsed)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    # Only the requests are timed, not the cold scenario's cache clears between them.
+    seconds = sum(latencies) / 1000
+
+    latencies.sort()
+    return {
+        'requests': len(paths),
+        'seconds': round(seconds, 3),
+        'throughput': round(len(paths) / seconds, 1),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p90_ms': round(percentile(latencies, 0.9), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3),
+        'statuses': statuses,
+    }
+
+def compare(results, baseline_path):
+    """
+        Prints each scenario's change in throughput and latency against an earlier results file.
+    """
+    baseline = json.load(open(baseline_path))
+    print "\nAgainst %s (%s):" % (baseline_path, baseline.get('commit', 'unknown')[:10])
+    for name, current in sorted(results['scenarios'].items()):
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        changes = []
+        for field in ('throughput', 'p50_ms', 'p99_ms'):
+            if previous[field]:
+                changes.append("%s %+.1f%%" % (field, (current[field] - previous[field]) * 100.0 / previous[field]))
+        print "  %-5s %s" % (name, ', '.join(changes))
+
+def main():
+    parser = OptionParser(usage = "python -m benchmarks.content_display [options]")
+    parser.add_option('--articles', type = 'int', default = 1000, help = 'Number of articles to seed.')
+    parser.add_option('--categories', type = 'int', default = 50, help = 'Number of categories to seed.')
+    parser.add_option('--sites', type = 'int', default = 5, help = 'Number of sites to seed.')
+    parser.add_option('--images', type = 'int', default = 200, help = 'Number of images to seed.')
+    parser.add_option('--requests', type = 'int', default = 1000, help = 'Number of timed requests per scenario.')
+    parser.add_option('--scenario', action = 'append', dest = 'scenarios', choices = SCENARIOS, help = 'Scenario to run. Repeat for several. Defaults to all of them.')
+    parser.add_option('--seed', type = 'int', default = 1, help = 'Random seed for the corpus and the requested paths.')
+    parser.add_option('--output', default = None, help = 'Where to save the JSON results. Defaults to benchmarks/results/<commit>.json.')
+    parser.add_option('--compare', default = None, help = 'An earlier results file to compare against.')
+    options, args = parser.parse_args()
+
+    import django
+    from django.conf import settings
+    from benchmarks.seed import seed
+
+    setup_database()
+    article_ids = seed(options.articles, options.categories, options.sites, options.images, options.seed)
+    paths = get_paths(article_ids, options.requests, options.seed)
+
+    from wsgi import application
+
+    commit = get_commit()
+    results = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+        'cache': settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1],
+        'corpus': {'articles': options.articles, 'categories': options.categories, 'sites': options.sites, 'images': options.images, 'seed': options.seed},
+        'scenarios': {},
+    }
+    for name in options.scenarios or SCENARIOS:
+        result = results['scenarios'][name] = run_scenario(application, name, paths)
+        print "%-5s %8.1f req/s  p50 %8.2fms  p90 %8.2fms  p99 %8.2fms  statuses %s" % (name, result['throughput'], result['p50_ms'], result['p90_ms'], result['p99_ms'], result['statuses'])
+
+    output = options.output or os.path.join(ROOT, 'benchmarks', 'results', '%s.json' % commit[:10])
+    if not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    json.dump(results, open(output, 'w'), indent = 2, sort_keys = True)
+    print "Saved %s" % output
+
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
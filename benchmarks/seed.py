@@ -0,0 +1,17 @@
+"""
+    Seeds the benchmark database with a reproducible corpus.
+"""
+from apps.content.corpus import CorpusGenerator
+
+
+def seed(articles = 1000, categories = 50, sites = 5, images = 200, random_seed = 1):
+    """
+        Fills an empty database. The same arguments always produce the same rows. Every article is public and
+        already published, so every benchmarked request renders a page.
+
+        @rtype: list
+        @return: The ids of the seeded articles.
+    """
+    generator = CorpusGenerator(articles = articles, categories = categories, category_depth = 3, category_fanout = 5, sites = sites,
+        authors = 10, images = images, future_ratio = 0, expired_ratio = 0, draft_ratio = 0, days = 365, random_seed = random_seed)
+    return generator.generate()
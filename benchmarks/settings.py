@@ -0,0 +1,57 @@
+"""
+    Settings for the benchmark suite. Everything comes from settings.common except the database and cache, which
+    default to a throwaway SQLite file and locmem so runs don't touch a real install.
+
+    GRIFFON_BENCH_DB=postgres uses a local Postgres database instead, named by GRIFFON_BENCH_DB_NAME
+    (default griffoncms_bench). GRIFFON_BENCH_CACHE=memcached uses a local memcached on 127.0.0.1:11211.
+"""
+from __future__ import absolute_import
+
+import os
+import tempfile
+
+from settings.common import *
+
+DEBUG = False
+TEMPLATE_DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+if os.environ.get('GRIFFON_BENCH_DB') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': os.environ.get('GRIFFON_BENCH_DB_NAME', 'griffoncms_bench'),
+            'USER': os.environ.get('GRIFFON_BENCH_DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('GRIFFON_BENCH_DB_PASSWORD', ''),
+            'HOST': 'localhost',
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('GRIFFON_BENCH_DB_NAME', os.path.join(tempfile.gettempdir(), 'griffoncms_bench.sqlite3')),
+        }
+    }
+
+if os.environ.get('GRIFFON_BENCH_CACHE') == 'memcached':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+            'KEY_PREFIX': 'griffoncms_bench',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 1000000},
+        }
+    }
+
+MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'griffoncms_bench_media')
+
+# The per-request log line and query counting would be measured along with everything else.
+REQUEST_STATS_LOG = False
+REQUEST_STATS_QUERIES = False
@@ -0,0 +1,180 @@
+"""
+    Benchmark for text index searches.
+
+    Builds a synthetic index in a temporary directory, with document terms drawn from a Zipf distribution so a few
+    terms are in most documents and most terms are in a few, then times searches under five scenarios:
+
+        common  One of the most frequent terms.
+        two     A frequent term and a middling one.
+        rare    A term in a few hundred documents.
+        public  A frequent term, with the site and status filters every public search adds.
+        filter  As public, in one category.
+        deep    The fifth page of a frequent term, following the tokens of the pages before it.
+
+    Latency percentiles for each scenario are printed and saved as JSON, named after the current commit, as
+    content_display does. The index is built once and kept with --keep, so later runs can reuse it with --root.
+
+    Usage, from the repository root:
+
+        python -m benchmarks.text_index --documents 1000000 --searches 200
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from bisect import bisect
+from datetime import datetime
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.content_display import get_commit, percentile
+from apps.utilities.textindex.index import Document, TextIndex
+
+SCENARIOS = ('common', 'two', 'rare', 'public', 'filter', 'deep')
+
+
+def get_cumulative(vocabulary):
+    """ Cumulative Zipf weights for drawing terms by rank. """
+    total, cumulative = 0.0, []
+    for rank in xrange(vocabulary):
+        total += 1.0 / (rank + 1)
+        cumulative.append(total)
+    return cumulative
+
+def get_documents(count, vocabulary, terms_per_document, categories, sites, random_seed, batch_size = 50000):
+    """
+        Yields batches of synthetic documents.
+    """
+    generator = random.Random(random_seed)
+    cumulative = get_cumulative(vocabulary)
+    total = cumulative[-1]
+    batch = []
+    for pk in xrange(1, count + 1):
+        frequencies = {}
+        length = generator.randint(terms_per_document // 2, terms_per_document * 2)
+        for position in xrange(length):
+            term = u"t%d" % bisect(cumulative, generator.random() * total)
+            frequencies[term] = frequencies.get(term, 0) + 1
+        filters = ["site:%d" % generator.randint(1, sites), "status:2", "category:%d" % generator.randint(1, categories)]
+        batch.append(Document(pk, frequencies, length, filters))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def get_queries(name, index, count, random_seed):
+    """
+        @rtype: list
+        @return: (query, filters) tuples for a scenario.
+    """
+    generator = random.Random(random_seed)
+    segment = max(index.segments, key = lambda segment: len(segment.pks))
+    ranked = sorted(segment.terms, key = lambda term: -segment.document_frequency(term))
+    ranked = [term for term in ranked if term.startswith('t')]
+    rare = [term for term in ranked if 100 <= segment.document_frequency(term) <= 1000] or ranked[-100:]
+    queries = []
+    for number in xrange(count):
+        common = generator.choice(ranked[:20])
+        if name == 'two':
+            queries.append((u"%s %s" % (common, generator.choice(ranked[100:1000])), []))
+        elif name == 'rare':
+            queries.append((generator.choice(rare), []))
+        elif name == 'public':
+            queries.append((common, ["site:%d" % generator.randint(1, 5), "status:2"]))
+        elif name == 'filter':
+            queries.append((common, ["site:%d" % generator.randint(1, 5), "status:2", "category:%d" % generator.randint(1, 50)]))
+        else:
+            queries.append((common, []))
+    return queries
+
+def run_scenario(index, name, queries, limit):
+    """
+        Runs one scenario's queries.
+
+        @rtype: dict
+        @return: Latency percentiles in milliseconds.
+    """
+    latencies = []
+    for query, filters in queries:
+        after = None
+        pages = name == 'deep' and 5 or 1
+        for page in xrange(pages):
+            started = time.time()
+            hits = index.search(query, filters, None, limit + 1, after)
+            elapsed = (time.time() - started) * 1000
+            if len(hits) <= limit:
+                break
+            after = hits[limit - 1] + (getattr(hits, 'generation', 0),)
+        latencies.append(elapsed)
+    latencies.sort()
+    return {
+        'searches': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p90_ms': round(percentile(latencies, 0.9), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3),
+    }
+
+def main():
+    parser = OptionParser(usage = "python -m benchmarks.text_index [options]")
+    parser.add_option('--documents', type = 'int', default = 100000, help = 'Number of documents to index.')
+    parser.add_option('--vocabulary', type = 'int', default = 50000, help = 'Number of distinct terms.')
+    parser.add_option('--terms', type = 'int', default = 40, help = 'Typical number of terms per document.')
+    parser.add_option('--searches', type = 'int', default = 200, help = 'Number of timed searches per scenario.')
+    parser.add_option('--limit', type = 'int', default = 20, help = 'Results per page.')
+    parser.add_option('--scenario', action = 'append', dest = 'scenarios', choices = SCENARIOS, help = 'Scenario to run. Repeat for several. Defaults to all of them.')
+    parser.add_option('--seed', type = 'int', default = 1, help = 'Random seed for the corpus and the queries.')
+    parser.add_option('--root', default = None, help = 'An index built by an earlier run with --keep, to search instead of building one.')
+    parser.add_option('--keep', action = 'store_true', default = False, help = 'Keep the index built, and print where it is.')
+    parser.add_option('--output', default = None, help = 'Where to save the JSON results. Defaults to benchmarks/results/text-index-<commit>.json.')
+    options, args = parser.parse_args()
+
+    root = options.root or tempfile.mkdtemp(prefix = 'text-index-')
+    index = TextIndex(root)
+    build_seconds = None
+    if not options.root:
+        started = time.time()
+        index.rebuild(get_documents(options.documents, options.vocabulary, options.terms, 50, 5, options.seed))
+        index.merge(full = True)
+        build_seconds = round(time.time() - started, 1)
+        print "Indexed %d documents in %.1fs" % (options.documents, build_seconds)
+    index.refresh()
+
+    commit = get_commit()
+    results = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'corpus': {'documents': sum(len(segment.pks) for segment in index.segments), 'vocabulary': options.vocabulary, 'terms': options.terms, 'seed': options.seed},
+        'build_seconds': build_seconds,
+        'scenarios': {},
+    }
+    try:
+        for name in options.scenarios or SCENARIOS:
+            queries = get_queries(name, index, options.searches, options.seed)
+            result = results['scenarios'][name] = run_scenario(index, name, queries, options.limit)
+            print "%-6s p50 %8.2fms  p90 %8.2fms  p99 %8.2fms  max %8.2fms" % (name, result['p50_ms'], result['p90_ms'], result['p99_ms'], result['max_ms'])
+    finally:
+        if options.keep or options.root:
+            print "Index kept in %s" % root
+        else:
+            shutil.rmtree(root)
+
+    output = options.output or os.path.join(ROOT, 'benchmarks', 'results', 'text-index-%s.json' % commit[:10])
+    if not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    json.dump(results, open(output, 'w'), indent = 2, sort_keys = True)
+    print "Saved %s" % output
+
+
+if __name__ == '__main__':
+    main()
@@ -20,19 +20,44 @@ DATABASES = {
         'HOST' : 'localhost',
    }
 }
+# Aliases in DATABASES of replicas of the default database, the primary. Add apps.utilities.replicas.router.ReplicaRouter
+# to DATABASE_ROUTERS and apps.utilities.replicas.middleware.ReplicaMiddleware to MIDDLEWARE_CLASSES, after
+# AuthenticationMiddleware, to send the reads of public requests to them. See apps.utilities.replicas.router.
+DATABASE_REPLICAS = []
+# How long a visitor's requests stay on the primary after one of them writes, in seconds.
+REPLICA_PIN_SECONDS = 15
+REPLICA_PIN_COOKIE = 'primary_pin'
+# How long any write keeps reads of the app it wrote to on the primary, in every process. Set it above the replicas' usual lag.
+REPLICA_LAG_SECONDS = 2
+# Apps always read from the primary, and paths whose requests always are. Content types stay on the primary because
+# Django caches them per database: read from a replica, every lookup misses and calls get_or_create().
+REPLICA_PRIMARY_APPS = ('auth', 'contenttypes', 'sessions')
+REPLICA_PRIMARY_PATHS = ('/admin/',)
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # GROUP_NAME is used by the caching structure to cache elements across multiple sites. All sites with a common GROUP_NAME will share cache.
 GROUP_NAME = 'griffoncms'
 # GROUP_CACHE_VERSION can be incremented/changed to break cache across all sites in a group.
+# Run the warm_cache_version command for the new version before deploying the change.
 GROUP_CACHE_VERSION = 1
+# While set, cache misses on the current version fall back to this one, and invalidation clears both. Set it to the old version
+# when bumping GROUP_CACHE_VERSION, and back to None once the new keys have filled.
+GROUP_CACHE_PREVIOUS_VERSION = None
+# While set, invalidation also clears this version's keys. Set it to the version warm_cache_version fills ahead of a bump,
+# so edits made between the warm-up and the deploy don't leave stale keys waiting, and back to None with the bump.
+GROUP_CACHE_NEXT_VERSION = None
 
 # Multiple site settings.
 SITE_ID = 1
 SITE_DOMAIN = '127.0.0.1:8000'
 # SITE_PREFIX is used to cache things in a site-specific way.
 SITE_PREFIX = 'griffon_com'
+# Add apps.utilities.sites.middleware.SiteMiddleware to MIDDLEWARE_CLASSES, after RequestStatsMiddleware, to serve every
+# site from these settings, picking the site by the Host header. SITE_ID is then the site for unknown hosts, and outside
+# requests. The Site domains are reread this often, in seconds. With SITE_UNKNOWN_HOST_404, unknown hosts get a 404 instead.
+SITE_HOSTS_SECONDS = 60
+SITE_UNKNOWN_HOST_404 = False
 
 # Used as the from address for most emails.
 SITE_FROM_EMAIL = 'webmaster@griffoncms.com'
@@ -67,22 +92,99 @@ TEMPLATE_DIRS = (
 
 # site cache key prefix
 CACHE_MIDDLEWARE_KEY_PREFIX = SITE_PREFIX
-# Incrementing or changing cache version breaks site-specific cache.
+# Incrementing or changing cache version breaks site-specific cache: the image size keys written when renditions are
+# stored, and the feed ETags. No page or object read misses on it, so unlike GROUP_CACHE_VERSION it needs no warm-up.
 CACHE_VERSION = 1
 # Whether or not to cache the rendered HTML of content pages.
 CACHE_HTML = None
+# How long to keep content page shells, in seconds, when pages are put together from cached fragments. See apps.content.fragments.
+# CACHE_HTML takes precedence when both are on.
+CACHE_FRAGMENTS = None
+# When set, public content pages are also written to static files under this directory, in a directory per site domain,
+# for the web server to serve. See apps.content.bake and the bake_content command.
+STATIC_BAKE_ROOT = None
+# Part of every content page's ETag. Increment it when the detail templates change, so clients and proxies refetch.
+CONTENT_TEMPLATE_VERSION = 1
+# How long, in seconds, browsers and shared proxies may keep a public content page before revalidating it.
+CONTENT_MAX_AGE = 60
+CONTENT_SHARED_MAX_AGE = 60 * 5
+# The Postgres text search configuration used to build and query content search vectors. Run update_search_index
+# after changing it.
+SEARCH_CONFIG = 'english'
+SEARCH_RESULTS_PER_PAGE = 20
+# Without Postgres, setting this to a directory keeps content in an on-disk text index there. See apps.content.text_index
+# and the rebuild_search_index command.
+SEARCH_INDEX_ROOT = None
+# How many segments saves can add before a background merge starts.
+SEARCH_INDEX_MAX_SEGMENTS = 10
+# How many of the best text index matches the admin search box lists.
+SEARCH_INDEX_ADMIN_LIMIT = 500
+# How many related objects are stored for each content object. See apps.content.related and the
+# rebuild_related_content command.
+RELATED_CONTENT_COUNT = 10
+# Only content published within this many days of an object can be related to it.
+RELATED_CONTENT_WINDOW_DAYS = 365
+# Relatedness halves for every this many days between two objects' publish dates.
+RELATED_CONTENT_HALF_LIFE_DAYS = 30
+# What each shared author adds to the score. A shared category adds 1, and a shared parent category half that.
+RELATED_CONTENT_AUTHOR_WEIGHT = 1.0
+# How many candidates are scored from each of an object's categories and authors, nearest publish date first.
+RELATED_CONTENT_CANDIDATES = 200
+# How many items site and category feeds show. See apps.content.feeds.
+FEED_ITEMS = 50
+# How long a feed stays cached. Feeds are patched as content changes, so this only bounds how long a renamed category
+# or author can show in one.
+FEED_CACHE_SECONDS = 60 * 60
+# The resized photo feed enclosures link to, as (width, height).
+FEED_ENCLOSURE_SIZE = (100, 100)
+# The resized versions of each image whose encoded sizes are stored when it's saved, for feed enclosure lengths.
+IMAGE_RENDITION_SIZES = (FEED_ENCLOSURE_SIZE,)
+# Where the generate_sitemaps command writes sitemaps, and the URL the web server serves that directory from.
+# See apps.content.sitemaps.
+SITEMAP_ROOT = None
+SITEMAP_URL = '/sitemaps/'
+# The most URLs in one sitemap file. The sitemap protocol allows 50,000.
+SITEMAP_SHARD_SIZE = 50000
+# How long JSON API responses are cached, in seconds. Edits drop the responses they show up in; lists are also kept
+# for a shorter time, since new content changes them. See apps.content.api.
+API_CACHE_SECONDS = 60 * 60
+API_LIST_CACHE_SECONDS = 60
+# Objects per API list page, unless limit asks for fewer or more, up to API_MAX_PAGE_SIZE.
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+# The most objects one ?ids= request can fetch.
+API_MAX_IDS = 100
 
 # eprise cache default settings
 CACHE_BACKEND = 'memcached://127.0.0.1:11211/'
 CACHE_MIDDLEWARE_SECONDS = 60 * 3 # 3 minutes
 CACHE_LONG_SECONDS = 60 * 60 * 24 * 14 # 2 weeks max memcache
 
+# Admin changelists with estimated counts use the Postgres planner's row estimate at or above this many rows, and an exact COUNT(*) below it.
+ADMIN_COUNT_ESTIMATE_THRESHOLD = 100000
+# How long changelist counts are cached, per filter combination.
+ADMIN_COUNT_CACHE_SECONDS = 60 * 5
+
 SESSION_SAVE_EVERY_REQUEST = False
 
+# Request instrumentation. Query counting counts and times each request's queries, without keeping their SQL;
+# the log line goes to the griffoncms.stats logger. Histograms are served per process at /_stats/.
+REQUEST_STATS_QUERIES = True
+REQUEST_STATS_LOG = True
+# Add apps.utilities.stats.middleware.QueryInspectorMiddleware to MIDDLEWARE_CLASSES to log requests that run the same
+# query shape from the same line this many times or more.
+QUERY_INSPECTOR_THRESHOLD = 5
+# Staff can profile any page with ?profile. Profiles are saved here, and the sampling profiler looks at the stack this often, in seconds.
+PROFILE_ROOT = os.path.join(os.path.dirname(__file__), "profiles")
+PROFILE_SAMPLE_INTERVAL = 0.005
+
 # eprise middleware
 # middleware may not be added to anywhere else for CMS sites
 # middleware may be overridden at cluster or site level if needed
 MIDDLEWARE_CLASSES = (
+    'apps.utilities.stats.middleware.RequestStatsMiddleware',
+    # Runs the baking and indexing saves defer, after TransactionMiddleware commits.
+    'apps.utilities.deferred.middleware.DeferredWorkMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -90,7 +192,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.gzip.GZipMiddleware',
     'django.middleware.transaction.TransactionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-
+    'apps.utilities.stats.middleware.ProfilerMiddleware',
 
 )
 
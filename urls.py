@@ -8,6 +8,7 @@ urlpatterns = patterns('',
     url(r'^gfmedia/', include('apps.media_library.urls')),
     url(r'^admin/', include(admin.site.urls)),
     url(r'^static/(.*)$', 'django.views.static.serve', kwargs={'document_root': 'static'}),
+    url(r'^_stats/$', 'apps.utilities.stats.views.stats_view', name="request_stats"),
     url(r'^', include('apps.content.urls')),
     
 )